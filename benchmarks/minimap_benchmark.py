@@ -0,0 +1,83 @@
+# Benchmark of the minimap rendering, for developpers
+# usage : python benchmarks/minimap_benchmark.py [paragraph_count ...]
+# set QT_QPA_PLATFORM=offscreen to run it without a display
+import os
+import sys
+import time
+
+# not shipped with plume, the plume modules are found in src/plume :
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "plume"))
+
+
+def build_document(paragraph_count, width=500):
+    from PyQt5.QtGui import QTextDocument
+
+    paragraph = "Lorem ipsum dolor sit amet,\tconsectetur adipiscing elit, sed do " \
+        "eiusmod tempor incididunt ut labore et dolore magna aliqua. "
+    # distinct paragraphs, none is reused from another one :
+    text = "\n".join("%d. %s" % (i, paragraph * (1 + i % 4)) for i in range(paragraph_count))
+    document = QTextDocument()
+    document.setPlainText(text)
+    document.setTextWidth(width)
+    # lay out all the blocks :
+    document.size()
+    return document
+
+
+def bench(paragraph_count, width=500):
+    from PyQt5.QtGui import QFontMetrics, QTextCursor
+    from gui.writingzone.minimap import Minimap, MinimapLayout, ImageGenerator, \
+        block_image_cache, changed_block_range, tab_chars
+
+    document = build_document(paragraph_count, width)
+    tab = tab_chars(QFontMetrics(document.defaultFont()))
+    tile_height = Minimap.tile_height
+
+    layout = MinimapLayout()
+    layout.reset(document.blockCount())
+    start = time.perf_counter()
+    layout.fill(document, width, tab)
+    layout_time = time.perf_counter() - start
+
+    def render_window(first_tile, tile_count):
+        for tile_index in range(first_tile, first_tile + tile_count):
+            item_list, top = layout.items_between(tile_index * tile_height,
+                                                  (tile_index + 1) * tile_height)
+            generator.render_tile(item_list, top, tile_height)
+
+    # the visible part, in the middle of the sheet :
+    middle_tile = layout.height // 2 // tile_height
+    block_image_cache.clear()
+    generator = ImageGenerator()
+    start = time.perf_counter()
+    render_window(middle_tile, 3)
+    render_time = time.perf_counter() - start
+
+    # every block image is reused :
+    start = time.perf_counter()
+    render_window(middle_tile, 3)
+    rerender_time = time.perf_counter() - start
+
+    # one word typed in the middle, only its block is read, and its tile drawn :
+    middle = paragraph_count // 2
+    position = document.findBlockByNumber(middle).position()
+    QTextCursor(document.findBlockByNumber(middle)).insertText("word ")
+    start = time.perf_counter()
+    head, tail = changed_block_range(document, position, len("word "))
+    layout.apply_change(head, tail, document.blockCount())
+    top, _ = layout.fill(document, width, tab)
+    render_window(top // tile_height, 1)
+    edit_time = time.perf_counter() - start
+
+    print("%6d paragraphs, %6d px high : layout %.3fs, 3 tiles %.3fs, again %.3fs, edit %.4fs"
+          % (paragraph_count, layout.height, layout_time, render_time, rerender_time, edit_time))
+    print("       ", block_image_cache)
+
+
+if __name__ == '__main__':
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication(sys.argv)
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 5000, 20000]
+    for count in counts:
+        bench(count)
@@ -8,6 +8,7 @@ from . import subscriber, cfg
 from .project import Project
 from .plugins import Plugins
 from .tree_sheet import TreeSheetManager
+from .document_registry import DocumentRegistry
 
 
 class Core(QObject):
@@ -30,6 +31,7 @@ class Core(QObject):
         self.plugins = Plugins()
         cfg.core_plugins = self.plugins
         self.tree_sheet_manager = TreeSheetManager()
+        self.document_registry = DocumentRegistry(self)
         self.write_panel_core = WritePanelCore(self)
 
 
@@ -51,6 +53,24 @@ class WritePanelCore(QObject):
         self._class_to_instanciate_dict = {}
         # fill it with plugins
         self._class_to_instanciate_dict = cfg.core_plugins.write_panel_dock_plugin_dict
+        # sheets selected in the write tree
+        self._selected_sheet_ids = ()
+
+    @property
+    def selected_sheet_ids(self):
+        return self._selected_sheet_ids
+
+    def set_selected_sheet_ids(self, sheet_ids):
+        '''
+        function:: set_selected_sheet_ids(sheet_ids)
+        :param sheet_ids: iterable of sheet_id
+        Announce "core.write_panel.selection" if it changes
+        '''
+        sheet_ids = tuple(sheet_ids)
+        if sheet_ids == self._selected_sheet_ids:
+            return
+        self._selected_sheet_ids = sheet_ids
+        subscriber.announce_update("core.write_panel.selection")
 
     def get_instance_of(self, instance_name):
         if instance_name in self._object_dict.keys():
@@ -0,0 +1,212 @@
+'''
+Created on 2 june 2015
+
+@author:  Cyril Jacquet
+'''
+from PyQt5.QtCore import QObject
+from PyQt5.QtGui import QTextDocument
+from PyQt5.Qt import Qt
+from . import cfg
+
+
+class DocumentRegistry(QObject):
+
+    '''
+    DocumentRegistry
+    One QTextDocument per (sheet_id, field), shared by all the views showing
+    it. field is "content" or an other content, like "synopsis".
+    '''
+
+    def __init__(self, parent=None):
+        '''
+        Constructor
+        '''
+
+        super(DocumentRegistry, self).__init__(parent)
+
+        # (sheet_id, field) -> SharedDocument
+        self._shared_document_dict = {}
+
+        cfg.data.subscriber.subscribe_update_func_to_domain(
+            self.clear,  "data.project.close")
+
+    def acquire(self, sheet_id, field):
+        '''
+        function:: acquire(sheet_id, field)
+        :param sheet_id:
+        :param field: "content" or an other content, like "synopsis"
+        :rtype: QTextDocument, to give to QTextEdit.setDocument()
+
+        Every acquire() must be followed by a release() when the view closes.
+        The edits are saved by the registry.
+        '''
+        key = (sheet_id, field)
+        shared_document = self._shared_document_dict.get(key)
+        if shared_document is None:
+            shared_document = SharedDocument(self, sheet_id, field)
+            self._shared_document_dict[key] = shared_document
+        shared_document.ref_count += 1
+        return shared_document.document
+
+    def release(self, sheet_id, field):
+        '''
+        function:: release(sheet_id, field)
+        :param sheet_id:
+        :param field:
+
+        The document is saved and deleted when its last view releases it
+        '''
+        key = (sheet_id, field)
+        shared_document = self._shared_document_dict.get(key)
+        if shared_document is None:
+            return
+        shared_document.ref_count -= 1
+        if shared_document.ref_count > 0:
+            return
+        del self._shared_document_dict[key]
+        shared_document.flush()
+        shared_document.close()
+
+    def ref_count(self, sheet_id, field):
+        shared_document = self._shared_document_dict.get((sheet_id, field))
+        if shared_document is None:
+            return 0
+        return shared_document.ref_count
+
+    def flush_document(self, sheet_id, field):
+        '''
+        function:: flush_document(sheet_id, field)
+        :param sheet_id:
+        :param field:
+
+        Save now the buffered edits of this document, if any
+        '''
+        shared_document = self._shared_document_dict.get((sheet_id, field))
+        if shared_document is not None:
+            shared_document.flush()
+
+    def flush_all(self):
+        for shared_document in self._shared_document_dict.values():
+            shared_document.flush()
+
+    def clear(self):
+        '''
+        function:: clear()
+
+        Delete all the documents, without saving. For a closed project
+        '''
+        for shared_document in self._shared_document_dict.values():
+            shared_document.close()
+        self._shared_document_dict = {}
+
+
+class SharedDocument(QObject):
+
+    '''
+    SharedDocument
+    '''
+
+    def __init__(self, parent, sheet_id, field):
+        '''
+        Constructor
+        '''
+
+        super(SharedDocument, self).__init__(parent)
+
+        self.sheet_id = sheet_id
+        self.field = field
+        self.ref_count = 0
+
+        # loaded while the sheet isn't opened in the manager, only used by
+        # this document. See _tree_sheet()
+        self._own_tree_sheet = None
+
+        # last html read or saved, to ignore the announcements of own saves
+        self._saved_text = self._read()
+        self._is_loading = False
+        self.document = QTextDocument(self)
+        self._load(self._saved_text)
+        self.document.contentsChanged.connect(self._mark_dirty)
+
+        if field == "content":
+            domain = "data.tree.content"
+        else:
+            domain = "data.tree.other_contents"
+        cfg.data.subscriber.subscribe_update_func_to_domain(
+            self.reload,  domain,  sheet_id)
+
+    def reload(self):
+        '''
+        function:: reload()
+
+        Load the stored text, if written by someone else
+        '''
+        text = self._read()
+        if text == self._saved_text:
+            return
+        self._saved_text = text
+        self._load(text)
+
+    def flush(self):
+        # the edits may be buffered by both sheets, if the manager opened the
+        # sheet after this document :
+        tree_sheet_manager = cfg.core.tree_sheet_manager
+        for tree_sheet in (tree_sheet_manager.get_tree_sheet_from_sheet_id(self.sheet_id),
+                           self._own_tree_sheet):
+            if tree_sheet is None:
+                continue
+            if self.field == "content":
+                tree_sheet.flush_content()
+            else:
+                tree_sheet.flush_other_contents()
+
+    def close(self):
+        cfg.data.subscriber.unsubscribe_update_func(self.reload)
+        if self._own_tree_sheet is not None:
+            self._own_tree_sheet._subscribe_to_data(False)
+            self._own_tree_sheet.deleteLater()
+            self._own_tree_sheet = None
+        self.document.deleteLater()
+        self.deleteLater()
+
+    def _tree_sheet(self):
+        # looked up at each use : the manager pools its closed sheets and
+        # deletes the evicted ones, while this document lives on
+        tree_sheet = cfg.core.tree_sheet_manager.get_tree_sheet_from_sheet_id(self.sheet_id)
+        if tree_sheet is not None:
+            return tree_sheet
+        if self._own_tree_sheet is None:
+            self._own_tree_sheet = cfg.core.tree_sheet_manager.only_load_sheet(self.sheet_id)
+        return self._own_tree_sheet
+
+    def _read(self):
+        if self.field == "content":
+            text = self._tree_sheet().get_content()
+        else:
+            text = self._tree_sheet().get_other_contents().get(self.field)
+        if text is None:
+            return ""
+        return text
+
+    def _load(self, text):
+        self._is_loading = True
+        # like QTextEdit.setText() :
+        if Qt.mightBeRichText(text):
+            self.document.setHtml(text)
+        else:
+            self.document.setPlainText(text)
+        self.document.setModified(False)
+        self._is_loading = False
+
+    def _mark_dirty(self):
+        if self._is_loading:
+            return
+        # serialized only when the tree sheet flushes :
+        if self.field == "content":
+            self._tree_sheet().mark_content_dirty(self._provide_text)
+        else:
+            self._tree_sheet().mark_other_content_dirty(self.field, self._provide_text)
+
+    def _provide_text(self):
+        self._saved_text = self.document.toHtml()
+        return self._saved_text
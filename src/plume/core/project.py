@@ -20,10 +20,10 @@ class Project():
         '''
 
         super(Project, self).__init__()
-        cfg.data.subscriber.subscribe_update_func_to_domain(
-            self.signal_project_is_saved, "data.project.saved")
-        cfg.data.subscriber.subscribe_update_func_to_domain(
-            self.signal_project_is_not_saved, "data.project.notsaved")
+        # delivered in the same pass as their "data" counterparts :
+        subscriber.bridge_domains("data.project.saved", "core.project.saved")
+        subscriber.bridge_domains(
+            "data.project.notsaved", "core.project.notsaved")
 
     @pyqtSlot()
     def open_test_project(self):
@@ -48,7 +48,7 @@ class Project():
         function:: save()
         :param :
         '''
-
+        cfg.core.tree_sheet_manager.flush_all_sheets()
         cfg.data.project.save()
 
     def save_as(self, file_name, file_type):
@@ -58,6 +58,7 @@ class Project():
         :param file_type:
         :param :
         '''
+        cfg.core.tree_sheet_manager.flush_all_sheets()
         cfg.data.project.save_as(file_name, file_type)
 
     def close_project(self):
@@ -73,6 +74,7 @@ class Project():
         :param :
         Clear all project from core
         '''
+        cfg.core.tree_sheet_manager.flush_all_sheets()
         cfg.data.project.close_db()
         subscriber.announce_update("core.project.close")
 
@@ -104,9 +106,3 @@ class Project():
 
     def is_open(self):
         return cfg.data.project.is_open()
-
-    def signal_project_is_saved(self):
-        subscriber.announce_update("core.project.saved")
-
-    def signal_project_is_not_saved(self):
-        subscriber.announce_update("core.project.notsaved")
@@ -2,27 +2,28 @@
 Created on 6 mai 2015
 
 @author:  Cyril Jacquet
+
+Core view of the event bus living in data.subscriber : "core.*" domains are
+announced and delivered on the same bus as the "data.*" ones.
 '''
 
-_update_funcs = []
-_disabled_funcs = []
-_domain_list = []
+from . import cfg
 
 
-def subscribe_update_func_to_domain(func, domain, sheet_id=None):
+def subscribe_update_func_to_domain(func, domain, sheet_id=None, delivery="inline", result_func=None,
+                                    pass_sheet_id=False, pass_detail=False):
     '''
     function:: subscribe_update_func_to_domain(func, domain)
     :param func:
-    :param domain: string like "data.tree.properties"
+    :param domain: string like "core.project.load"
     :param sheet_id: int. optional. if present, can narrow_down the update.
+    :param delivery: "inline" (default) or "worker", see data.subscriber
+    :param result_func: optional. GUI-thread receiver of a "worker" func result
+    :param pass_sheet_id: if True, func(sheet_id) is called
+    :param pass_detail: if True, func(sheet_id, detail) is called
     '''
-    has_already_update_function = False
-
-    for update_function in _update_funcs:
-        if update_function.function is func and update_function.domain is domain:
-            has_already_update_function = True
-    if has_already_update_function is False:
-        _update_funcs.append(UpdateFunction(func, domain, sheet_id))
+    cfg.data.subscriber.subscribe_update_func_to_domain(
+        func, domain, sheet_id, delivery, result_func, pass_sheet_id, pass_detail)
 
 
 def unsubscribe_update_func(func):
@@ -30,65 +31,48 @@ def unsubscribe_update_func(func):
     function:: unsubscribe_update_func(func)
     :param func:
     '''
-    for update_function in _update_funcs:
-        if update_function.function == func:
-            _update_funcs.remove(update_function)
+    cfg.data.subscriber.unsubscribe_update_func(func)
+
+
+def unsubscribe_update_func_from_domain(func, domain):
+    '''
+    function:: unsubscribe_update_func_from_domain(func, domain)
+    :param func:
+    :param domain:
+    '''
+    cfg.data.subscriber.unsubscribe_update_func_from_domain(func, domain)
 
 
 def disable_func(func):
-    for update_function in _update_funcs:
-        if update_function.function == func:
-            _update_funcs.remove(update_function)
-            _disabled_funcs.append(update_function)
+    cfg.data.subscriber.disable_func(func)
 
 
 def enable_func(func):
-    for update_function in _update_funcs:
-        if update_function.function == func:
-            _disabled_funcs.remove(update_function)
-            _update_funcs.append(update_function)
+    cfg.data.subscriber.enable_func(func)
 
 
-def announce_update(domain, sheet_id=-1):
+def bridge_domains(source_domain, target_domain):
+    '''
+    function:: bridge_domains(source_domain, target_domain)
+    :param source_domain: ex: "data.project.saved"
+    :param target_domain: ex: "core.project.saved"
+    '''
+    cfg.data.subscriber.bridge_domains(source_domain, target_domain)
+
+
+def announce_update(domain, sheet_id=-1, detail=None):
     '''
     function:: announce_update(domain)
     :param domain:
     :param sheet_id: int. optional. if present, can narrow_down the update.
+    :param detail: optional. ex: the key of a changed property
     '''
-    for update_function in _update_funcs:
-        if update_function.domain == domain and update_function.sheet_id == sheet_id:
-            update_function.function()
-        # for the subscriber interested by all updates from every sheet:
-        if update_function.domain == domain and update_function.sheet_id == None:
-            f = update_function.function
-            f()
-
+    cfg.data.subscriber.announce_update(domain, sheet_id, detail)
 
-class UpdateFunction():
 
+def statistics():
     '''
-    UpdateFunction
+    function:: statistics()
+    :rtype: dict namespace -> NamespaceStatistics
     '''
-
-    def __init__(self, function, domain, sheet_id=None):
-        '''
-        Constructor
-        '''
-
-        super(UpdateFunction, self).__init__()
-
-        self._function = function
-        self._domain = domain
-        self._sheet_id = sheet_id
-
-    @property
-    def function(self):
-        return self._function
-
-    @property
-    def domain(self):
-        return self._domain
-
-    @property
-    def sheet_id(self):
-        return self._sheet_id
+    return cfg.data.subscriber.statistics()
@@ -0,0 +1,69 @@
+import sqlite3
+import types
+import unittest
+
+from core import cfg
+from core.tree_sheet import TreeSheet
+from data import subscriber
+from data.tree import Tree
+
+
+class Test_TreeSheet(unittest.TestCase):
+
+    def setUp(self):
+        self.database = sqlite3.connect(":memory:")
+        cursor = self.database.cursor()
+        cursor.execute("CREATE TABLE other_sheet_contents (other_sheet_contents_id INTEGER PRIMARY KEY \
+        AUTOINCREMENT UNIQUE NOT NULL, synopsis NONE)")
+        cursor.execute("CREATE TABLE main_table (sheet_id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, \
+        title TEXT, tree TEXT, content NONE, content_type TEXT, other_sheet_contents_id INTEGER \
+        REFERENCES other_sheet_contents (other_sheet_contents_id), creation_date DATETIME, \
+        modification_date DATETIME, properties TEXT, parent_id INTEGER, children_id TEXT, \
+        version INTEGER, is_root BOOLEAN DEFAULT False)")
+        cursor.execute("INSERT INTO main_table (sheet_id, title, tree, is_root) VALUES (0, 'root', 'write', 1)")
+        self.database.commit()
+
+        tree = Tree()
+        tree.db = self.database
+        self.sheet_id = tree.create_new_sheet(0, "write")
+        tree.set_content(self.sheet_id, "old")
+
+        self._old_cfg = (cfg.data, cfg.core_plugins)
+        cfg.data = types.SimpleNamespace(main_tree=tree, subscriber=subscriber)
+        cfg.core_plugins = types.SimpleNamespace(write_tab_dock_plugin_dict={})
+        self.sheet = TreeSheet(sheet_id=self.sheet_id)
+        self.read_list = []
+
+    def tearDown(self):
+        subscriber.unsubscribe_update_func(self.read_content)
+        self.sheet._subscribe_to_data(False)
+        cfg.data, cfg.core_plugins = self._old_cfg
+        self.database.close()
+
+    def read_content(self):
+        self.read_list.append(self.sheet.get_content())
+
+    def test_announced_content_is_new(self):
+        # subscribed before the sheet caches the content, so called before
+        # the sheet uncaches it :
+        subscriber.subscribe_update_func_to_domain(self.read_content, "data.tree.content",
+                                                   self.sheet_id)
+        self.assertEqual(self.sheet.get_content(), "old")
+
+        self.sheet.set_content("new")
+        self.assertEqual(self.read_list, ["new"])
+        self.assertEqual(self.sheet.get_content(), "new")
+
+    def test_flushed_content_is_new(self):
+        subscriber.subscribe_update_func_to_domain(self.read_content, "data.tree.content",
+                                                   self.sheet_id)
+        self.assertEqual(self.sheet.get_content(), "old")
+
+        self.sheet.mark_content_dirty(lambda: "edited")
+        self.sheet.flush_content()
+        self.assertEqual(self.read_list, ["edited"])
+        self.assertEqual(cfg.data.main_tree.get_content(self.sheet_id), "edited")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,8 +4,10 @@ Created on 6 mai 2015
 @author:  Cyril Jacquet
 '''
 from . import subscriber, cfg
-from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtCore import QObject, pyqtSignal, QTimer
 from _csv import Error
+from collections import OrderedDict
+from functools import partial
 
 
 class TreeSheetError(OSError):
@@ -24,7 +26,24 @@ class TreeSheet(QObject):
 
     '''
     TreeSheet
+    Every field is loaded from the tree on first access, then cached until the
+    data announces a change of this field for this sheet.
     '''
+    # idle time (ms) after the last edit before a dirty content is persisted
+    content_flush_delay = 1000
+    # field -> data domain(s) announcing its changes
+    field_domain_dict = {"title": "data.tree.title",
+                         "content": "data.tree.content",
+                         "content_type": "data.tree.content_type",
+                         "other_contents": "data.tree.other_contents",
+                         "properties": ("data.tree.properties",
+                                        "data.tree.property.value",
+                                        "data.tree.property.key",
+                                        "data.tree.property.removed"),
+                         "modification_date": "data.tree.modification_date",
+                         "creation_date": "data.tree.creation_date",
+                         "version": "data.tree.version",
+                         }
 
     def __init__(self, parent=None, sheet_id=None):
         '''
@@ -34,18 +53,23 @@ class TreeSheet(QObject):
         super(TreeSheet, self).__init__(parent)
 
         self.sheet_id = sheet_id
-        self._content = None
-        self._other_contents = None
-        self._content_type = ""
-        self._creation_date = ""
-        self._last_modification_date = ""
-        self._properties = {}
+        # field -> value, only for the loaded fields
+        self._field_cache = {}
+        # field -> function uncaching it, subscribed once the field is loaded
+        self._uncache_funcs = {}
         self.parent_id = None
         self.children_id = []
-        self._version = -1
 
-        if sheet_id is not None:
-            self.load()
+        # write-behind buffer of the content :
+        self._content_provider = None
+        self._content_flush_timer = QTimer(self)
+        self._content_flush_timer.setSingleShot(True)
+        self._content_flush_timer.timeout.connect(self.flush_content)
+        # key -> callable returning the value, like "synopsis" for its dock
+        self._other_content_providers = {}
+        self._other_contents_flush_timer = QTimer(self)
+        self._other_contents_flush_timer.setSingleShot(True)
+        self._other_contents_flush_timer.timeout.connect(self.flush_other_contents)
 
         # dict of instances, like for core_part of docks
         self._object_dict = {}
@@ -54,41 +78,79 @@ class TreeSheet(QObject):
         # fill it with plugins
         self._class_to_instanciate_dict = cfg.core_plugins.write_tab_dock_plugin_dict
 
-        self._subscribe_to_data()
-
     def load(self):
-        # fill the sheet :
-
-        self._content = cfg.data.main_tree.get_content(self.sheet_id)
-        self._title = cfg.data.main_tree.get_title(self.sheet_id)
-        self._content_type = cfg.data.main_tree.get_content_type(self.sheet_id)
-        self._other_contents = cfg.data.main_tree.get_other_contents(
-            self.sheet_id)
-        self._properties = cfg.data.main_tree.get_properties(self.sheet_id)
-        self._last_modification_date = cfg.data.main_tree.get_modification_date(
-            self.sheet_id)
-        self._creation_date = cfg.data.main_tree.get_creation_date(
-            self.sheet_id)
-        self._version = cfg.data.main_tree.get_version(self.sheet_id)
+        '''
+        function:: load()
+
+        Fill all the fields of the sheet at once
+        '''
+        self.prefetch(self.field_domain_dict.keys())
+
+    def prefetch(self, fields):
+        '''
+        function:: prefetch(fields)
+        :param fields: iterable of field names, like ("title", "properties")
+
+        Hint for callers knowing what they need : the missing fields are read
+        together, instead of one query per first access.
+        '''
+        missing_fields = [field for field in fields
+                          if field not in self._field_cache]
+        if missing_fields == []:
+            return
+        for field, value in cfg.data.main_tree.get_fields(self.sheet_id, missing_fields).items():
+            self._cache_field(field, value)
+
+    def _get_field(self, field):
+        try:
+            return self._field_cache[field]
+        except KeyError:
+            value = cfg.data.main_tree.get_fields(
+                self.sheet_id, [field])[field]
+            self._cache_field(field, value)
+            return value
+
+    def _cache_field(self, field, value):
+        self._field_cache[field] = value
+        if field not in self._uncache_funcs:
+            uncache_func = partial(self._uncache_field, field)
+            self._uncache_funcs[field] = uncache_func
+            domains = self.field_domain_dict[field]
+            if isinstance(domains, str):
+                domains = (domains,)
+            for domain in domains:
+                cfg.data.subscriber.subscribe_update_func_to_domain(
+                    uncache_func, domain, self.sheet_id)
+            if field == "properties":
+                # announced for several sheets at once :
+                self._uncache_funcs["properties.batch"] = self._uncache_batched_properties
+                cfg.data.subscriber.subscribe_update_func_to_domain(
+                    self._uncache_batched_properties, "data.tree.property.batch", pass_detail=True)
+
+    def _uncache_field(self, field):
+        self._field_cache.pop(field, None)
+
+    def _uncache_batched_properties(self, _, sheet_ids_change):
+        if self.sheet_id in sheet_ids_change[0]:
+            self._uncache_field("properties")
+
+    def is_loaded(self, field):
+        return field in self._field_cache
 
     def _subscribe_to_data(self,  is_subscribing=True):
+        '''
+        function:: _subscribe_to_data(is_subscribing=True)
+        :param is_subscribing: if False, drop the cache and every subscription
 
-        list_ = [[self.get_title, "data.tree.title"],
-                 [self.get_content, "data.tree.content"],
-                 [self.get_other_contents, "data.tree.other_contents"],
-                 [self.get_content_type, "data.tree.content_type"],
-                 [self.get_properties, "data.tree.properties"],
-                 [self.get_modification_date, "data.tree.modification_date"],
-                 [self.get_creation_date, "data.tree.creation_date"],
-                 [self.get_properties, "data.tree.properties"],
-                 [self.get_version, "data.tree.version"],
-                 ]
-        for func, domain in list_:
-            if is_subscribing is True:
-                cfg.data.subscriber.subscribe_update_func_to_domain(
-                    func, domain)
-            else:
-                cfg.data.subscriber.unsubscribe_update_func_to_domain(func)
+        Subscriptions are made field by field, when a field is cached.
+        '''
+        if is_subscribing is True:
+            return
+
+        for uncache_func in self._uncache_funcs.values():
+            cfg.data.subscriber.unsubscribe_update_func(uncache_func)
+        self._uncache_funcs = {}
+        self._field_cache = {}
 
     def get_instance_of(self, instance_name):
         if instance_name in self._object_dict.keys():
@@ -100,10 +162,12 @@ class TreeSheet(QObject):
         return instance
 
     def get_title(self):
-        return cfg.data.main_tree.get_title(self.sheet_id)
+        return self._get_field("title")
 
     def set_title(self, new_title):
         cfg.data.main_tree.set_title(self.sheet_id, new_title)
+        # after the announcement, which uncached the title :
+        self._cache_field("title", new_title)
 
     def get_content(self):
         '''
@@ -112,25 +176,67 @@ class TreeSheet(QObject):
         :rtype: content
 
         '''
-        content = cfg.data.main_tree.get_content(self.sheet_id)
-        return content
+        self.flush_content()
+        return self._get_field("content")
 
     def set_content(self, content):
         '''
         function:: set_content(self, content)
         :param content:
         '''
+        # a direct write replaces any buffered one :
+        self._content_provider = None
+        self._content_flush_timer.stop()
+        self._store_content(content)
 
+    def mark_content_dirty(self, content_provider):
+        '''
+        function:: mark_content_dirty(self, content_provider)
+        :param content_provider: callable returning the content. Only called
+        when the content is flushed, not at each edit.
+
+        Cheap enough to be called at each keystroke : the content is persisted
+        after content_flush_delay ms of idle, or by flush_content().
+        '''
+        was_dirty = self.is_content_dirty()
+        self._content_provider = content_provider
+        self._content_flush_timer.start(self.content_flush_delay)
+        if not was_dirty:
+            subscriber.announce_update("core.project.notsaved")
+
+    def is_content_dirty(self):
+        return self._content_provider is not None
+
+    def flush_content(self):
+        '''
+        function:: flush_content(self)
+
+        Serialize and persist the buffered content, if any.
+        '''
+        self._content_flush_timer.stop()
+        if self._content_provider is None:
+            return
+        content_provider = self._content_provider
+        self._content_provider = None
+        content = content_provider()
+        if not self.is_loaded("content") or content != self._field_cache["content"]:
+            self._store_content(content)
+
+    def _store_content(self, content):
+        # the subscribers reading it during the announcement get the new value :
+        self._uncache_field("content")
         cfg.data.main_tree.set_content(self.sheet_id, content)
+        # after the announcement, which uncached the content :
+        self._cache_field("content", content)
 
     def get_other_contents(self):
         '''
         function:: get_other_contents(self)
-        :rtype other_contents:
+        :rtype other_contents: a copy, free to be modified
 
         '''
-        other_contents = cfg.data.main_tree.get_other_contents(self.sheet_id)
-        return other_contents
+        self.flush_other_contents()
+        return dict(self._get_field("other_contents"))
 
     def _set_other_contents(self, dict_):
         '''
@@ -138,15 +244,63 @@ class TreeSheet(QObject):
 
         '''
         cfg.data.main_tree.set_other_contents(self.sheet_id, dict_)
+        self._cache_field("other_contents", dict(dict_))
 
     def set_other_content(self, key,  value):
         '''
         function:: set_other_content(self, key, value)
 
         '''
-        dict_ = self.get_other_contents()
+        # a direct write replaces any buffered one :
+        self._other_content_providers.pop(key, None)
+        self._store_other_content(key, value)
+
+    def mark_other_content_dirty(self, key, content_provider):
+        '''
+        function:: mark_other_content_dirty(self, key, content_provider)
+        :param key: ex: "synopsis"
+        :param content_provider: callable returning the value. Only called
+        when the other contents are flushed, not at each edit.
+
+        Like mark_content_dirty(), for one of the other contents
+        '''
+        was_dirty = self.is_other_content_dirty()
+        self._other_content_providers[key] = content_provider
+        self._other_contents_flush_timer.start(self.content_flush_delay)
+        if not was_dirty:
+            subscriber.announce_update("core.project.notsaved")
+
+    def is_other_content_dirty(self, key=None):
+        if key is None:
+            return self._other_content_providers != {}
+        return key in self._other_content_providers
+
+    def flush_other_contents(self):
+        '''
+        function:: flush_other_contents(self)
+
+        Serialize and persist the buffered other contents, if any. Only the
+        changed fields are written.
+        '''
+        self._other_contents_flush_timer.stop()
+        if self._other_content_providers == {}:
+            return
+        content_providers = self._other_content_providers
+        self._other_content_providers = {}
+        for key, content_provider in content_providers.items():
+            self._store_other_content(key, content_provider())
+
+    def _store_other_content(self, key, value):
+        dict_ = self._get_field("other_contents")
+        if key in dict_ and dict_[key] == value:
+            return
+        dict_ = dict(dict_)
         dict_[key] = value
-        self._set_other_contents(dict_)
+        # the subscribers reading it during the announcement get the new value :
+        self._uncache_field("other_contents")
+        cfg.data.main_tree.set_other_content(self.sheet_id, key, value)
+        # after the announcement, which uncached the other contents :
+        self._cache_field("other_contents", dict_)
 
     def get_content_type(self):
         '''
@@ -154,8 +308,7 @@ class TreeSheet(QObject):
         :rtype content_type:
 
         '''
-        content_type = cfg.data.main_tree.get_content_type(self.sheet_id)
-        return content_type
+        return self._get_field("content_type")
 
     def set_content_type(self, content_type):
         '''
@@ -168,10 +321,14 @@ class TreeSheet(QObject):
     def get_properties(self):
         '''
         function:: get_properties()
-        :rtype properties_dict:
+        :rtype properties_dict: a copy, free to be modified
 
         '''
-        return cfg.data.main_tree.get_properties(self.sheet_id)
+        return dict(self._get_field("properties"))
+
+    def _set_properties(self, properties):
+        cfg.data.main_tree.set_properties(self.sheet_id, properties)
+        self._cache_field("properties", properties)
 
     def set_property(self, key, value):
         '''
@@ -179,31 +336,29 @@ class TreeSheet(QObject):
         :param key:
         :param value:
         '''
-        self._properties[key] = value
-        cfg.data.main_tree.set_properties(self.sheet_id, self._properties)
+        cfg.data.main_tree.set_property(self.sheet_id, key, value)
 
     def change_property_key(self, key, new_key):
         '''
         function:: change_property_key(key, new_key):
-        :param key:
+        :param key: if missing, new_key is added with an empty value
         :param new_key:
         '''
-        if key not in self._properties.keys():
-            value = ""
-        else:
-            value = self._properties.pop(key)
+        cfg.data.main_tree.rename_property_key(self.sheet_id, key, new_key)
 
-        self._properties[new_key] = value
-        cfg.data.main_tree.set_properties(self.sheet_id, self._properties)
+    def remove_property(self, key):
+        '''
+        function:: remove_property(key):
+        :param key:
+        '''
+        cfg.data.main_tree.remove_property(self.sheet_id, key)
 
     def get_modification_date(self):
         '''
         function:: get_modification_date(self)
         :rtype modification_date:
         '''
-        modification_date = cfg.data.main_tree.get_modification_date(
-            self.sheet_id)
-        return modification_date
+        return self._get_field("modification_date")
 
     def set_modification_date(self, date):
         '''
@@ -217,8 +372,7 @@ class TreeSheet(QObject):
         :rtype creation_date:
 
         '''
-        creation_date = cfg.data.main_tree.get_creation_date(self.sheet_id)
-        return creation_date
+        return self._get_field("creation_date")
 
     def set_creation_date(self, date):
         '''
@@ -234,8 +388,63 @@ class TreeSheet(QObject):
         :rtype version:
 
         '''
-        version = cfg.data.main_tree.get_version(self.sheet_id)
-        return version
+        return self._get_field("version")
+
+
+class TreeSheetView():
+
+    '''
+    TreeSheetView
+    Lightweight read-only copy of a sheet's fields, made by
+    TreeSheetManager.load_many() or iter_sheets(). Not kept up to date.
+    '''
+    __slots__ = ("sheet_id", "_field_cache")
+
+    def __init__(self, sheet_id, field_dict):
+        '''
+        Constructor
+        '''
+
+        super(TreeSheetView, self).__init__()
+
+        self.sheet_id = sheet_id
+        self._field_cache = field_dict
+
+    def _get_field(self, field):
+        try:
+            return self._field_cache[field]
+        except KeyError:  # not asked for, read it alone
+            value = cfg.data.main_tree.get_fields(
+                self.sheet_id, [field])[field]
+            self._field_cache[field] = value
+            return value
+
+    def is_loaded(self, field):
+        return field in self._field_cache
+
+    def get_title(self):
+        return self._get_field("title")
+
+    def get_content(self):
+        return self._get_field("content")
+
+    def get_content_type(self):
+        return self._get_field("content_type")
+
+    def get_other_contents(self):
+        return dict(self._get_field("other_contents"))
+
+    def get_properties(self):
+        return dict(self._get_field("properties"))
+
+    def get_modification_date(self):
+        return self._get_field("modification_date")
+
+    def get_creation_date(self):
+        return self._get_field("creation_date")
+
+    def get_version(self):
+        return self._get_field("version")
 
 
 class StoryTreeSheet(TreeSheet):
@@ -289,6 +498,8 @@ class TreeSheetManager(QObject):
     TreeSheetManager
     '''
     sheet_is_opening = pyqtSignal(TreeSheet, name='sheet_is_opening')
+    # number of recently closed sheets kept loaded
+    closed_sheet_pool_size = 8
 
     def __init__(self, parent=None):
         '''
@@ -297,16 +508,20 @@ class TreeSheetManager(QObject):
 
         super(TreeSheetManager, self).__init__(parent)
 
-        self.sheet_list = []
+        # sheet_id -> TreeSheet, in opening order
+        self._sheet_dict = {}
+        # sheet_id -> recently closed TreeSheet, least recently closed first
+        self._closed_sheet_pool = OrderedDict()
 
         cfg.data.subscriber.subscribe_update_func_to_domain(
             self.close_all_sheets,  "data.project.close")
 
+    @property
+    def sheet_list(self):
+        return list(self._sheet_dict.values())
+
     def get_tree_sheet_from_sheet_id(self, sheet_id):
-        for sheet in self.sheet_list:
-            if sheet.sheet_id == sheet_id:
-                return sheet
-        return None
+        return self._sheet_dict.get(sheet_id)
 
     def open_sheet(self, sheet_id):
         '''
@@ -315,12 +530,15 @@ class TreeSheetManager(QObject):
         :rtype: tree_sheet:
 
         '''
-        for sheet in self.sheet_list:
-            if sheet_id == sheet.sheet_id:
-                return sheet
+        tree_sheet = self._sheet_dict.get(sheet_id)
+        if tree_sheet is not None:
+            return tree_sheet
 
-        tree_sheet = self.only_load_sheet(sheet_id)
-        self.sheet_list.append(tree_sheet)
+        # reuse a recently closed sheet, already loaded :
+        tree_sheet = self._closed_sheet_pool.pop(sheet_id, None)
+        if tree_sheet is None:
+            tree_sheet = self.only_load_sheet(sheet_id)
+        self._sheet_dict[sheet_id] = tree_sheet
 
         # emit signal to Gui
         self.sheet_is_opening.emit(tree_sheet)
@@ -333,27 +551,90 @@ class TreeSheetManager(QObject):
         :param sheet_id:
         :rtype: tree_sheet:
 
-        It doesn't add the TreeSheet to the manager. Good if you want only to use a TreeSheet temporarily
+        It doesn't add the TreeSheet to the manager. Good if you want only to use a TreeSheet temporarily :
+        nothing is read until a field is asked for.
         '''
         tree_sheet = TreeSheet(parent=self, sheet_id=sheet_id)
 
         return tree_sheet
 
+    def load_many(self, sheet_ids, fields=("title", "properties")):
+        '''
+        function:: load_many(sheet_ids, fields=("title", "properties"))
+        :param sheet_ids: iterable of sheet_id
+        :param fields: field names, see TreeSheet.field_domain_dict
+        :rtype: [TreeSheetView], in the order of sheet_ids
+
+        For whole-project passes (compile, export, analysis) : the sheets are
+        read with a few bulk queries, instead of a TreeSheet each.
+        '''
+        return list(self._iter_sheet_views(sheet_ids, fields))
+
+    def iter_sheets(self, tree_type, order="document", fields=("title", "properties"), chunk_size=500):
+        '''
+        function:: iter_sheets(tree_type, order="document", fields=("title", "properties"), chunk_size=500)
+        :param tree_type: Ex : "write"
+        :param order: "document" or "id"
+        :param fields: field names, see TreeSheet.field_domain_dict
+        :param chunk_size: number of sheets read by each query
+        :rtype: generator of TreeSheetView, without the root sheet
+        '''
+        sheet_ids = cfg.data.main_tree.get_sheet_ids(tree_type, order)
+        return self._iter_sheet_views(sheet_ids, fields, chunk_size)
+
+    def _iter_sheet_views(self, sheet_ids, fields, chunk_size=500):
+        if "content" in fields:  # buffered contents first
+            self.flush_all_sheets()
+        for sheet_id, field_dict in cfg.data.main_tree.get_many_fields(sheet_ids, fields, chunk_size):
+            yield TreeSheetView(sheet_id, field_dict)
+
+    def flush_all_sheets(self):
+        '''
+        function:: flush_all_sheets()
+
+        Persist the buffered contents of every open sheet
+        '''
+        for sheet in self._sheet_dict.values():
+            sheet.flush_content()
+            sheet.flush_other_contents()
+        # the shared documents of sheets not opened here :
+        cfg.core.document_registry.flush_all()
+
     def close_sheet(self, tree_sheet):
         '''
         function:: close_sheet(tree_sheet)
         :param tree_sheet: id or TreeSheet object
+
+        The closed sheet is kept in a pool of closed_sheet_pool_size sheets,
+        until reopened or evicted.
         '''
         if isinstance(tree_sheet, int):
-            sheet_id = tree_sheet
-            for sheet in self.sheet_list:
-                if sheet_id == sheet.sheet_id:
-                    self.sheet_list.remove(tree_sheet)
+            tree_sheet = self.get_tree_sheet_from_sheet_id(tree_sheet)
+
+        if not isinstance(tree_sheet, TreeSheet):
+            return
+        if self._sheet_dict.get(tree_sheet.sheet_id) is not tree_sheet:
+            return
+        del self._sheet_dict[tree_sheet.sheet_id]
 
-        if isinstance(tree_sheet, TreeSheet):
-            self.sheet_list.remove(tree_sheet)
-            tree_sheet.deleteLater()
+        if cfg.data.main_tree.db is None:  # closed
+            self._delete_sheet(tree_sheet)
+            return
+
+        tree_sheet.flush_content()
+        tree_sheet.flush_other_contents()
+        self._closed_sheet_pool[tree_sheet.sheet_id] = tree_sheet
+        while len(self._closed_sheet_pool) > self.closed_sheet_pool_size:
+            _, evicted_sheet = self._closed_sheet_pool.popitem(last=False)
+            self._delete_sheet(evicted_sheet)
 
     def close_all_sheets(self):
         for sheet in self.sheet_list:
             self.close_sheet(sheet)
+        for sheet in self._closed_sheet_pool.values():
+            self._delete_sheet(sheet)
+        self._closed_sheet_pool.clear()
+
+    def _delete_sheet(self, tree_sheet):
+        tree_sheet._subscribe_to_data(False)
+        tree_sheet.deleteLater()
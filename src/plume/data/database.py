@@ -1,4 +1,4 @@
-from PyQt5.Qt import QObject
+from PyQt5.Qt import QObject, QCoreApplication
 from PyQt5.QtCore import pyqtSignal
 
 from .plugins import Plugins
@@ -21,3 +21,8 @@ class Database(QObject):
         self.project = Project()
         self.main_tree = Tree()
         self.plugins = Plugins()
+
+        # stop the subscribers' worker lane with the application :
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.subscriber.shutdown)
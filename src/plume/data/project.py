@@ -58,15 +58,18 @@ class Project(object):
     def load(self, file_name):
         if file_name.endswith(".sqlite"):
             old_db = sqlite3.connect(file_name)
-            new_db = sqlite3.connect(':memory:')  # create a memory database
+            # create a memory database, readable by the subscribers delivered
+            # in the worker lane (see subscriber.WorkerLane) :
+            new_db = sqlite3.connect(':memory:', check_same_thread=False)
             query = "".join(line for line in old_db.iterdump())
 
             # Dump old database in the new one.
             new_db.executescript(query)
 
-            self.db = new_db
-            cfg.data.db = self.db
-            cfg.data.main_tree.db = self.db
+            with cfg.data.main_tree.db_lock:
+                self.db = new_db
+                cfg.data.db = self.db
+                cfg.data.main_tree.db = self.db
             subscriber.announce_update("data.tree")
             subscriber.announce_update("data.project.close")
             subscriber.announce_update("data.project.load")
@@ -83,7 +86,8 @@ class Project(object):
             if os.path.exists(file_name):
                 os.remove(file_name)
             on_disk_db = sqlite3.connect(file_name)
-            query = "".join(line for line in self.db.iterdump())
+            with cfg.data.main_tree.db_lock:
+                query = "".join(line for line in self.db.iterdump())
             on_disk_db.executescript(query)
             subscriber.announce_update("data.project.saved")
             self._project_path = file_name
@@ -103,8 +107,9 @@ class Project(object):
         return self._file_type
 
     def close_db(self):
-        self.db = None
-        cfg.data.db = None
-        cfg.data.main_tree.db = None
+        with cfg.data.main_tree.db_lock:
+            self.db = None
+            cfg.data.db = None
+            cfg.data.main_tree.db = None
         subscriber.announce_update("data.project.close")
         self._is_open = False
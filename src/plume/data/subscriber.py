@@ -2,27 +2,449 @@
 Created on 6 mai 2015
 
 @author:  Cyril Jacquet
+
+One event bus shared by data, core and gui. Domains are dotted strings like
+"data.tree.properties" ; the first part is the namespace ("data", "core"...).
+Subscribers are indexed by domain, so an announcement only scans the
+subscribers of its own domain and of the domains bridged to it.
+
+A subscriber is called inline by default, on the thread announcing the
+update (the GUI thread). With delivery="worker", it is called by the
+WorkerLane thread pool instead, and its return value can be sent back to
+the GUI thread through a queued Qt signal.
 '''
+import time
+import threading
+import traceback
+from collections import OrderedDict
+from PyQt5.QtCore import QObject, QThread, Qt, pyqtSignal, pyqtSlot
+
+INLINE_DELIVERY = "inline"
+WORKER_DELIVERY = "worker"
+
+
+class EventBus():
+
+    '''
+    EventBus
+    '''
+
+    def __init__(self):
+        '''
+        Constructor
+        '''
+
+        super(EventBus, self).__init__()
+
+        # domain -> [UpdateFunction]
+        self._update_funcs = {}
+        # function -> [UpdateFunction], to unsubscribe/disable without a scan
+        self._funcs_by_function = {}
+        self._disabled_funcs = set()
+        # source domain -> [target domain]
+        self._bridges = {}
+        self._resolved_bridges = {}
+        # namespace -> NamespaceStatistics
+        self._statistics = {}
+        self._worker_lane = None
+
+    def subscribe(self, func, domain, sheet_id=None, delivery=INLINE_DELIVERY, result_func=None,
+                  pass_sheet_id=False, pass_detail=False):
+        '''
+        function:: subscribe(func, domain, sheet_id=None, delivery="inline", result_func=None, pass_sheet_id=False, pass_detail=False)
+        :param func:
+        :param domain: string like "data.tree.properties"
+        :param sheet_id: int. optional. if present, can narrow_down the update.
+        :param delivery: "inline" or "worker". A "worker" func runs outside of
+        the GUI thread : it may read the tree, but must not write to it nor
+        touch widgets. It may be called with the sheet_id -1 and the detail
+        None, for changes of any sheet, see WorkerLane.
+        :param result_func: optional, only for "worker" delivery. Called in the
+        GUI thread with the value returned by func.
+        :param pass_sheet_id: if True, func is called with the announced
+        sheet_id, so one subscriber can follow every sheet.
+        :param pass_detail: if True, func(sheet_id, detail) is called, with the
+        detail of the announcement, ex: the key of a changed property
+        '''
+        if delivery not in (INLINE_DELIVERY, WORKER_DELIVERY):
+            raise ValueError("unknown delivery: " + str(delivery))
+        for update_function in self._funcs_by_function.get(func, []):
+            if update_function.domain == domain:
+                return
+
+        update_function = UpdateFunction(
+            func, domain, sheet_id, delivery, result_func, pass_sheet_id, pass_detail)
+        self._update_funcs.setdefault(domain, []).append(update_function)
+        self._funcs_by_function.setdefault(func, []).append(update_function)
+
+    def unsubscribe(self, func, domain=None):
+        '''
+        function:: unsubscribe(func, domain=None)
+        :param func:
+        :param domain: optional. if absent, func is removed from every domain.
+        '''
+        update_functions = self._funcs_by_function.get(func, [])
+        for update_function in list(update_functions):
+            if domain is not None and update_function.domain != domain:
+                continue
+            update_functions.remove(update_function)
+            self._update_funcs[update_function.domain].remove(update_function)
+            if self._worker_lane is not None:
+                self._worker_lane.cancel(update_function)
+        if update_functions == []:
+            self._funcs_by_function.pop(func, None)
+            self._disabled_funcs.discard(func)
+
+    def disable(self, func):
+        '''
+        function:: disable(func)
+        :param func: stays subscribed, but is skipped until enable(func)
+        '''
+        if func in self._funcs_by_function:
+            self._disabled_funcs.add(func)
+
+    def enable(self, func):
+        '''
+        function:: enable(func)
+        :param func:
+        '''
+        self._disabled_funcs.discard(func)
+
+    def bridge(self, source_domain, target_domain):
+        '''
+        function:: bridge(source_domain, target_domain)
+        :param source_domain: ex: "data.project.saved"
+        :param target_domain: ex: "core.project.saved"
+
+        Subscribers of target_domain are delivered in the same pass as those
+        of source_domain, instead of re-announcing from a subscriber.
+        '''
+        targets = self._bridges.setdefault(source_domain, [])
+        if target_domain not in targets:
+            targets.append(target_domain)
+        self._resolved_bridges = {}
+
+    def unbridge(self, source_domain, target_domain):
+        '''
+        function:: unbridge(source_domain, target_domain)
+        :param source_domain:
+        :param target_domain:
+        '''
+        targets = self._bridges.get(source_domain, [])
+        if target_domain in targets:
+            targets.remove(target_domain)
+        self._resolved_bridges = {}
+
+    def _resolve_domains(self, domain):
+        '''
+        function:: _resolve_domains(domain)
+        :param domain:
+        :rtype: list of domain followed by every domain bridged to it
+        '''
+        if domain in self._resolved_bridges:
+            return self._resolved_bridges[domain]
+
+        domains = [domain]
+        for current in domains:
+            for target in self._bridges.get(current, []):
+                if target not in domains:
+                    domains.append(target)
+        self._resolved_bridges[domain] = domains
+        return domains
+
+    def announce(self, domain, sheet_id=-1, detail=None):
+        '''
+        function:: announce(domain, sheet_id=-1, detail=None)
+        :param domain:
+        :param sheet_id: int. optional. if present, can narrow_down the update.
+        :param detail: optional. passed to the pass_detail subscribers. Must be
+        hashable if some of them are delivered in the worker lane.
+        '''
+        self.get_statistics(namespace_of(domain)).announcements += 1
+        delivered = set()
+        for current_domain in self._resolve_domains(domain):
+            update_functions = self._update_funcs.get(current_domain)
+            if not update_functions:
+                continue
+            stats = self.get_statistics(namespace_of(current_domain))
+            if current_domain != domain:
+                stats.bridged_announcements += 1
+            # copy: a function can subscribe or unsubscribe while called
+            for update_function in list(update_functions):
+                func = update_function.function
+                if update_function.sheet_id is not None \
+                        and update_function.sheet_id != sheet_id:
+                    continue
+                if func in self._disabled_funcs or func in delivered:
+                    continue
+                delivered.add(func)
+                if update_function.delivery == WORKER_DELIVERY:
+                    self.worker_lane.submit(update_function, stats, sheet_id, detail)
+                    continue
+                start = time.perf_counter()
+                if update_function.pass_detail:
+                    func(sheet_id, detail)
+                elif update_function.pass_sheet_id:
+                    func(sheet_id)
+                else:
+                    func()
+                stats.deliveries += 1
+                stats.delivery_time += time.perf_counter() - start
+
+    @property
+    def worker_lane(self):
+        if self._worker_lane is None:
+            self._worker_lane = WorkerLane()
+        return self._worker_lane
+
+    def shutdown(self):
+        '''
+        function:: shutdown()
+
+        Stop the worker lane, if any. Pending worker deliveries are dropped.
+        '''
+        if self._worker_lane is not None:
+            self._worker_lane.shutdown()
+            self._worker_lane = None
+
+    def get_statistics(self, namespace):
+        '''
+        function:: get_statistics(namespace)
+        :param namespace: string like "data"
+        :rtype: NamespaceStatistics
+        '''
+        try:
+            return self._statistics[namespace]
+        except KeyError:
+            stats = NamespaceStatistics(namespace)
+            self._statistics[namespace] = stats
+            return stats
+
+    def statistics(self):
+        '''
+        function:: statistics()
+        :rtype: dict namespace -> NamespaceStatistics
+        '''
+        return dict(self._statistics)
+
+    def reset_statistics(self):
+        self._statistics = {}
+
+
+class NamespaceStatistics():
+
+    '''
+    NamespaceStatistics
+    '''
+
+    def __init__(self, namespace):
+        '''
+        Constructor
+        '''
+
+        super(NamespaceStatistics, self).__init__()
+
+        self.namespace = namespace
+        self.announcements = 0
+        self.bridged_announcements = 0
+        self.deliveries = 0
+        self.delivery_time = 0.0
+        # worker lane :
+        self.worker_submitted = 0
+        self.worker_superseded = 0
+        self.worker_coalesced = 0
+        self.worker_deliveries = 0
+        self.worker_delivery_time = 0.0
+
+    def __repr__(self):
+        return "NamespaceStatistics({0}: {1} announced, {2} bridged, {3} delivered in {4:.6f}s, " \
+            "worker: {5} submitted, {6} superseded, {7} coalesced, {8} delivered in {9:.6f}s)".format(
+                self.namespace, self.announcements, self.bridged_announcements,
+                self.deliveries, self.delivery_time, self.worker_submitted,
+                self.worker_superseded, self.worker_coalesced,
+                self.worker_deliveries, self.worker_delivery_time)
+
+
+class WorkerLane(QObject):
+
+    '''
+    WorkerLane
+    Queue of deliveries drained by a pool of threads. A delivery still
+    waiting in the queue is superseded by the same new one. Past max_pending
+    deliveries, the pending deliveries of a subscriber are coalesced into one,
+    for any sheet : func(-1), or func(-1, None) with pass_detail. Nothing is
+    dropped, and the announcing thread, which often holds the tree lock,
+    never waits for the workers.
+    '''
+    result_ready = pyqtSignal(object, object, name='result_ready')
+
+    def __init__(self, thread_count=2, max_pending=64):
+        '''
+        Constructor
+        '''
+
+        super(WorkerLane, self).__init__()
+
+        self.max_pending = max_pending
+        # (UpdateFunction, sheet_id) -> NamespaceStatistics, in submission order
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._is_running = True
+
+        # results are always delivered in the thread owning the lane :
+        self.result_ready.connect(self._deliver_result, Qt.QueuedConnection)
+
+        self._threads = []
+        for _ in range(0, thread_count):
+            thread = WorkerThread(self)
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, update_function, stats, sheet_id=-1, detail=None):
+        '''
+        function:: submit(update_function, stats, sheet_id=-1, detail=None)
+        :param update_function:
+        :param stats: NamespaceStatistics of the update_function domain
+        :param sheet_id: announced sheet_id
+        :param detail: announced detail
+        '''
+        if not update_function.pass_detail:
+            detail = None
+            if not update_function.pass_sheet_id:
+                sheet_id = None  # all announcements supersede each other
+        key = (update_function, sheet_id, detail)
+        with self._condition:
+            if not self._is_running:
+                return
+            if key in self._pending:
+                stats.worker_superseded += 1
+                return
+            if len(self._pending) >= self.max_pending:
+                coalesced_keys = [pending_key for pending_key in self._pending
+                                  if pending_key[0] is update_function]
+                if coalesced_keys != []:
+                    for coalesced_key in coalesced_keys:
+                        del self._pending[coalesced_key]
+                    stats.worker_coalesced += len(coalesced_keys)
+                    key = (update_function, key[1] if key[1] is None else -1, None)
+            self._pending[key] = stats
+            stats.worker_submitted += 1
+            self._condition.notify()
+
+    def cancel(self, update_function):
+        '''
+        function:: cancel(update_function)
+        :param update_function: removed from the queue if not yet started
+        '''
+        with self._condition:
+            for key in list(self._pending.keys()):
+                if key[0] is update_function:
+                    del self._pending[key]
+
+    def take(self):
+        '''
+        function:: take()
+        :rtype: ((UpdateFunction, sheet_id, detail), NamespaceStatistics) or None if shut down
+
+        Called by the worker threads. Block until a delivery is available.
+        '''
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._pending or not self._is_running)
+            if not self._is_running:
+                return None
+            item = self._pending.popitem(last=False)
+            # wake a producer waiting for room :
+            self._condition.notify_all()
+            return item
+
+    def deliver(self, key, stats):
+        '''
+        function:: deliver(key, stats)
+        :param key: (UpdateFunction, sheet_id, detail)
+        :param stats:
+
+        Called by the worker threads.
+        '''
+        update_function, sheet_id, detail = key
+        start = time.perf_counter()
+        try:
+            if update_function.pass_detail:
+                result = update_function.function(sheet_id, detail)
+            elif update_function.pass_sheet_id:
+                result = update_function.function(sheet_id)
+            else:
+                result = update_function.function()
+        except Exception:
+            traceback.print_exc()
+            return
+        # the worker threads share the statistics :
+        with self._condition:
+            stats.worker_deliveries += 1
+            stats.worker_delivery_time += time.perf_counter() - start
+        if update_function.result_func is not None:
+            self.result_ready.emit(update_function.result_func, result)
+
+    @pyqtSlot(object, object)
+    def _deliver_result(self, result_func, result):
+        result_func(result)
+
+    def shutdown(self):
+        '''
+        function:: shutdown()
+        '''
+        with self._condition:
+            self._is_running = False
+            self._pending.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.wait()
+        self._threads = []
+
+
+class WorkerThread(QThread):
+
+    '''
+    WorkerThread
+    '''
+
+    def __init__(self, lane):
+        '''
+        Constructor
+        '''
+        super(WorkerThread, self).__init__()
+
+        self._lane = lane
+
+    def run(self):
+        while True:
+            item = self._lane.take()
+            if item is None:
+                return
+            key, stats = item
+            self._lane.deliver(key, stats)
+
+
+def namespace_of(domain):
+    return domain.partition(".")[0]
 
-_update_funcs = []
-_disabled_funcs = []
-_domain_list = []
 
+bus = EventBus()
 
-def subscribe_update_func_to_domain(func, domain, sheet_id=None):
+
+def subscribe_update_func_to_domain(func, domain, sheet_id=None, delivery=INLINE_DELIVERY, result_func=None,
+                                    pass_sheet_id=False, pass_detail=False):
     '''
     function:: subscribe_update_func_to_domain(func, domain)
     :param func:
     :param domain: string like "data.tree.properties"
     :param sheet_id: int. optional. if present, can narrow_down the update.
+    :param delivery: "inline" (default) or "worker", see EventBus.subscribe
+    :param result_func: optional. GUI-thread receiver of a "worker" func result
+    :param pass_sheet_id: if True, func(sheet_id) is called
+    :param pass_detail: if True, func(sheet_id, detail) is called
     '''
-    has_already_update_function = False
-
-    for update_function in _update_funcs:
-        if update_function.function is func and update_function.domain is domain:
-            has_already_update_function = True
-    if has_already_update_function is False:
-        _update_funcs.append(UpdateFunction(func, domain, sheet_id))
+    bus.subscribe(func, domain, sheet_id, delivery, result_func, pass_sheet_id, pass_detail)
 
 
 def unsubscribe_update_func(func):
@@ -30,38 +452,64 @@ def unsubscribe_update_func(func):
     function:: unsubscribe_update_func(func)
     :param func:
     '''
-    for update_function in _update_funcs:
-        if update_function.function == func:
-            _update_funcs.remove(update_function)
+    bus.unsubscribe(func)
+
+
+def unsubscribe_update_funcs(func_list):
+    '''
+    function:: unsubscribe_update_funcs(func_list)
+    :param func_list: ex: the subscribed methods of an object being deleted
+    '''
+    for func in func_list:
+        bus.unsubscribe(func)
+
+
+def unsubscribe_update_func_from_domain(func, domain):
+    '''
+    function:: unsubscribe_update_func_from_domain(func, domain)
+    :param func:
+    :param domain:
+    '''
+    bus.unsubscribe(func, domain)
 
 
 def disable_func(func):
-    for update_function in _update_funcs:
-        if update_function.function == func:
-            _update_funcs.remove(update_function)
-            _disabled_funcs.append(update_function)
+    bus.disable(func)
 
 
 def enable_func(func):
-    for update_function in _update_funcs:
-        if update_function.function == func:
-            _disabled_funcs.remove(update_function)
-            _update_funcs.append(update_function)
+    bus.enable(func)
 
 
-def announce_update(domain, sheet_id=-1):
+def bridge_domains(source_domain, target_domain):
+    '''
+    function:: bridge_domains(source_domain, target_domain)
+    :param source_domain: ex: "data.project.saved"
+    :param target_domain: ex: "core.project.saved"
+    '''
+    bus.bridge(source_domain, target_domain)
+
+
+def announce_update(domain, sheet_id=-1, detail=None):
     '''
     function:: announce_update(domain)
     :param domain:
     :param sheet_id: int. optional. if present, can narrow_down the update.
+    :param detail: optional. ex: the key of a changed property
     '''
-    for update_function in _update_funcs:
-        if update_function.domain == domain and update_function.sheet_id == sheet_id:
-            update_function.function()
-        # for the subscriber interested by all updates from every sheet:
-        if update_function.domain == domain and update_function.sheet_id == None:
-            f = update_function.function
-            f()
+    bus.announce(domain, sheet_id, detail)
+
+
+def statistics():
+    '''
+    function:: statistics()
+    :rtype: dict namespace -> NamespaceStatistics
+    '''
+    return bus.statistics()
+
+
+def shutdown():
+    bus.shutdown()
 
 
 class UpdateFunction():
@@ -70,7 +518,8 @@ class UpdateFunction():
     UpdateFunction
     '''
 
-    def __init__(self, function, domain, sheet_id=None):
+    def __init__(self, function, domain, sheet_id=None, delivery=INLINE_DELIVERY, result_func=None,
+                 pass_sheet_id=False, pass_detail=False):
         '''
         Constructor
         '''
@@ -80,6 +529,10 @@ class UpdateFunction():
         self._function = function
         self._domain = domain
         self._sheet_id = sheet_id
+        self._delivery = delivery
+        self._result_func = result_func
+        self._pass_sheet_id = pass_sheet_id
+        self._pass_detail = pass_detail
 
     @property
     def function(self):
@@ -92,3 +545,19 @@ class UpdateFunction():
     @property
     def sheet_id(self):
         return self._sheet_id
+
+    @property
+    def delivery(self):
+        return self._delivery
+
+    @property
+    def result_func(self):
+        return self._result_func
+
+    @property
+    def pass_sheet_id(self):
+        return self._pass_sheet_id
+
+    @property
+    def pass_detail(self):
+        return self._pass_detail
@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+# the tests don't need a display :
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtWidgets import QApplication
+
+from data.subscriber import EventBus, WorkerLane, WORKER_DELIVERY
+
+
+class Test_EventBus(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = EventBus()
+        self.calls = []
+
+    def tearDown(self):
+        self.bus.shutdown()
+
+    def test_inline(self):
+        self.bus.subscribe(lambda: self.calls.append("all"), "data.tree.title")
+        self.bus.subscribe(lambda sheet_id: self.calls.append(sheet_id), "data.tree.title",
+                           pass_sheet_id=True)
+        self.bus.subscribe(lambda: self.calls.append("one"), "data.tree.title", sheet_id=2)
+        self.bus.announce("data.tree.title", 1)
+        self.assertEqual(self.calls, ["all", 1])
+
+    def test_bridge(self):
+        self.bus.subscribe(lambda: self.calls.append("core"), "core.project.saved")
+        self.bus.bridge("data.project.saved", "core.project.saved")
+        self.bus.announce("data.project.saved")
+        self.assertEqual(self.calls, ["core"])
+        self.assertEqual(self.bus.statistics()["core"].bridged_announcements, 1)
+
+    def test_unsubscribe(self):
+        func = lambda: self.calls.append("x")
+        self.bus.subscribe(func, "data.tree.title")
+        self.bus.unsubscribe(func)
+        self.bus.announce("data.tree.title", 1)
+        self.assertEqual(self.calls, [])
+
+
+class Test_WorkerLane(unittest.TestCase):
+    '''
+    The lane has no thread, the deliveries are taken by the test
+    '''
+
+    def setUp(self):
+        self.bus = EventBus()
+        self.lane = WorkerLane(thread_count=0, max_pending=3)
+        self.bus._worker_lane = self.lane
+        self.calls = []
+
+    def tearDown(self):
+        self.bus.shutdown()
+
+    def subscribe(self, func, domain="data.tree.properties", **kwargs):
+        self.bus.subscribe(func, domain, delivery=WORKER_DELIVERY, **kwargs)
+
+    def drain(self):
+        while self.lane._pending:
+            key, stats = self.lane._pending.popitem(last=False)
+            self.lane.deliver(key, stats)
+
+    def test_superseded(self):
+        self.subscribe(lambda sheet_id: self.calls.append(sheet_id), pass_sheet_id=True)
+        for sheet_id in (1, 2, 1, 1):
+            self.bus.announce("data.tree.properties", sheet_id)
+        self.drain()
+        self.assertEqual(self.calls, [1, 2])
+        self.assertEqual(self.bus.statistics()["data"].worker_superseded, 2)
+
+    def test_coalesced_when_full(self):
+        self.subscribe(lambda sheet_id, detail: self.calls.append((sheet_id, detail)),
+                       pass_detail=True)
+        for sheet_id in range(1, 5):
+            self.bus.announce("data.tree.properties", sheet_id, "key")
+        # the three pending ones and the new one are coalesced, for any sheet :
+        self.assertEqual(len(self.lane._pending), 1)
+        self.drain()
+        self.assertEqual(self.calls, [(-1, None)])
+        self.assertEqual(self.bus.statistics()["data"].worker_coalesced, 3)
+
+    def test_other_subscribers_kept_when_full(self):
+        self.subscribe(lambda sheet_id: self.calls.append(("a", sheet_id)), pass_sheet_id=True)
+        self.subscribe(lambda: self.calls.append(("b", None)), "data.tree.title")
+        for sheet_id in range(1, 4):
+            self.bus.announce("data.tree.properties", sheet_id)
+        self.bus.announce("data.tree.title", 7)
+        self.drain()
+        # nothing is dropped :
+        self.assertEqual(self.calls, [("a", 1), ("a", 2), ("a", 3), ("b", None)])
+
+    def test_full_queue_does_not_wait(self):
+        self.subscribe(lambda sheet_id: None, pass_sheet_id=True)
+        start = time.perf_counter()
+        for sheet_id in range(0, 1000):
+            self.bus.announce("data.tree.properties", sheet_id)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertLessEqual(len(self.lane._pending), self.lane.max_pending)
+
+
+class Test_WorkerLaneThreads(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # a QApplication, for the widget tests run with these ones :
+        cls.app = QCoreApplication.instance() or QApplication(sys.argv)
+
+    def setUp(self):
+        self.bus = EventBus()
+
+    def tearDown(self):
+        self.bus.shutdown()
+
+    def test_result_in_announcing_thread(self):
+        threads = {}
+        results = []
+
+        def work(sheet_id):
+            threads["work"] = threading.current_thread()
+            return sheet_id * 10
+
+        def receive(result):
+            threads["result"] = threading.current_thread()
+            results.append(result)
+
+        self.bus.subscribe(work, "data.tree.content", delivery=WORKER_DELIVERY,
+                           result_func=receive, pass_sheet_id=True)
+        self.bus.announce("data.tree.content", 4)
+        deadline = time.perf_counter() + 5
+        while results == [] and time.perf_counter() < deadline:
+            QCoreApplication.processEvents()
+            time.sleep(0.01)
+
+        self.assertEqual(results, [40])
+        self.assertIsNot(threads["work"], threading.main_thread())
+        self.assertIs(threads["result"], threading.main_thread())
+        self.assertEqual(self.bus.statistics()["data"].worker_deliveries, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import sqlite3
+
+from data.tree import Tree
+
+
+class Test_Tree(unittest.TestCase):
+
+    def setUp(self):
+        self.database = sqlite3.connect(":memory:")
+        cursor = self.database.cursor()
+        cursor.execute("CREATE TABLE other_sheet_contents (other_sheet_contents_id INTEGER PRIMARY KEY \
+        AUTOINCREMENT UNIQUE NOT NULL, synopsis NONE)")
+        cursor.execute("CREATE TABLE main_table (sheet_id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, \
+        title TEXT, tree TEXT, content NONE, content_type TEXT, other_sheet_contents_id INTEGER \
+        REFERENCES other_sheet_contents (other_sheet_contents_id), creation_date DATETIME, \
+        modification_date DATETIME, properties TEXT, parent_id INTEGER, children_id TEXT, \
+        version INTEGER, is_root BOOLEAN DEFAULT False)")
+        cursor.execute("INSERT INTO main_table (sheet_id, title, tree, is_root) VALUES (0, 'root', 'write', 1)")
+        self.database.commit()
+
+        self.tree = Tree()
+        self.tree.db = self.database
+        # root -> 1 -> (3, 4, 5), root -> 2
+        self.book_id = self.tree.create_new_sheet(0, "write")
+        self.other_book_id = self.tree.create_new_sheet(0, "write")
+        self.chapter_ids = [self.tree.create_new_sheet(self.book_id, "write") for _ in range(3)]
+
+    def tearDown(self):
+        self.database.close()
+
+    def children(self, sheet_id):
+        return self.tree._get_children_id(sheet_id)
+
+    def test_find_by_properties(self):
+        first, second, third = self.chapter_ids
+        self.tree.set_properties(first, {"status": "draft", "words": "120"})
+        self.tree.set_properties(second, {"status": "done", "words": "800"})
+        self.tree.set_properties(third, {"status": "draft", "due": "2015-06-02"})
+
+        self.assertEqual(self.tree.find_by_properties(status="draft"), [first, third])
+        self.assertEqual(self.tree.find_by_properties(status="draft", words="120"), [first])
+        self.assertEqual(self.tree.find_by_properties(words=(100, 500)), [first])
+        self.assertEqual(self.tree.find_by_properties(due=("2015-06-01", None)), [third])
+        self.assertEqual(self.tree.find_by_properties(status="missing"), [])
+
+        # the index follows the changes :
+        self.tree.set_properties(second, {"status": "draft"})
+        self.assertEqual(self.tree.find_by_properties(status="draft"), [first, second, third])
+
+    def test_find_by_properties_without_criteria(self):
+        self.assertEqual(self.tree.find_by_properties(),
+                         [self.book_id, self.other_book_id] + self.chapter_ids)
+
+    def test_find_by_properties_skips_roots(self):
+        self.tree.set_properties(0, {"status": "draft"})
+        self.tree.set_properties(self.book_id, {"status": "draft"})
+        self.assertEqual(self.tree.find_by_properties(status="draft"), [self.book_id])
+
+    def test_find_by_properties_in_tree(self):
+        note_root_id = self.tree.db.execute("INSERT INTO main_table (title, tree, is_root) \
+        VALUES ('root', 'note', 1)").lastrowid
+        note_id = self.tree.create_new_sheet(note_root_id, "note")
+        self.tree.set_properties(note_id, {"status": "draft"})
+        self.tree.set_properties(self.book_id, {"status": "draft"})
+
+        self.assertEqual(self.tree.find_by_properties(status="draft"), [self.book_id, note_id])
+        self.assertEqual(self.tree.find_by_properties("write", status="draft"), [self.book_id])
+        self.assertEqual(self.tree.find_by_properties("note"), [note_id])
+
+
+    def test_move_many(self):
+        first, second, third = self.chapter_ids
+        old_positions = self.tree.move_many([third, first], self.other_book_id)
+
+        self.assertEqual(self.children(self.book_id), [second])
+        self.assertEqual(self.children(self.other_book_id), [third, first])
+        self.assertEqual(self.tree.get_tree_model_row(first)[2], self.other_book_id)
+        self.assertEqual(sorted(old_positions),
+                         sorted([(first, self.book_id, 0), (third, self.book_id, 2)]))
+
+    def test_move_many_within_parent(self):
+        first, second, third = self.chapter_ids
+        self.tree.move_many([third], self.book_id, 0)
+
+        self.assertEqual(self.children(self.book_id), [third, first, second])
+
+    def test_restore_positions(self):
+        first, second, third = self.chapter_ids
+        old_positions = self.tree.move_many([third, first], self.other_book_id, 0)
+        self.tree.restore_positions(old_positions)
+
+        self.assertEqual(self.children(self.book_id), [first, second, third])
+        self.assertEqual(self.children(self.other_book_id), [])
+        self.assertEqual(self.tree.get_tree_model_row(third)[2], self.book_id)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,25 @@ Created on 26 avr. 2015
 
 from . import subscriber
 import ast
+import functools
+import threading
+from datetime import datetime
+
+# fields of a sheet stored in a column of main_table
+MAIN_TABLE_FIELDS = ("title", "content", "content_type", "properties",
+                     "modification_date", "creation_date", "version")
+
+
+def with_db_lock(method):
+    '''
+    function:: with_db_lock(method)
+    :param method: of Tree, run holding Tree.db_lock
+    '''
+    @functools.wraps(method)
+    def locked_method(self, *args, **kwargs):
+        with self.db_lock:
+            return method(self, *args, **kwargs)
+    return locked_method
 
 
 class Tree(object):
@@ -20,7 +39,13 @@ class Tree(object):
         Constructor
         '''
         self.db = None
+        # the one connection is shared by the GUI thread and the worker
+        # lane (see subscriber.WorkerLane) : every access holds this lock
+        self.db_lock = threading.RLock()
+        # the db whose property_index table is built, see find_by_properties()
+        self._property_index_db = None
 
+    @with_db_lock
     def get_tree_model_necessities(self, tree_type=None):
         '''
         :param tree_type: restrict to a given tree. Ex : write
@@ -29,29 +54,222 @@ class Tree(object):
         return [(sheet_id, title, parent_id, children_id, properties), (...)]
         '''
 
+        return list(self.iter_tree_model_necessities(tree_type))
+
+    def iter_tree_model_necessities(self, tree_type=None, chunk_size=500):
+        '''
+        :param tree_type: restrict to a given tree. Ex : write
+        :param chunk_size: number of rows fetched from the cursor at a time
+        Same as get_tree_model_necessities(), streamed from the cursor, so a
+        tree builder doesn't hold every row twice
+
+        yield (sheet_id, title, parent_id, children_id, properties)
+        '''
+
+        with self.db_lock:
+            db = self.db
+
+            if db is None:  # closed
+                return
+
+            cur = db.cursor()
+            if tree_type is not None:  # select only designated tree type
+                cur.execute("SELECT sheet_id, title, parent_id, children_id, properties FROM main_table WHERE tree=:tree ", {
+                            "tree": tree_type})
+            else:  # take all
+                cur.execute(
+                    "SELECT sheet_id, title, parent_id, children_id, properties FROM main_table")
+
+        while True:
+            # the lock isn't held while the caller handles the rows :
+            with self.db_lock:
+                result = cur.fetchmany(chunk_size)
+            if not result:
+                break
+            for row in result:
+                yield transform_tree_model_row(row)
+
+    @with_db_lock
+    def get_tree_model_row(self, sheet_id):
+        '''
+        :param sheet_id:
+        The get_tree_model_necessities() tuple of only one sheet, to update a
+        treeModel incrementally
+
+        return (sheet_id, title, parent_id, children_id, properties) or None
+        '''
         db = self.db
 
+        if db is None:  # closed
+            return None
+
+        cur = db.cursor()
+        cur.execute("SELECT sheet_id, title, parent_id, children_id, properties FROM main_table \
+        WHERE sheet_id=:id", {"id": sheet_id})
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return transform_tree_model_row(row)
+
+    @with_db_lock
+    def get_tree_model_rows(self, sheet_ids, chunk_size=500):
+        '''
+        function:: get_tree_model_rows(sheet_ids, chunk_size=500)
+        :param sheet_ids: iterable of sheet_id
+        :param chunk_size: number of sheets read by each query
+        The get_tree_model_necessities() tuples of some sheets, ex: the children
+        of a node a treeModel is expanding
+
+        return [(sheet_id, title, parent_id, children_id, properties), (...)]
+        in the order of sheet_ids, without the missing sheets
+        '''
+        db = self.db
+
+        if db is None:  # closed
+            return []
+
+        sheet_ids = list(sheet_ids)
+        row_dict = {}
+        for start in range(0, len(sheet_ids), chunk_size):
+            chunk = sheet_ids[start:start + chunk_size]
+            cur = db.cursor()
+            cur.execute("".join(["SELECT sheet_id, title, parent_id, children_id, properties \
+            FROM main_table WHERE sheet_id IN (", ", ".join("?" * len(chunk)), ")"]), chunk)
+            for row in cur.fetchall():
+                row_dict[row[0]] = row
+
+        return [transform_tree_model_row(row_dict[sheet_id])
+                for sheet_id in sheet_ids if sheet_id in row_dict]
+
+    @with_db_lock
+    def get_fields(self, sheet_id, fields):
+        '''
+        function:: get_fields(sheet_id, fields)
+        :param sheet_id:
+        :param fields: iterable of names from MAIN_TABLE_FIELDS or "other_contents"
+        Read several fields of a sheet in one query
+
+        return {field: value}
+        '''
+        fields = list(fields)
+        columns = [field for field in fields if field in MAIN_TABLE_FIELDS]
+        for field in fields:
+            if field not in columns and field != "other_contents":
+                raise ValueError("unknown sheet field: " + str(field))
+
+        dict_ = {}
+        if columns != []:
+            cur = self.db.cursor()
+            cur.execute("".join(["SELECT ", ", ".join(columns),
+                                 " FROM main_table WHERE sheet_id=:id"]), {"id": sheet_id})
+            row = cur.fetchone()
+            for column, value in zip(columns, row):
+                dict_[column] = value
+            if "properties" in dict_:
+                dict_["properties"] = transform_properties_text_into_dict(
+                    dict_["properties"])
+        if "other_contents" in fields:
+            dict_["other_contents"] = self.get_other_contents(sheet_id)
+
+        return dict_
+
+    @with_db_lock
+    def get_many_fields(self, sheet_ids, fields, chunk_size=500):
+        '''
+        function:: get_many_fields(sheet_ids, fields, chunk_size=500)
+        :param sheet_ids: iterable of sheet_id
+        :param fields: iterable of names from MAIN_TABLE_FIELDS or "other_contents"
+        :param chunk_size: number of sheets read by each query
+        Read the fields of many sheets with one query per chunk. Unlike
+        get_other_contents, it never creates missing other contents.
+
+        generator of (sheet_id, {field: value}), in the order of sheet_ids
+        '''
+        fields = list(fields)
+        columns = [field for field in fields if field in MAIN_TABLE_FIELDS]
+        for field in fields:
+            if field not in columns and field != "other_contents":
+                raise ValueError("unknown sheet field: " + str(field))
+        with_other_contents = "other_contents" in fields
+
+        if with_other_contents:
+            cur = self.db.cursor()
+            cursor = cur.execute('SELECT * FROM other_sheet_contents LIMIT 0')
+            other_names = [description[0]
+                           for description in cursor.description]
+            selected = ["main_table.sheet_id"] \
+                + ["main_table." + column for column in columns] \
+                + ["other_sheet_contents." + name for name in other_names]
+            from_ = " FROM main_table LEFT JOIN other_sheet_contents ON \
+                other_sheet_contents.other_sheet_contents_id = main_table.other_sheet_contents_id"
+        else:
+            selected = ["sheet_id"] + columns
+            from_ = " FROM main_table"
+
+        sheet_ids = list(sheet_ids)
+        for start in range(0, len(sheet_ids), chunk_size):
+            chunk = sheet_ids[start:start + chunk_size]
+            query = "".join(["SELECT ", ", ".join(selected), from_,
+                             " WHERE main_table.sheet_id IN (",
+                             ", ".join("?" * len(chunk)), ")"])
+            cur = self.db.cursor()
+            cur.execute(query, chunk)
+            row_dict = {}
+            for row in cur.fetchall():
+                row_dict[row[0]] = row
+
+            for sheet_id in chunk:
+                if sheet_id not in row_dict:
+                    continue
+                row = row_dict[sheet_id]
+                dict_ = {}
+                for column, value in zip(columns, row[1:]):
+                    dict_[column] = value
+                if "properties" in dict_:
+                    dict_["properties"] = transform_properties_text_into_dict(
+                        dict_["properties"])
+                if with_other_contents:
+                    dict_["other_contents"] = dict(
+                        zip(other_names, row[1 + len(columns):]))
+                yield sheet_id, dict_
+
+    @with_db_lock
+    def get_sheet_ids(self, tree_type, order="document"):
+        '''
+        function:: get_sheet_ids(tree_type, order="document")
+        :param tree_type: Ex : write
+        :param order: "document", depth first from the root, or "id"
+
+        return [sheet_id, ...] without the root sheet
+        '''
+        db = self.db
         if db is None:  # closed
             return []
 
         cur = db.cursor()
-        if tree_type is None:  # select only designated tree type
-            cur.execute("SELECT sheet_id, title, parent_id, children_id, properties FROM main_table WHERE tree=:tree ", {
-                        "tree": tree_type})
-        else:  # take all
-            cur.execute(
-                "SELECT sheet_id, title, parent_id, children_id, properties FROM main_table")
-
-        result = cur.fetchall()
-        final_result = []
-        for row in result:
-            sheet_id, title, parent_id, children_id, properties = row
-            tuple_ = (sheet_id, title, parent_id, transform_children_id_text_into_int_tuple(
-                children_id), transform_properties_text_into_dict(properties))
-            final_result.append(tuple_)
+        if order == "id":
+            cur.execute("SELECT sheet_id FROM main_table WHERE tree=:tree AND NOT is_root \
+            ORDER BY sheet_id", {"tree": tree_type})
+            return [row[0] for row in cur.fetchall()]
+        if order != "document":
+            raise ValueError("unknown order: " + str(order))
 
-        return final_result
+        cur.execute("SELECT sheet_id, children_id FROM main_table WHERE tree=:tree",
+                    {"tree": tree_type})
+        children_dict = {}
+        for sheet_id, children_id in cur.fetchall():
+            children_dict[sheet_id] = transform_children_id_text_into_int_tuple(
+                children_id)
 
+        sheet_ids = []
+        stack = list(reversed(children_dict.get(self.get_root_id(tree_type), ())))
+        while stack:
+            sheet_id = stack.pop()
+            sheet_ids.append(sheet_id)
+            stack.extend(reversed(children_dict.get(sheet_id, ())))
+        return sheet_ids
+
+    @with_db_lock
     def get_root_id(self, tree_type):
         db = self.db
         if db is None:  # closed
@@ -64,9 +282,250 @@ class Tree(object):
             sheet_id = int(row)
         return sheet_id
 
+    @with_db_lock
+    def _get_children_id(self, sheet_id):
+        cur = self.db.cursor()
+        cur.execute(
+            "SELECT children_id FROM main_table WHERE sheet_id=:id", {"id": sheet_id})
+        row = cur.fetchone()
+        if row is None:
+            return []
+        return list(transform_children_id_text_into_int_tuple(row[0]))
+
+    @with_db_lock
+    def _set_children_id(self, sheet_id, children_list):
+        self.db.cursor().execute("UPDATE main_table SET children_id=:children_id WHERE sheet_id=:id",
+                                 {"children_id": transform_int_list_into_children_id_text(children_list),
+                                  "id": sheet_id})
+
+    @with_db_lock
     def move(self, sheet_id, old_position_in_children, old_parent_id, new_position_in_children, new_parent_id):
-        pass
+        '''
+        function:: move(sheet_id, old_position_in_children, old_parent_id, new_position_in_children, new_parent_id)
+        :param sheet_id:
+        :param old_position_in_children: int, position in the old parent's children
+        :param old_parent_id:
+        :param new_position_in_children: int, position in the new parent's children,
+        once the sheet is taken out of the old parent
+        :param new_parent_id:
+        '''
+        old_children_list = self._get_children_id(old_parent_id)
+        if sheet_id in old_children_list:
+            old_children_list.remove(sheet_id)
+        if new_parent_id == old_parent_id:
+            new_children_list = old_children_list
+        else:
+            self._set_children_id(old_parent_id, old_children_list)
+            new_children_list = self._get_children_id(new_parent_id)
+        new_children_list.insert(new_position_in_children, sheet_id)
+        self._set_children_id(new_parent_id, new_children_list)
+        self.db.cursor().execute("UPDATE main_table SET parent_id=:parent_id WHERE sheet_id=:id",
+                                 {"parent_id": new_parent_id, "id": sheet_id})
+        self.db.commit()
+        subscriber.announce_update("data.tree.sheet_moved", sheet_id)
+        subscriber.announce_update("data.project.notsaved")
+
+    @with_db_lock
+    def move_many(self, sheet_ids, new_parent_id, new_position=-1):
+        '''
+        function:: move_many(sheet_ids, new_parent_id, new_position=-1)
+        :param sheet_ids: moved sheets, they stay in this order
+        :param new_parent_id:
+        :param new_position: int, position in the new parent's children,
+        counted before the move, like a drop row. -1 to append
+        Move several sheets with one transaction
+
+        return [(sheet_id, old_parent_id, old_position_in_children)], for
+        restore_positions()
+        '''
+        sheet_ids = list(sheet_ids)
+        moved_ids = set(sheet_ids)
+        old_positions = self._get_positions(sheet_ids)
+        children_dict = {}
+        for _, old_parent_id, _ in old_positions:
+            if old_parent_id not in children_dict:
+                children_dict[old_parent_id] = self._get_children_id(old_parent_id)
+        if new_parent_id not in children_dict:
+            children_dict[new_parent_id] = self._get_children_id(new_parent_id)
+
+        new_children_list = children_dict[new_parent_id]
+        if new_position is None or new_position < 0:
+            new_position = len(new_children_list)
+        # the position once the moved sheets are taken out :
+        new_position -= len([child_id for child_id in new_children_list[:new_position]
+                             if child_id in moved_ids])
+        for old_parent_id in children_dict:
+            children_dict[old_parent_id] = [child_id for child_id in children_dict[old_parent_id]
+                                            if child_id not in moved_ids]
+        children_dict[new_parent_id][new_position:new_position] = sheet_ids
+
+        self._apply_moves(children_dict, {sheet_id: new_parent_id for sheet_id in sheet_ids})
+        return old_positions
+
+    @with_db_lock
+    def restore_positions(self, positions):
+        '''
+        function:: restore_positions(positions)
+        :param positions: [(sheet_id, parent_id, position_in_children)], as
+        returned by move_many()
+        Move back several sheets with one transaction, ex: to undo move_many()
+        '''
+        sheet_ids = [sheet_id for sheet_id, _, _ in positions]
+        moved_ids = set(sheet_ids)
+        current_positions = self._get_positions(sheet_ids)
+        children_dict = {}
+        for _, parent_id, _ in current_positions + list(positions):
+            if parent_id not in children_dict:
+                children_dict[parent_id] = [child_id for child_id in self._get_children_id(parent_id)
+                                            if child_id not in moved_ids]
+        # ascending positions, so each one is valid when inserted :
+        for sheet_id, parent_id, position in sorted(positions, key=lambda position: position[2]):
+            children_dict[parent_id].insert(position, sheet_id)
+
+        self._apply_moves(children_dict, {sheet_id: parent_id for sheet_id, parent_id, _ in positions})
+
+    @with_db_lock
+    def _get_positions(self, sheet_ids):
+        positions = []
+        cur = self.db.cursor()
+        for sheet_id in sheet_ids:
+            cur.execute("SELECT parent_id FROM main_table WHERE sheet_id=:id", {"id": sheet_id})
+            parent_id = cur.fetchone()[0]
+            positions.append((sheet_id, parent_id, self._get_children_id(parent_id).index(sheet_id)))
+        return positions
+
+    @with_db_lock
+    def _apply_moves(self, children_dict, parent_id_dict):
+        cur = self.db.cursor()
+        try:
+            for parent_id, children_list in children_dict.items():
+                cur.execute("UPDATE main_table SET children_id=:children_id WHERE sheet_id=:id",
+                            {"children_id": transform_int_list_into_children_id_text(children_list),
+                             "id": parent_id})
+            cur.executemany("UPDATE main_table SET parent_id=? WHERE sheet_id=?",
+                            [(parent_id, sheet_id) for sheet_id, parent_id in parent_id_dict.items()])
+        except:
+            self.db.rollback()
+            raise
+        self.db.commit()
+
+        # in the final order of each parent, so that each moved sheet follows
+        # a sheet already in place :
+        for parent_id, children_list in children_dict.items():
+            for sheet_id in children_list:
+                if parent_id_dict.get(sheet_id) == parent_id:
+                    subscriber.announce_update("data.tree.sheet_moved", sheet_id)
+        subscriber.announce_update("data.project.notsaved")
+
+    @with_db_lock
+    def remove_sheet(self, sheet_id):
+        '''
+        function:: remove_sheet(sheet_id)
+        :param sheet_id: removed with all its descendants
+        :rtype: dict of the removed rows, for restore_sheet(), or None if
+        there is no such sheet
+        '''
+        cur = self.db.cursor()
+        cur.execute(
+            "SELECT parent_id FROM main_table WHERE sheet_id=:id", {"id": sheet_id})
+        row = cur.fetchone()
+        if row is None:
+            return None
+        parent_id = row[0]
+        position = None
+        if parent_id is not None:
+            children_list = self._get_children_id(parent_id)
+            if sheet_id in children_list:
+                position = children_list.index(sheet_id)
+
+        # sheet and descendants :
+        removed_ids = [sheet_id]
+        for removed_id in removed_ids:
+            removed_ids.extend(self._get_children_id(removed_id))
+        removed_rows = [(removed_id,) for removed_id in removed_ids]
+        other_rows = []
+        for removed_id in removed_ids:
+            cur.execute("SELECT other_sheet_contents_id FROM main_table WHERE sheet_id=:id",
+                        {"id": removed_id})
+            row = cur.fetchone()
+            if row is not None and row[0] is not None:
+                other_rows.append(row)
+        removal = {"sheet_id": sheet_id, "parent_id": parent_id, "position": position,
+                   "main_table": self._select_rows("main_table", "sheet_id", removed_rows),
+                   "other_sheet_contents": self._select_rows(
+                       "other_sheet_contents", "other_sheet_contents_id", other_rows)}
+
+        try:
+            cur.executemany("DELETE FROM other_sheet_contents WHERE other_sheet_contents_id=?",
+                            other_rows)
+            cur.executemany("DELETE FROM main_table WHERE sheet_id=?", removed_rows)
+            if self._property_index_is_built():
+                cur.executemany("DELETE FROM property_index WHERE sheet_id=?", removed_rows)
+            if parent_id is not None:
+                children_list = self._get_children_id(parent_id)
+                if sheet_id in children_list:
+                    children_list.remove(sheet_id)
+                self._set_children_id(parent_id, children_list)
+        except:
+            self.db.rollback()
+            raise
+        self.db.commit()
+        subscriber.announce_update("data.tree.sheet_removed", sheet_id)
+        subscriber.announce_update("data.project.notsaved")
+        return removal
+
+    @with_db_lock
+    def restore_sheet(self, removal):
+        '''
+        function:: restore_sheet(removal)
+        :param removal: dict returned by remove_sheet()
+        Put back a removed sheet, with its descendants and their contents, in
+        one transaction, ex: to undo remove_sheet()
+        '''
+        sheet_id = removal["sheet_id"]
+        parent_id = removal["parent_id"]
+        cur = self.db.cursor()
+        try:
+            for table in ("main_table", "other_sheet_contents"):
+                names, rows = removal[table]
+                if rows == []:
+                    continue
+                cur.executemany("".join(["INSERT INTO ", table, " (",
+                                         ", ".join('"' + name + '"' for name in names),
+                                         ") VALUES (", ", ".join("?" * len(names)), ")"]),
+                                rows)
+            if parent_id is not None:
+                children_list = self._get_children_id(parent_id)
+                position = removal["position"]
+                if position is None:
+                    position = len(children_list)
+                children_list.insert(min(position, len(children_list)), sheet_id)
+                self._set_children_id(parent_id, children_list)
+            if self._property_index_is_built():
+                names, rows = removal["main_table"]
+                for row in rows:
+                    fields = dict(zip(names, row))
+                    self._index_properties(fields["sheet_id"],
+                                           transform_properties_text_into_dict(fields["properties"]))
+        except:
+            self.db.rollback()
+            raise
+        self.db.commit()
+        subscriber.announce_update("data.tree.sheet_added", sheet_id)
+        subscriber.announce_update("data.project.notsaved")
 
+    def _select_rows(self, table, id_column, id_rows):
+        # (column names, rows) of the table rows whose id is in id_rows
+        cur = self.db.cursor()
+        cur.execute("".join(["SELECT * FROM ", table, " LIMIT 0"]))
+        names = [description[0] for description in cur.description]
+        rows = []
+        for id_row in id_rows:
+            cur.execute("".join(["SELECT * FROM ", table, " WHERE ", id_column, "=?"]), id_row)
+            rows.extend(cur.fetchall())
+        return names, rows
+
+    @with_db_lock
     def create_new_sheet(self, parent_id, tree_type):
         '''
         function:: create_new_tree_item(parent, tree_type)
@@ -83,29 +542,17 @@ class Tree(object):
         result = c.fetchone()
         for row in result:
             sheet_id = row
-        # get parent sheet :
-        c.execute(
-            "SELECT children_id FROM main_table WHERE sheet_id=:id", {"id": parent_id})
-        result = c.fetchone()
-        for row in result:
-            children_id = row
-        # modify parent's children_i :
-        t = transform_children_id_text_into_int_tuple(children_id)
-        children_list = list(t)
+        # modify parent's children_id :
+        children_list = self._get_children_id(parent_id)
         children_list.append(sheet_id)
-        if len(children_list) == 0:
-            children_list_str = ""
-        else:
-            children_list_str = [str(child_id) for child_id in children_list]
-        children_id = ",".join(children_list_str)
-        self.db.cursor().execute("UPDATE main_table SET children_id=:children_id WHERE sheet_id=:id",
-                                 {"children_id": children_id, "id": parent_id})
+        self._set_children_id(parent_id, children_list)
         self.db.commit()
-        subscriber.announce_update("data.tree")
+        subscriber.announce_update("data.tree.sheet_added", sheet_id)
         subscriber.announce_update("data.project.notsaved")
 
         return sheet_id
 
+    @with_db_lock
     def get_title(self, sheet_id):
         db = self.db
         cur = db.cursor()
@@ -116,6 +563,7 @@ class Tree(object):
             title = row
         return title
 
+    @with_db_lock
     def set_title(self, sheet_id, new_title):
         self.db.cursor().execute("UPDATE main_table SET title=:title WHERE sheet_id=:id",
                                  {"title": new_title, "id": sheet_id})
@@ -123,7 +571,19 @@ class Tree(object):
         subscriber.announce_update("data.tree.title", sheet_id)
         subscriber.announce_update("data.project.notsaved")
 
+    @with_db_lock
     def get_other_contents(self, sheet_id):
+        other_id = self._get_other_sheet_contents_id(sheet_id)
+
+        # insert in dict each column:
+        cur = self.db.cursor()
+        cur.execute("SELECT * FROM other_sheet_contents WHERE other_sheet_contents_id=:id",
+                    {"id": other_id})
+        names = [description[0] for description in cur.description]
+        return dict(zip(names, cur.fetchone()))
+
+    @with_db_lock
+    def _get_other_sheet_contents_id(self, sheet_id):
         db = self.db
         cur = db.cursor()
         cur.execute("SELECT other_sheet_contents_id FROM main_table WHERE sheet_id=:id", {
@@ -143,24 +603,36 @@ class Tree(object):
             c.execute("UPDATE main_table SET other_sheet_contents_id=:other_id WHERE sheet_id=:id", {
                       "other_id": other_id, "id": sheet_id})
             db.commit()
+        return other_id
 
-        # insert in dict each column:
-        dict_ = {}
-        cur = db.cursor()
-        cursor = cur.execute('SELECT * FROM other_sheet_contents')
+    @with_db_lock
+    def set_other_content(self, sheet_id, key, value):
+        '''
+        function:: set_other_content(sheet_id, key, value)
+        :param sheet_id:
+        :param key: ex: "synopsis"
+        :param value:
+        Write only this field, in one transaction
+        '''
+        if key == "other_sheet_contents_id":
+            return
+        other_id = self._get_other_sheet_contents_id(sheet_id)
+        cur = self.db.cursor()
+        cursor = cur.execute('SELECT * FROM other_sheet_contents LIMIT 0')
         names = [description[0] for description in cursor.description]
-        for name in names:
-            cur = db.cursor()
+        if key not in names:  # create column
             query = "".join(
-                ["SELECT ",  name, " FROM other_sheet_contents WHERE other_sheet_contents_id=",  str(other_id)])
+                ["ALTER TABLE other_sheet_contents ADD COLUMN ",  key, " NONE"])
             cur.execute(query)
-            result = cur.fetchone()
-            for row in result:
-                dat = row
-            dict_[name] = dat
+        query = "".join(
+            ["UPDATE other_sheet_contents SET ",  key, "=:dat WHERE other_sheet_contents_id=:id"])
+        cur.execute(query, {"dat": value,  "id": other_id})
+        self.db.commit()
 
-        return dict_
+        subscriber.announce_update("data.tree.other_contents", sheet_id)
+        subscriber.announce_update("data.project.notsaved")
 
+    @with_db_lock
     def set_other_contents(self, sheet_id, dict_):
         db = self.db
         cur = db.cursor()
@@ -191,6 +663,7 @@ class Tree(object):
         subscriber.announce_update("data.tree.other_contents", sheet_id)
         subscriber.announce_update("data.project.notsaved")
 
+    @with_db_lock
     def get_content(self, sheet_id):
         db = self.db
         cur = db.cursor()
@@ -201,6 +674,7 @@ class Tree(object):
             content = row
         return content
 
+    @with_db_lock
     def set_content(self, sheet_id, content):
         self.db.cursor().execute("UPDATE main_table SET content=:content WHERE sheet_id=:id",
                                  {"content": content, "id": sheet_id})
@@ -208,6 +682,7 @@ class Tree(object):
         subscriber.announce_update("data.tree.content", sheet_id)
         subscriber.announce_update("data.project.notsaved")
 
+    @with_db_lock
     def get_content_type(self, sheet_id):
         db = self.db
         cur = db.cursor()
@@ -218,6 +693,7 @@ class Tree(object):
             content_type = row
         return content_type
 
+    @with_db_lock
     def set_content_type(self, sheet_id, content_type):
         self.db.cursor().execute("UPDATE main_table SET content_type=:content_type WHERE sheet_id=:id",
                                  {"content": content_type, "id": sheet_id})
@@ -225,6 +701,7 @@ class Tree(object):
         subscriber.announce_update("data.tree.content_type", sheet_id)
         subscriber.announce_update("data.project.notsaved")
 
+    @with_db_lock
     def get_properties(self, sheet_id):
         prop_dict = {}
         db = self.db
@@ -240,14 +717,256 @@ class Tree(object):
 
         return prop_dict
 
+    @with_db_lock
     def set_properties(self, sheet_id, properties):
         properties_str = transform_dict_into_text(properties)
         self.db.cursor().execute("UPDATE main_table SET properties=:properties WHERE sheet_id=:id",
                                  {"properties": properties_str, "id": sheet_id})
+        if self._property_index_is_built():
+            self._index_properties(sheet_id, properties)
         self.db.commit()
         subscriber.announce_update("data.tree.properties", sheet_id)
         subscriber.announce_update("data.project.notsaved")
 
+    @with_db_lock
+    def set_property(self, sheet_id, key, value):
+        '''
+        function:: set_property(sheet_id, key, value)
+        :param sheet_id:
+        :param key: added if missing
+        :param value:
+        Announce "data.tree.property.value" with the detail (key, value)
+        '''
+        properties = self.get_properties(sheet_id)
+        properties[key] = value
+        self._write_property_change(sheet_id, properties, [key], [(key, value)])
+        subscriber.announce_update("data.tree.property.value", sheet_id, (key, value))
+        subscriber.announce_update("data.project.notsaved")
+
+    @with_db_lock
+    def rename_property_key(self, sheet_id, key, new_key):
+        '''
+        function:: rename_property_key(sheet_id, key, new_key)
+        :param sheet_id:
+        :param key: if missing, new_key is added with an empty value
+        :param new_key: replaces the property of this key, if any
+        Announce "data.tree.property.key" with the detail (key, new_key)
+        '''
+        properties = self.get_properties(sheet_id)
+        if key not in properties:
+            self.set_property(sheet_id, new_key, "")
+            return
+        value = properties.pop(key)
+        properties[new_key] = value
+        self._write_property_change(sheet_id, properties, [key, new_key], [(new_key, value)])
+        subscriber.announce_update("data.tree.property.key", sheet_id, (key, new_key))
+        subscriber.announce_update("data.project.notsaved")
+
+    @with_db_lock
+    def remove_property(self, sheet_id, key):
+        '''
+        function:: remove_property(sheet_id, key)
+        :param sheet_id:
+        :param key:
+        Announce "data.tree.property.removed" with the detail key
+        '''
+        properties = self.get_properties(sheet_id)
+        if key not in properties:
+            return
+        del properties[key]
+        self._write_property_change(sheet_id, properties, [key], [])
+        subscriber.announce_update("data.tree.property.removed", sheet_id, key)
+        subscriber.announce_update("data.project.notsaved")
+
+    @with_db_lock
+    def set_property_many(self, sheet_ids, key, value):
+        '''
+        function:: set_property_many(sheet_ids, key, value)
+        :param sheet_ids:
+        :param key: added where missing
+        :param value:
+        Same as set_property() on several sheets, with one transaction
+        '''
+        self._change_properties_many(sheet_ids, ("value", key, value))
+
+    @with_db_lock
+    def rename_property_key_many(self, sheet_ids, key, new_key):
+        '''
+        function:: rename_property_key_many(sheet_ids, key, new_key)
+        :param sheet_ids:
+        :param key: where missing, new_key is added with an empty value
+        :param new_key:
+        Same as rename_property_key() on several sheets, with one transaction
+        '''
+        self._change_properties_many(sheet_ids, ("key", key, new_key))
+
+    @with_db_lock
+    def remove_property_many(self, sheet_ids, key):
+        '''
+        function:: remove_property_many(sheet_ids, key)
+        :param sheet_ids:
+        :param key:
+        Same as remove_property() on several sheets, with one transaction
+        '''
+        self._change_properties_many(sheet_ids, ("removed", key))
+
+    @staticmethod
+    def apply_property_change(properties, change):
+        '''
+        function:: apply_property_change(properties, change)
+        :param properties: dict, modified
+        :param change: ("value", key, value), ("key", key, new_key) or
+        ("removed", key), the detail of "data.tree.property.batch"
+        '''
+        if change[0] == "value":
+            properties[change[1]] = change[2]
+        elif change[0] == "key":
+            properties[change[2]] = properties.pop(change[1], "")
+        elif change[0] == "removed":
+            properties.pop(change[1], None)
+        else:
+            raise ValueError("unknown property change: " + str(change[0]))
+
+    @with_db_lock
+    def _change_properties_many(self, sheet_ids, change):
+        sheet_ids = tuple(sheet_ids)
+        update_list = []
+        index_deletion_list = []
+        index_insertion_list = []
+        for sheet_id, fields in self.get_many_fields(sheet_ids, ["properties"]):
+            properties = fields["properties"]
+            old_properties = dict(properties)
+            self.apply_property_change(properties, change)
+            if properties == old_properties and change[0] != "value":
+                continue
+            update_list.append((transform_dict_into_text(properties), sheet_id))
+            # keys of the property_index rows to replace :
+            changed_keys = change[1:3] if change[0] == "key" else change[1:2]
+            for key in changed_keys:
+                index_deletion_list.append((sheet_id, key))
+                if key in properties:
+                    index_insertion_list.append(
+                        transform_property_into_index_row(sheet_id, key, properties[key]))
+
+        cur = self.db.cursor()
+        try:
+            cur.executemany("UPDATE main_table SET properties=? WHERE sheet_id=?", update_list)
+            if self._property_index_is_built():
+                cur.executemany("DELETE FROM property_index WHERE sheet_id=? AND key=?",
+                                index_deletion_list)
+                cur.executemany("INSERT INTO property_index VALUES (?, ?, ?, ?, ?)",
+                                index_insertion_list)
+        except:
+            self.db.rollback()
+            raise
+        self.db.commit()
+        # one notification for all the sheets :
+        subscriber.announce_update("data.tree.property.batch", -1, (sheet_ids, change))
+        subscriber.announce_update("data.project.notsaved")
+
+    @with_db_lock
+    def _write_property_change(self, sheet_id, properties, old_keys, new_items):
+        # the properties column stays a whole dict, but the index only
+        # changes for the keys involved :
+        cur = self.db.cursor()
+        cur.execute("UPDATE main_table SET properties=:properties WHERE sheet_id=:id",
+                    {"properties": transform_dict_into_text(properties), "id": sheet_id})
+        if self._property_index_is_built():
+            cur.executemany("DELETE FROM property_index WHERE sheet_id=? AND key=?",
+                            [(sheet_id, key) for key in old_keys])
+            cur.executemany("INSERT INTO property_index VALUES (?, ?, ?, ?, ?)",
+                            [transform_property_into_index_row(sheet_id, key, value)
+                             for key, value in new_items])
+        self.db.commit()
+
+    @with_db_lock
+    def find_by_properties(self, tree_type=None, **criteria):
+        '''
+        function:: find_by_properties(tree_type=None, **criteria)
+        :param tree_type: restrict to a given tree. Ex : write
+        :param criteria: property key = value, ex: status="draft". The value
+        can be a (min, max) tuple, inclusive, compared as numbers if the
+        bounds are numbers, else as ISO dates ("2015-05-26"). A None bound is
+        open. For keys which aren't python names : **{"my key": value}
+        Query the property_index table, a temporary table (not saved with
+        the project), built on first use and kept in sync by set_properties()
+
+        return [sheet_id, ...] of the sheets matching every criterion, of
+        all the sheets without criteria. The root sheets are never returned
+        '''
+        if self.db is None:  # closed
+            return []
+        if criteria and not self._property_index_is_built():
+            self._build_property_index()
+
+        if tree_type is None:
+            query_list = ["SELECT sheet_id FROM main_table WHERE NOT is_root"]
+            parameter_list = []
+        else:
+            query_list = ["SELECT sheet_id FROM main_table WHERE tree=? AND NOT is_root"]
+            parameter_list = [tree_type]
+        for key, value in criteria.items():
+            if isinstance(value, (tuple, list)):
+                low, high = value
+                column = "number"
+                if not all(bound is None or isinstance(bound, (int, float))
+                           for bound in (low, high)):
+                    column = "date"
+                    low, high = [bound if bound is None else str(bound)[:10]
+                                 for bound in (low, high)]
+                condition = [column + " IS NOT NULL"]
+                if low is not None:
+                    condition.append(column + " >= ?")
+                if high is not None:
+                    condition.append(column + " <= ?")
+                query_list.append("SELECT sheet_id FROM property_index WHERE key=? AND "
+                                  + " AND ".join(condition))
+                parameter_list.extend([key] + [bound for bound in (low, high)
+                                               if bound is not None])
+            elif isinstance(value, (int, float)):
+                query_list.append("SELECT sheet_id FROM property_index WHERE key=? AND number=?")
+                parameter_list.extend([key, value])
+            else:
+                query_list.append("SELECT sheet_id FROM property_index WHERE key=? AND value=?")
+                parameter_list.extend([key, str(value)])
+
+        cur = self.db.cursor()
+        cur.execute(" INTERSECT ".join(query_list) + " ORDER BY sheet_id", parameter_list)
+        return [row[0] for row in cur.fetchall()]
+
+    @with_db_lock
+    def _property_index_is_built(self):
+        return self.db is not None and self._property_index_db is self.db
+
+    @with_db_lock
+    def _build_property_index(self):
+        cur = self.db.cursor()
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS property_index \
+        (key TEXT, value TEXT, number REAL, date TEXT, sheet_id INTEGER)")
+        cur.execute("DELETE FROM property_index")
+        cur.execute("CREATE INDEX IF NOT EXISTS temp.property_index_value ON property_index (key, value)")
+        cur.execute("CREATE INDEX IF NOT EXISTS temp.property_index_number ON property_index (key, number)")
+        cur.execute("CREATE INDEX IF NOT EXISTS temp.property_index_date ON property_index (key, date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS temp.property_index_sheet ON property_index (sheet_id)")
+
+        row_list = []
+        cur.execute("SELECT sheet_id, properties FROM main_table")
+        for sheet_id, properties in cur.fetchall():
+            for key, value in transform_properties_text_into_dict(properties).items():
+                row_list.append(transform_property_into_index_row(sheet_id, key, value))
+        cur.executemany("INSERT INTO property_index VALUES (?, ?, ?, ?, ?)", row_list)
+        self.db.commit()
+        self._property_index_db = self.db
+
+    @with_db_lock
+    def _index_properties(self, sheet_id, properties):
+        cur = self.db.cursor()
+        cur.execute("DELETE FROM property_index WHERE sheet_id=:id", {"id": sheet_id})
+        cur.executemany("INSERT INTO property_index VALUES (?, ?, ?, ?, ?)",
+                        [transform_property_into_index_row(sheet_id, key, value)
+                         for key, value in properties.items()])
+
+    @with_db_lock
     def get_modification_date(self, sheet_id):
         db = self.db
         cur = db.cursor()
@@ -258,6 +977,7 @@ class Tree(object):
             modification_date = row
         return modification_date
 
+    @with_db_lock
     def set_modification_date(self, sheet_id, modification_date):
         self.db.cursor().execute("UPDATE main_table SET modification_date=:modification_date WHERE sheet_id=:id",
                                  {"modification_date": modification_date, "id": sheet_id})
@@ -265,6 +985,7 @@ class Tree(object):
         subscriber.announce_update("data.tree.modification_date", sheet_id)
         subscriber.announce_update("data.project.notsaved")
 
+    @with_db_lock
     def get_creation_date(self, sheet_id):
         db = self.db
         cur = db.cursor()
@@ -275,6 +996,7 @@ class Tree(object):
             creation_date = row
         return creation_date
 
+    @with_db_lock
     def set_creation_date(self, sheet_id, creation_date):
         self.db.cursor().execute("UPDATE main_table SET creation_date=:creation_date WHERE sheet_id=:id",
                                  {"creation_date": creation_date, "id": sheet_id})
@@ -282,6 +1004,7 @@ class Tree(object):
         subscriber.announce_update("data.tree.creation_date", sheet_id)
         subscriber.announce_update("data.project.notsaved")
 
+    @with_db_lock
     def get_version(self, sheet_id):
         db = self.db
         cur = db.cursor()
@@ -292,6 +1015,7 @@ class Tree(object):
             version = row
         return version
 
+    @with_db_lock
     def set_version(self, sheet_id, version):
         self.db.cursor().execute("UPDATE main_table SET version=:version WHERE sheet_id=:id",
                                  {"version": version, "id": sheet_id})
@@ -300,17 +1024,29 @@ class Tree(object):
         subscriber.announce_update("data.project.notsaved")
 
 
+def transform_tree_model_row(row):
+    sheet_id, title, parent_id, children_id, properties = row
+    return (sheet_id, title, parent_id, transform_children_id_text_into_int_tuple(
+        children_id), transform_properties_text_into_dict(properties))
+
+
 def transform_children_id_text_into_int_tuple(children_id_text):
     int_tuple = ()
     int_list = []
     if children_id_text is not None:
         for txt in children_id_text.split(","):
-            if txt != None:
+            if txt != None and txt != "":
                 int_list.append(int(txt))
         int_tuple = tuple(int_list)
     return int_tuple
 
 
+def transform_int_list_into_children_id_text(children_list):
+    if len(children_list) == 0:
+        return None
+    return ",".join([str(child_id) for child_id in children_list])
+
+
 def transform_properties_text_into_dict(properties):
     properties_dict = {}
     if properties is not None:
@@ -319,6 +1055,26 @@ def transform_properties_text_into_dict(properties):
     return properties_dict
 
 
+def transform_property_into_index_row(sheet_id, key, value):
+    '''
+    return (key, value, number or None, ISO date or None, sheet_id), a row
+    of the property_index table
+    '''
+    value = str(value)
+    number = None
+    try:
+        number = float(value)
+    except ValueError:
+        pass
+    date = None
+    try:
+        datetime.strptime(value[:10], "%Y-%m-%d")
+        date = value[:10]
+    except ValueError:
+        pass
+    return (key, value, number, date, sheet_id)
+
+
 def transform_dict_into_text(properties):
     properties_str = "{}"
     if properties is not {}:
@@ -30,11 +30,18 @@ class SubWindow(QMainWindow):
         self.parent_window_system_controller.detach_sub_window(self)
         self._is_attached = False
 
+    def flush_content(self):
+        '''
+        Persist what the sub window buffers. Nothing by default.
+        '''
+        pass
+
     def attach_back_to_parent_window_system(self):
         self.parent_window_system_controller.attach_sub_window(self)
         self._is_attached = True
 
     def closeEvent(self,  event):
+        self.flush_content()
         if self.parent_window_system_controller != None:
             self.attach_back_to_parent_window_system()
             event.ignore()
@@ -75,6 +82,10 @@ class WritePanel(SubWindow, WindowSystemController):
         # set TabWidget:
         self.tab_widget = QTabWidget(self)
         self.setCentralWidget(self.tab_widget)
+        self.tab_widget.setTabsClosable(True)
+        self._current_write_tab = None
+        self.tab_widget.currentChanged.connect(self._flush_previous_tab)
+        self.tab_widget.tabCloseRequested.connect(self.close_write_tab)
 
         # subscribe
         cfg.core.subscriber.subscribe_update_func_to_domain(
@@ -88,11 +99,32 @@ class WritePanel(SubWindow, WindowSystemController):
         # temp for test:
         new_write_tab.dock_system.add_dock("properties-dock")
 
+    @pyqtSlot(int)
+    def close_write_tab(self, index):
+        write_tab = self.tab_widget.widget(index)
+        write_tab.flush_content()
+        if write_tab is self._current_write_tab:
+            self._current_write_tab = None
+        self.tab_widget.removeTab(index)
+        tree_sheet = write_tab.tree_sheet
+        write_tab.release_document()
+        # the manager keeps it loaded for a while, in case it's reopened :
+        cfg.core.tree_sheet_manager.close_sheet(tree_sheet)
+        write_tab.deleteLater()
+
+    @pyqtSlot(int)
+    def _flush_previous_tab(self, index):
+        if self._current_write_tab is not None:
+            self._current_write_tab.flush_content()
+        self._current_write_tab = self.tab_widget.widget(index)
+
     def _clear_project(self):
         # TODO: make that cleaner
+        self._current_write_tab = None
         for i in range(0, self.tab_widget.count()):
             widget = self.tab_widget.widget(i)
             widget.close()
+            widget.release_document()
             widget.deleteLater()
         self.tab_widget.clear()
 
@@ -136,23 +168,33 @@ class WriteTab(SubWindow):
 
     @tree_sheet.setter
     def tree_sheet(self, tree_sheet_object):
+        self.release_document()
         self._tree_sheet = tree_sheet_object
         self._load_from_tree_sheet(tree_sheet_object)
-        self.ui.writeTabWritingZone.text_edit.textChanged.connect(
-            self.save_content)
 
-    @pyqtSlot()
-    def save_content(self):
-        self._tree_sheet.set_content(
-            self.ui.writeTabWritingZone.text_edit.toHtml())
+    def flush_content(self):
+        if self._tree_sheet is not None:
+            cfg.core.document_registry.flush_document(
+                self._tree_sheet.sheet_id, "content")
+            self._tree_sheet.flush_content()
+
+    def release_document(self):
+        '''
+        function:: release_document()
+
+        Give back the shared document of the content, when closing
+        '''
+        if self._tree_sheet is not None:
+            cfg.core.document_registry.release(
+                self._tree_sheet.sheet_id, "content")
+            self._tree_sheet = None
 
     def _load_from_tree_sheet(self, tree_sheet_object):
-        cfg.core.subscriber.disable_func(self.save_content)
         self.tab_title = tree_sheet_object.get_title()
-        self.ui.writeTabWritingZone.set_rich_text(
-            tree_sheet_object.get_content())
+        # shared with the other views of the content, which save it :
+        self.ui.writeTabWritingZone.set_document(
+            cfg.core.document_registry.acquire(tree_sheet_object.sheet_id, "content"))
         self.dock_system.sheet_id = tree_sheet_object.sheet_id
-        cfg.core.subscriber.enable_func(self.save_content)
 
     def change_tab_title(self, new_title):
         tab_widget = self.parent().tab_widget
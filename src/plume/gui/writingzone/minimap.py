@@ -6,18 +6,31 @@ Created on 11 mai 2015
 
 from PyQt5.QtWidgets import QTextEdit, QMenu, QGraphicsView, QGraphicsScene, QLabel,\
     QGraphicsItem
-from PyQt5.QtCore import pyqtSlot, Qt, QThread, pyqtSignal, QRectF
+from PyQt5.QtCore import pyqtSlot, Qt, QThread, pyqtSignal, QRectF, QTimer
 from PyQt5.QtGui import QPixmap, QPalette, QTextBlockFormat
 from PyQt5.Qt import QPainterPath, QImage, QPainter, QPen, QPoint, QRect,\
     QAbstractTextDocumentLayout, QFontMetrics
 from PyQt5.QtOpenGL import QGLWidget
+try:
+    import numpy
+except ImportError:  # the minimap is drawn with QPainter
+    numpy = None
 
 
 class Minimap(QGraphicsView):
 
     '''
     Minimap
+    Drawn in tiles of tile_height px, rendered around the visible part only
     '''
+    # ms of idle after an edit before the minimap is rendered again
+    render_delay = 500
+    # px of minimap per tile
+    tile_height = 512
+    # tiles kept, the least recently shown ones are dropped beyond
+    max_tiles = 12
+    # px rendered above and below the visible part
+    tile_margin = 256
 
     def __init__(self, parent=0):
         '''
@@ -37,14 +50,29 @@ class Minimap(QGraphicsView):
         self.nav_cursor = Cursor()
         self.nav_cursor.graphics_view = self
         self._scene.addItem(self.nav_cursor)
-        self._graphic_item_list = []
-        self._pixmap = None
+        self.nav_cursor.setZValue(1)
         self._text_edit = None
+        self._document = None
+        self._scrollbar = None
         self._abstract_doc_layout = None
         self._is_cursor_moved = False
 
+        self._layout = MinimapLayout()
+        # (width, tab_chars) of the items
+        self._item_layout = None
+        # tile index -> [QGraphicsPixmapItem, is_stale], least recently
+        # shown first
+        self._tile_dict = OrderedDict()
+        self._map_width = 1
+
+        # incremented at each edit, a render of an older one is dropped :
+        self._generation = 0
+        self._render_timer = QTimer(self)
+        self._render_timer.setSingleShot(True)
+        self._render_timer.timeout.connect(self._request_tiles)
+
         self._img_generator = ImageGenerator()
-        self._img_generator.image_generated.connect(self._update_with)
+        self._img_generator.tile_generated.connect(self._add_tile)
         # self.setBackgroundRole(QPalette.Dark)
 
     @property
@@ -56,15 +84,46 @@ class Minimap(QGraphicsView):
         if not isinstance(text_edit, QTextEdit):
             pass
         self._text_edit = text_edit
-        self._text_edit.textChanged.connect(self.update)
         self._scrollbar = self._text_edit.verticalScrollBar()
         self._scrollbar.valueChanged.connect(self._change_cursor_pos)
+        self.set_document(text_edit.document())
+
+    def set_document(self, document):
+        '''
+        function:: set_document(document)
+        :param document: QTextDocument of the text edit, to follow after
+        QTextEdit.setDocument()
+        '''
+        if self._document is not None:
+            try:
+                self._document.contentsChange.disconnect(self._apply_contents_change)
+            except (TypeError, RuntimeError):  # disconnected, or deleted by the text edit
+                pass
+        self._document = document
+        document.contentsChange.connect(self._apply_contents_change)
+        self._layout.reset(document.blockCount())
+        self._clear_tiles()
+        self.update()
+
+    @pyqtSlot(int, int, int)
+    def _apply_contents_change(self, position, chars_removed, chars_added):
+        head, tail = changed_block_range(self._document, position, chars_added)
+        self._layout.apply_change(head, tail, self._document.blockCount())
+        self.update()
 
     @pyqtSlot()
     def update(self):
+        '''
+        function:: update()
+
+        The edits are gathered : the render starts after render_delay ms
+        without edit, and the render of a previous edit is cancelled.
+        '''
         if self._is_cursor_moved:
             pass
-        self._generate_image(self.text_edit)
+        self._generation += 1
+        self._img_generator.cancel(self._generation)
+        self._render_timer.start(self.render_delay)
 
     def _change_scrollbar_value(self, value):
         self._scrollbar.setValue(value)
@@ -73,74 +132,131 @@ class Minimap(QGraphicsView):
 
         # self._image_label.setFixedHeight(self.height())
         # self._image_label.setFixedWidth(self.width())
-        return QGraphicsView.resizeEvent(self, event)
+        result = QGraphicsView.resizeEvent(self, event)
+        self._change_cursor_pos()
+        return result
 
 #--------------------------------------------------------------------------
-    def _generate_image(self, text_edit):
-
-        doc = text_edit.document()
-
-        item_list = []
-        for i in range(0, doc.blockCount()):
-            block = doc.findBlockByNumber(i)
-            item = DocItem()
-            item.block_text = block.text()
-            item.text_format = block.blockFormat()
-            item.width = text_edit.viewport().width()
-            layout = block.layout()
-            item.lines = []
-            if layout:
-                for i in range(0, layout.lineCount()):
-                    item.lines.append(layout.lineAt(i))
-
-            item_list.append(item)
-        self._img_generator.set_items(item_list)
-        self._img_generator.start()
-
-    @pyqtSlot('QPixmap')
-    def _update_with(self, pixmap):
-        for g_item in self._graphic_item_list:
-            if g_item.name == "map":
-                self._scene.removeItem(g_item)
-                self._graphic_item_list.remove(g_item)
-                del g_item
-
-        item = self._scene.addPixmap(pixmap)
-        item.name = "map"
-        item.setPos(0, 0)
-        self._pixmap = pixmap
-        self._graphic_item_list.append(item)
-
-        self.setFixedWidth(pixmap.width())
+    def _sync_layout(self):
+        # read the changed blocks, and mark the tiles showing them as stale
+        text_edit = self._text_edit
+        document = self._document
+        item_layout = (text_edit.viewport().width(), tab_chars(text_edit.fontMetrics()))
+        if item_layout != self._item_layout or self._layout.block_count() != document.blockCount():
+            # every block is drawn again :
+            self._item_layout = item_layout
+            self._layout.reset(document.blockCount())
+        changed_range = self._layout.fill(document, item_layout[0], item_layout[1])
+        if changed_range is None:
+            return
+        top, bottom = changed_range
+        for tile_index, tile in list(self._tile_dict.items()):
+            tile_top = tile_index * self.tile_height
+            if tile_top >= self._layout.height and tile_index > 0:
+                # beyond the end :
+                self._scene.removeItem(tile[0])
+                del self._tile_dict[tile_index]
+            elif tile_top + self.tile_height > top and (bottom is None or tile_top < bottom):
+                tile[1] = True
+        self._update_geometry()
+
+    @pyqtSlot()
+    def _request_tiles(self):
+        '''
+        function:: _request_tiles()
+
+        Render the missing or stale tiles around the visible part
+        '''
+        if self._text_edit is None:
+            return
+        self._sync_layout()
+        view_top = self._view_top()
+        first_tile = max((view_top - self.tile_margin) // self.tile_height, 0)
+        last_tile = min((view_top + self.viewport().height() + self.tile_margin) // self.tile_height,
+                        max(self._layout.height - 1, 0) // self.tile_height)
+
+        tile_list = []
+        for tile_index in range(first_tile, last_tile + 1):
+            tile = self._tile_dict.get(tile_index)
+            if tile is not None:
+                self._tile_dict.move_to_end(tile_index)
+                if not tile[1]:
+                    continue
+            tile_top = tile_index * self.tile_height
+            item_list, top = self._layout.items_between(tile_top, tile_top + self.tile_height)
+            tile_list.append((tile_index, item_list, top))
+        if tile_list != []:
+            self._img_generator.submit(self._generation, tile_list, self.tile_height)
+
+    @pyqtSlot(int, int, QImage)
+    def _add_tile(self, generation, tile_index, image):
+        if generation != self._generation:  # the text changed since
+            return
+        pixmap = QPixmap.fromImage(image, Qt.AutoColor)
+        tile = self._tile_dict.get(tile_index)
+        if tile is None:
+            item = self._scene.addPixmap(pixmap)
+            item.setPos(0, tile_index * self.tile_height)
+            self._tile_dict[tile_index] = [item, False]
+        else:
+            tile[0].setPixmap(pixmap)
+            tile[1] = False
+            self._tile_dict.move_to_end(tile_index)
+        # the memory doesn't depend on the length of the sheet :
+        while len(self._tile_dict) > self.max_tiles:
+            _, (item, _) = self._tile_dict.popitem(last=False)
+            self._scene.removeItem(item)
+
+        if pixmap.width() > self._map_width:
+            self._map_width = pixmap.width()
+            self._update_geometry()
+
+    def _clear_tiles(self):
+        for item, _ in self._tile_dict.values():
+            self._scene.removeItem(item)
+        self._tile_dict = OrderedDict()
+
+    def _update_geometry(self):
+        minimap_height = self._layout.height
+        self._scene.setSceneRect(0, 0, self._map_width, max(minimap_height, 1))
+        self.setFixedWidth(self._map_width)
 
         # cursor :
-        self.nav_cursor.setZValue(1)
         # width :
-        self.nav_cursor.set_width(pixmap.width())
+        self.nav_cursor.set_width(self._map_width)
         # height :
         text_edit_height = self.text_edit.height()
         doc_height = self.text_edit.document().size().height()
-        minimap_height = self._pixmap.height()
         self.nav_cursor.set_minimap_height(minimap_height)
-        ratio = doc_height / text_edit_height
-        cursor_height = minimap_height / ratio
-        self.nav_cursor.set_height(cursor_height)
+        if doc_height > 0:
+            ratio = doc_height / text_edit_height
+            self.nav_cursor.set_height(minimap_height / ratio)
         # position :
-        self._change_cursor_pos()
+        self._place_cursor()
+
+    def _scroll_ratio(self):
+        scroll_max = self._scrollbar.maximum()
+        if scroll_max == 0:
+            return 0
+        return self._scrollbar.value() / scroll_max
+
+    def _view_top(self):
+        # the view and the cursor follow the same scroll ratio :
+        return int(self._scroll_ratio() * max(self._layout.height - self.viewport().height(), 0))
 
     def _change_cursor_pos(self):
-        if self._is_cursor_moved == True:
+        self._place_cursor()
+        self._request_tiles()
+
+    def _place_cursor(self):
+        if self._is_cursor_moved == True or self._scrollbar is None:
             return
-        scroll_value = self._scrollbar.value()
-        scroll_max = self._scrollbar.maximum()
-        available_height_for_cursor = self._pixmap.height(
-        ) - self.nav_cursor.height()
-        if scroll_max != 0:
-            pos_ratio = scroll_value / scroll_max
+        pos_ratio = self._scroll_ratio()
+        available_height_for_cursor = max(self._layout.height - self.nav_cursor.height(), 0)
+        if self._scrollbar.maximum() != 0:
             self.nav_cursor.pos_ratio = pos_ratio
-            self.nav_cursor.setPos(0, available_height_for_cursor * pos_ratio)
-        else:
-            self.nav_cursor.setPos(0, 0)
+        self.nav_cursor.setPos(0, available_height_for_cursor * pos_ratio)
+        self.verticalScrollBar().setValue(self._view_top())
 
 
 class Cursor(QGraphicsItem):
@@ -231,7 +347,394 @@ class Cursor(QGraphicsItem):
                 self.graphics_view._change_scrollbar_value(
                     int(r / self.pos_ratio))
 
+import bisect
 import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+
+# character classes of DocItem._prepared_text(), and ARGB32 colors :
+CODE_SPACE = 0
+CODE_CHAR = 1
+CODE_TAB = 2
+WHITE = 0xFFFFFFFF
+BLACK = 0xFF000000
+
+if numpy is not None:
+    _ASCII_CODES = numpy.array([CODE_TAB if point == 9
+                                else CODE_CHAR if chr(point).isalnum()
+                                else CODE_SPACE for point in range(128)], numpy.uint8)
+
+
+def char_codes(text):
+    '''
+    function:: char_codes(text)
+    :param text:
+    :rtype: numpy uint8 array of the class of each character, CODE_CHAR,
+    CODE_SPACE or CODE_TAB. Needs numpy
+    '''
+    points = numpy.frombuffer(text.encode("utf-32-le"), numpy.uint32)
+    codes = numpy.zeros(len(points), numpy.uint8)
+    is_ascii = points < 128
+    codes[is_ascii] = _ASCII_CODES[points[is_ascii]]
+    # usually a few accented letters :
+    for point in numpy.unique(points[~is_ascii]):
+        if chr(point).isalnum():
+            codes[points == point] = CODE_CHAR
+    return codes
+
+
+def new_image_array(width, height):
+    '''
+    function:: new_image_array(width, height)
+    :param width:
+    :param height:
+    :rtype: (QImage, numpy array of its pixels). Writing in the array writes
+    in the image, without copy. Needs numpy
+    '''
+    image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    bits = image.bits()
+    bits.setsize(image.byteCount())
+    array = numpy.frombuffer(bits, numpy.uint32).reshape(
+        height, image.bytesPerLine() // 4)[:, :width]
+    array.fill(WHITE)
+    return image, array
+
+
+def generate_block_arrays(item_list):
+    '''
+    function:: generate_block_arrays(item_list)
+    :param item_list: list of DocItem
+
+    Draw the blocks of all the items at once, with array operations : the
+    pixels DocItem._generate_image() draws with QPainter. Needs numpy
+    :rtype: list of numpy arrays, one per item, in the order of item_list.
+    The items are not modified
+    '''
+    if item_list == []:
+        return []
+    # each character is a w + 1 px wide column, each line 2 * h px high
+    h = 2
+    w = 1
+
+    texts = [item.block_text for item in item_list]
+    codes = char_codes("".join(texts))
+    text_lengths = numpy.array([len(text) for text in texts], numpy.intp)
+    text_starts = numpy.cumsum(text_lengths) - text_lengths
+
+    # first character of each line, for all the blocks :
+    line_start_list = []
+    line_count_list = []
+    for item, text_start, text_length in zip(item_list, text_starts.tolist(), text_lengths.tolist()):
+        starts = sorted(set(start for start in item.line_starts if 0 < start < text_length))
+        line_start_list.append(text_start)
+        line_start_list.extend(text_start + start for start in starts)
+        line_count_list.append(1 + len(starts))
+    line_starts = numpy.array(line_start_list, numpy.intp)
+    line_counts = numpy.array(line_count_list, numpy.intp)
+
+    # columns, with the tabs expanded :
+    tab_widths = numpy.repeat(numpy.array([item.tab_chars for item in item_list], numpy.intp),
+                              text_lengths)
+    widths = numpy.where(codes == CODE_TAB, tab_widths, 1)
+    ends = numpy.cumsum(widths)
+    starts = ends - widths
+    # an empty block shares its start with the next line, which wins. A
+    # trailing one starts after the last character, at column 0 if the
+    # blocks are all empty :
+    line_of_char = numpy.searchsorted(line_starts, numpy.arange(len(codes)), side="right") - 1
+    line_first_columns = numpy.append(starts, ends[-1:] if len(codes) else [0])[line_starts]
+    columns = starts - line_first_columns[line_of_char]
+
+    block_of_line = numpy.repeat(numpy.arange(len(item_list)), line_counts)
+    block_columns = numpy.ones(len(item_list), numpy.intp)
+    numpy.maximum.at(block_columns, block_of_line[line_of_char], columns + widths)
+
+    # the columns with a character, for each line :
+    column_count = int(block_columns.max())
+    is_char = codes == CODE_CHAR
+    mask = numpy.zeros((len(line_starts), column_count), numpy.bool_)
+    mask[line_of_char[is_char], columns[is_char]] = True
+
+    # all the blocks, one under the other. A character is drawn from the
+    # second pixel row of its line, h + 1 px high and w + 1 px wide :
+    batch = numpy.empty((len(line_starts), h * 2, column_count, w + 1), numpy.uint32)
+    batch[:, 0, :, :] = WHITE
+    batch[:, 1:h + 2, :, :] = numpy.where(mask, BLACK, WHITE)[:, None, :, None]
+    batch[:, h + 2:, :, :] = WHITE
+    batch = batch.reshape(len(line_starts) * h * 2, column_count * (w + 1))
+
+    first_lines = numpy.cumsum(line_counts) - line_counts
+    # copies, so the cache doesn't keep the whole batch :
+    return [batch[first_line * h * 2:(first_line + line_count) * h * 2,
+                  :column_count * (w + 1)].copy()
+            for first_line, line_count, column_count in zip(
+                first_lines.tolist(), line_count_list, block_columns.tolist())]
+
+
+def block_format_key(text_format):
+    '''
+    function:: block_format_key(text_format)
+    :param text_format: QTextBlockFormat or None
+    :rtype: tuple of the block format properties changing the layout
+    '''
+    if text_format is None:
+        return None
+    return (int(text_format.alignment()), text_format.indent(), text_format.textIndent(),
+            text_format.leftMargin(), text_format.rightMargin(),
+            text_format.topMargin(), text_format.bottomMargin(),
+            text_format.lineHeight(), text_format.lineHeightType())
+
+
+class BlockImageCache():
+
+    '''
+    BlockImageCache
+    Block images by DocItem.hash, shared by all the minimaps. The least
+    recently used images are evicted beyond max_bytes.
+    '''
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        '''
+        Constructor
+        '''
+
+        super(BlockImageCache, self).__init__()
+
+        self.max_bytes = max_bytes
+        # hash -> (image or numpy array, bytes), least recently used first
+        self._entry_dict = OrderedDict()
+        self._lock = threading.Lock()
+        self.byte_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''
+        function:: get(key)
+        :param key: DocItem.hash
+        :rtype: the image, or None
+        '''
+        with self._lock:
+            entry = self._entry_dict.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entry_dict.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, image, byte_count):
+        '''
+        function:: put(key, image, byte_count)
+        :param key: DocItem.hash
+        :param image: QImage or numpy array, not modified afterwards
+        :param byte_count: memory used by image
+        '''
+        with self._lock:
+            old_entry = self._entry_dict.pop(key, None)
+            if old_entry is not None:
+                self.byte_count -= old_entry[1]
+            self._entry_dict[key] = (image, byte_count)
+            self.byte_count += byte_count
+            while self.byte_count > self.max_bytes and self._entry_dict:
+                _, (_, evicted_byte_count) = self._entry_dict.popitem(last=False)
+                self.byte_count -= evicted_byte_count
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entry_dict = OrderedDict()
+            self.byte_count = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __len__(self):
+        return len(self._entry_dict)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    def __repr__(self):
+        return "BlockImageCache({0} images, {1}/{2} bytes, {3} hits, {4} misses, " \
+            "{5} evicted, hit rate {6:.2f})".format(
+                len(self._entry_dict), self.byte_count, self.max_bytes, self.hits,
+                self.misses, self.evictions, self.hit_rate)
+
+
+# shared by the minimaps of all the tabs :
+block_image_cache = BlockImageCache()
+
+
+def tab_chars(font_metrics):
+    '''
+    function:: tab_chars(font_metrics)
+    :param font_metrics: QFontMetrics of the text
+    :rtype: number of characters drawn for a tab
+    '''
+    # range of tab:
+    tab_default = 80
+    return max(1, int(tab_default / font_metrics.width("m")))
+
+
+def make_doc_items(document, width, tab_chars=8, first=0, end=None):
+    '''
+    function:: make_doc_items(document, width, tab_chars=8, first=0, end=None)
+    :param document: QTextDocument, laid out
+    :param width: width of the text edit viewport
+    :param tab_chars: see tab_chars()
+    :param first: number of the first block
+    :param end: number of the block after the last one, None for all
+    :rtype: list of DocItem, one per block. They hold no reference to the
+    document, so they can be rendered in another thread
+    '''
+    if end is None:
+        end = document.blockCount()
+    item_list = []
+    block = document.findBlockByNumber(first)
+    while block.isValid() and len(item_list) < end - first:
+        item = DocItem()
+        item.block_text = block.text()
+        item.text_format = block.blockFormat()
+        item.width = width
+        item.tab_chars = tab_chars
+        layout = block.layout()
+        if layout and layout.lineCount() == 0:
+            # not laid out yet by the text edit :
+            document.documentLayout().blockBoundingRect(block)
+        if layout:
+            item.line_starts = [layout.lineAt(i).textStart()
+                                for i in range(0, layout.lineCount())]
+        item_list.append(item)
+        block = block.next()
+    return item_list
+
+
+def changed_block_range(document, position, chars_added):
+    '''
+    function:: changed_block_range(document, position, chars_added)
+    :param document: QTextDocument, after the change
+    :param position: from QTextDocument.contentsChange
+    :param chars_added: from QTextDocument.contentsChange
+    :rtype: (head, tail), the number of unchanged blocks at the beginning
+    and at the end of the document
+    '''
+    # contentsChange may go beyond the last character :
+    last_position = max(document.characterCount() - 1, 0)
+    first_block = document.findBlock(min(position, last_position))
+    last_block = document.findBlock(min(position + chars_added, last_position))
+    head = max(first_block.blockNumber(), 0)
+    tail = max(document.blockCount() - 1 - max(last_block.blockNumber(), head), 0)
+    return head, tail
+
+
+def merge_dirty_ranges(dirty_range, other_range):
+    '''
+    function:: merge_dirty_ranges(dirty_range, other_range)
+    :param dirty_range: (head, tail), see changed_block_range(), or None if
+    nothing changed
+    :param other_range: the same, for a later change
+    :rtype: (head, tail) of the blocks unchanged by both, or None
+    '''
+    if dirty_range is None:
+        return other_range
+    if other_range is None:
+        return dirty_range
+    return min(dirty_range[0], other_range[0]), min(dirty_range[1], other_range[1])
+
+
+class MinimapLayout():
+
+    '''
+    MinimapLayout
+    One DocItem per block, with its height and its position in the minimap
+    '''
+
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        super(MinimapLayout, self).__init__()
+        self.reset(0)
+
+    def reset(self, block_count):
+        '''
+        function:: reset(block_count)
+        :param block_count: every block is read again at the next fill()
+        '''
+        # None for the blocks changed since fill() :
+        self._item_list = [None] * block_count
+        self._heights = [0] * block_count
+        # y of each block, then the height of the minimap :
+        self._tops = [0] * (block_count + 1)
+        self.height = 0
+        # (head, tail) unchanged blocks since fill(), None if clean
+        self._dirty_range = (0, 0)
+
+    def block_count(self):
+        return len(self._item_list)
+
+    def apply_change(self, head, tail, block_count):
+        '''
+        function:: apply_change(head, tail, block_count)
+        :param head: see changed_block_range()
+        :param tail: see changed_block_range()
+        :param block_count: of the document, after the change
+        '''
+        # the unchanged blocks of the end are in the old list too :
+        tail = min(tail, max(len(self._item_list) - head, 0))
+        old_end = len(self._item_list) - tail
+        new_count = block_count - tail - head
+        self._item_list[head:old_end] = [None] * new_count
+        self._heights[head:old_end] = [0] * new_count
+        self._dirty_range = merge_dirty_ranges(self._dirty_range, (head, tail))
+
+    def fill(self, document, width, tab_chars):
+        '''
+        function:: fill(document, width, tab_chars)
+        :param document: QTextDocument, laid out
+        :param width: see make_doc_items()
+        :param tab_chars: see make_doc_items()
+        :rtype: (top, bottom) px of the minimap to draw again, bottom None if
+        the blocks below moved. None if nothing changed
+
+        Read the changed blocks only
+        '''
+        if self._dirty_range is None:
+            return None
+        head, tail = self._dirty_range
+        end = len(self._item_list) - tail
+        item_list = make_doc_items(document, width, tab_chars, head, end)
+        self._item_list[head:end] = item_list
+        self._heights[head:end] = [item.height for item in item_list]
+        self._dirty_range = None
+
+        old_height = self.height
+        self._tops = [0]
+        self._tops.extend(itertools.accumulate(self._heights))
+        self.height = self._tops[-1]
+        if self.height != old_height:
+            return self._tops[head], None
+        # same height, so the blocks below didn't move :
+        return self._tops[head], self._tops[end]
+
+    def items_between(self, top, bottom):
+        '''
+        function:: items_between(top, bottom)
+        :param top: px
+        :param bottom: px
+        :rtype: (list of the DocItem shown between top and bottom, y of the
+        first one minus top)
+        '''
+        first = max(bisect.bisect_right(self._tops, top) - 1, 0)
+        end = min(bisect.bisect_left(self._tops, bottom), len(self._item_list))
+        return self._item_list[first:end], self._tops[first] - top
 
 
 class DocItem():
@@ -244,21 +747,36 @@ class DocItem():
         super(DocItem, self).__init__()
         self.block_text = ''
         self.text_format = None
-        self._hash = ''
+        self._hash = None
         self.index = None
         self._image = None
         self.width = None
-        self.lines = []
+        # position in block_text of each line of the layout
+        self.line_starts = []
+        self.tab_chars = 8
 
     @property
     def hash(self):
-        if self._hash is "":  # generate hash from text and format
+        '''
+        key of the block image : digest of everything drawn or changing the
+        layout, the text, the line starts, the format and the width
+        '''
+        if self._hash is None:  # generate hash from text and format
             m = hashlib.md5()
             m.update(bytes(self.block_text, "utf-8"))
-            m.update(bytes(self.width))
+            m.update(repr((self.line_starts, self.tab_chars, self.width,
+                           block_format_key(self.text_format))).encode("utf-8"))
             self._hash = m.digest()
         return self._hash
 
+    @property
+    def height(self):
+        '''
+        px of the block image : 2 * h px per line, see _generate_image()
+        '''
+        length = len(self.block_text)
+        return 4 * (1 + len(set(start for start in self.line_starts if 0 < start < length)))
+
     def __eq__(self, other):
         if self.hash == other.hash:
             return True
@@ -273,105 +791,78 @@ class DocItem():
         return self._image
 
     def _generate_image(self):
+        if numpy is not None:
+            block_array = generate_block_arrays([self])[0]
+            height, width = block_array.shape
+            image, array = new_image_array(width, height)
+            array[:] = block_array
+            return image
+
+        # each character is a w + 1 px wide column, each line 2 * h px high
         h = 2
         w = 1
+        tab_chars = self.tab_chars
 
-        def draw_char(pos, pen_color):
-            pix_paint.setPen(QPen(pen_color))
-
-            rect = QRect(i * w + i, 1, w, h)
-            pix_paint.drawRect(rect)
-            pix_paint.fillRect(rect, pen_color)
-
-        # range of tab:
-        tab_default = 80
-
-        text = "m"
-        px = QPixmap(100, 100)
-        p = QPainter(px)
-        fm = p.fontMetrics()
-        width = fm.width(text)
-        p.end()
-        number_chars_in_one_tab = int(tab_default / width)
-
-        p_text = self._prepared_text()
-        split_p_text = p_text.split("N")
-
-        pix_list = []
-        for text in split_p_text:
-            line_num = 0
-            i = 0
-            length = len(text)
-            if length == 0:
-                length = 1
-            pixmap = QImage(
-                length * w + length, h * 2, QImage.Format_ARGB32_Premultiplied)
-            pixmap.fill(Qt.white)
-            pix_paint = QPainter(pixmap)
-
-            for char in text:
-                if char == "c":
-                    draw_char(i, Qt.black)
-                if char == "t":
-                    for _ in range(0, number_chars_in_one_tab):
-                        draw_char(i, Qt.transparent)
-                        i += 1
-                if char == "_":
-                    draw_char(i, Qt.transparent)
-                i += 1
-
-            pix_list.append(pixmap)
-            line_num += 1
-        pix_paint.end()
-        # find max width:
-        width_list = [pix.width() for pix in pix_list]
-        max_width = max(width_list)
-
-        image = QImage(max_width, pix_list[
-                       0].height() * len(pix_list), QImage.Format_ARGB32_Premultiplied)
+        lines = self._prepared_text().split("N")
+        max_columns = 1
+        for line in lines:
+            max_columns = max(max_columns, len(line) + line.count("t") * (tab_chars - 1))
+
+        image = QImage(max_columns * (w + 1), h * 2 * len(lines),
+                       QImage.Format_ARGB32_Premultiplied)
         image.fill(Qt.white)
         painter = QPainter(image)
-        for pix in pix_list:
-            y = pix_list[0].height() * pix_list.index(pix)
-            painter.drawImage(0, y, pix)
-
+        for line_number, line in enumerate(lines):
+            y = line_number * h * 2 + 1
+            column = 0
+            run_start = None  # first column of the current word
+            for char in line:
+                if char == "c":
+                    if run_start is None:
+                        run_start = column
+                    column += 1
+                    continue
+                if run_start is not None:
+                    painter.fillRect(run_start * (w + 1), y, (column - run_start) * (w + 1), h + 1,
+                                     Qt.black)
+                    run_start = None
+                if char == "t":
+                    column += tab_chars
+                else:
+                    column += 1
+            if run_start is not None:
+                painter.fillRect(run_start * (w + 1), y, (column - run_start) * (w + 1), h + 1,
+                                 Qt.black)
         painter.end()
         return image
 
     def _prepared_text(self):
-        return_pos_list = []
-        for line in self.lines:
-            return_pos_list.append(line.textStart())
-
-        indent = self.text_format.textIndent()
-        l_margin = self.text_format.leftMargin()
-        r_margin = self.text_format.rightMargin()
-
-        string = self.block_text
-        final = ''
-        i = 0
-        for char in string:
-            if i in return_pos_list and i != 0:
-                final = "".join([final, "N"])  # line return
+        # one code per character : "c" char, "_" space, "t" tab, and "N"
+        # before each line return
+        return_pos_set = set(self.line_starts)
+        return_pos_set.discard(0)
+
+        code_list = []
+        for i, char in enumerate(self.block_text):
+            if i in return_pos_set:
+                code_list.append("N")  # line return
             if char == "\t":
-                final = "".join([final, "t"])  # tab
-            if char.isalnum():
-                final = "".join([final, "c"])  # char
+                code_list.append("t")  # tab
+            elif char.isalnum():
+                code_list.append("c")  # char
             else:
-                final = "".join([final, "_"])  # space
-            i += 1
-        return final
-
-
-import time
+                code_list.append("_")  # space
+        return "".join(code_list)
 
 
 class ImageGenerator(QThread):
 
     '''
     ImageGenerator
+    Renders the tiles requested by a minimap, one job at a time. Only the
+    latest job waits : a new one replaces it, and cancels the running one.
     '''
-    image_generated = pyqtSignal('QPixmap', name="image_generated")
+    tile_generated = pyqtSignal(int, int, QImage, name="tile_generated")
 
     def __init__(self):
         '''
@@ -379,71 +870,142 @@ class ImageGenerator(QThread):
         '''
         super(ImageGenerator, self).__init__()
 
-        self._old_item_list = {}
-        self._old_hash_item_dict = {}
+        self.block_image_cache = block_image_cache
         self._max_width_found = 30
 
-    def set_items(self, item_list):
-        self._item_list = item_list
+        self._condition = threading.Condition()
+        # (generation, tile_list, tile_height) waiting for the thread
+        self._pending_job = None
+        # the jobs of an older generation are cancelled :
+        self._latest_generation = 0
+        self._is_working = False
 
-    def run(self):
+    def submit(self, generation, tile_list, tile_height):
+        '''
+        function:: submit(generation, tile_list, tile_height)
+        :param generation: int, sent back with the tiles
+        :param tile_list: list of (tile_index, item_list, top), see
+        MinimapLayout.items_between()
+        :param tile_height: px
+        '''
+        with self._condition:
+            self._pending_job = (generation, tile_list, tile_height)
+            self._latest_generation = generation
+            if self._is_working:
+                return
+            self._is_working = True
+        # the thread may still be returning from its last job :
+        self.wait()
+        self.start()
+
+    def cancel(self, generation):
+        '''
+        function:: cancel(generation)
+        :param generation: the jobs older than it are cancelled
+        '''
+        with self._condition:
+            self._latest_generation = generation
+            if self._pending_job is not None and self._pending_job[0] < generation:
+                self._pending_job = None
 
-        time.sleep(0.5)
-        # create hash dict of current list
-        self._hash_item_dict = {}
-        for item in self._item_list:
-            self._hash_item_dict[item.hash] = item
-
-        # compare and swap between lists if new item is not generated
-        for new_hash in self._hash_item_dict.keys():
-            if new_hash in self._old_hash_item_dict.keys():
-                # swap to avoid generating uselessly :
-                self._hash_item_dict[
-                    new_hash] = self._old_hash_item_dict[new_hash]
-            else:  # generate
-                _ = self._hash_item_dict[new_hash].image
-
-        # append generated images
-        # images_list.append()
-        pix_list = []
-        for new_item in self._item_list:
-            usable_item = self._hash_item_dict[new_item.hash]
-            pix_list.append(usable_item.image)
-
-        # draw pixmaps in one :
-        image = QImage(20, 20, QImage.Format_ARGB32_Premultiplied)
+    def run(self):
+        while True:
+            with self._condition:
+                job = self._pending_job
+                self._pending_job = None
+                if job is None:
+                    self._is_working = False
+                    return
+            generation, tile_list, tile_height = job
+
+            def is_cancelled():
+                # a newer job asks again for the tiles it still needs :
+                return generation != self._latest_generation or self._pending_job is not None
+            for tile_index, item_list, top in tile_list:
+                image = self.render_tile(item_list, top, tile_height, is_cancelled)
+                if image is None:
+                    break
+                self.tile_generated.emit(generation, tile_index, image)
+
+    def render_tile(self, item_list, top, height, is_cancelled=None):
+        '''
+        function:: render_tile(item_list, top, height, is_cancelled=None)
+        :param item_list: list of DocItem, the blocks shown in the tile
+        :param top: px, y of the first block in the tile, 0 or less
+        :param height: px, of the tile
+        :param is_cancelled: optional callable, checked between the steps
+        :rtype: QImage of the tile, or None if cancelled
+
+        The block images are taken from block_image_cache, or drawn and
+        cached.
+        '''
+        block_image_list = self._block_images(item_list, is_cancelled)
+        if block_image_list is None:
+            return None
+
+        if numpy is not None:
+            for block_array in block_image_list:
+                self._max_width_found = max(self._max_width_found, block_array.shape[1])
+            image, array = new_image_array(self._max_width_found, height)
+            y = top
+            for block_array in block_image_list:
+                # only the rows inside the tile :
+                first_row = max(-y, 0)
+                end_row = min(height - y, block_array.shape[0])
+                if end_row > first_row:
+                    array[y + first_row:y + end_row, :block_array.shape[1]] = \
+                        block_array[first_row:end_row]
+                y += block_array.shape[0]
+            return image
+
+        for block_image in block_image_list:
+            self._max_width_found = max(self._max_width_found, block_image.width())
+        image = QImage(self._max_width_found, height, QImage.Format_ARGB32_Premultiplied)
         image.fill(Qt.white)
-        point = QPoint(0, 0)
-        width_list = [pix.width() for pix in pix_list]
-        max_width = max(width_list)
-        self._max_width_found = max([max_width, self._max_width_found])
-        for pix in pix_list:
-
-            last_image = image
-            image = QImage(self._max_width_found, image.height(
-            ) + pix.height(), QImage.Format_ARGB32_Premultiplied)
-            pix_paint = QPainter(image)
-            image.fill(Qt.white)
-            pix_paint.drawImage(0, 0, last_image)
-            pix_paint.drawImage(point, pix)
-            point = QPoint(0, point.y() + pix.height())
-            pix_paint.end()
-        '''
-        pixmap = QImage(21,21, QImage.Format_ARGB32_Premultiplied) # temp
-        pixPaint = QPainter(pixmap)
-        myPen = QPen( Qt.black)
-        pixPaint.setPen(myPen)
-        pixPaint.drawRect(0,0, 20,20);
-        pixPaint.end()
-        image = pixmap
-
-            painter.drawImage(point, pix)
-            point = QPoint(0, point.y() + pix.height())
+        # clipped to the tile :
+        painter = QPainter(image)
+        y = top
+        for block_image in block_image_list:
+            painter.drawImage(0, y, block_image)
+            y += block_image.height()
         painter.end()
-          '''
-
-        final_pixmap = QPixmap.fromImage(image, Qt.AutoColor)
-        self.image_generated.emit(final_pixmap)
+        return image
 
-        self._old_item_list = self._item_list
-        self._old_hash_item_dict = self._hash_item_dict
+    def _block_images(self, item_list, is_cancelled):
+        # block images (numpy arrays with numpy) of the items, or None if
+        # cancelled. hash -> image, for the blocks of this document :
+        image_dict = {}
+        # hash -> DocItem, the blocks to draw
+        missing_item_dict = {}
+        for item in item_list:
+            key = item.hash
+            if key in image_dict or key in missing_item_dict:
+                continue
+            image = self.block_image_cache.get(key)
+            if image is None:
+                missing_item_dict[key] = item
+            else:
+                image_dict[key] = image
+
+        if is_cancelled is not None and is_cancelled():
+            return None
+
+        # the pixels are only kept by the cache, not by the items of the
+        # layout, which belong to the GUI thread
+        if numpy is not None:
+            # the new blocks are drawn together :
+            block_array_list = generate_block_arrays(list(missing_item_dict.values()))
+            if is_cancelled is not None and is_cancelled():
+                return None
+            for key, block_array in zip(missing_item_dict.keys(), block_array_list):
+                image_dict[key] = block_array
+                self.block_image_cache.put(key, block_array, block_array.nbytes)
+            return [image_dict[item.hash] for item in item_list]
+
+        for number, (key, item) in enumerate(missing_item_dict.items()):
+            if number % 64 == 0 and is_cancelled is not None and is_cancelled():
+                return None
+            image = item._generate_image()
+            image_dict[key] = image
+            self.block_image_cache.put(key, image, image.byteCount())
+        return [image_dict[item.hash] for item in item_list]
@@ -9,6 +9,7 @@ from PyQt5.QtWidgets import QTextEdit, QGraphicsView, QGraphicsScene,\
 from PyQt5.QtCore import pyqtSlot, Qt, pyqtSignal,  QPoint
 from PyQt5.QtGui import QPainter, QPen, QTextCursor
 from PyQt5.Qt import QRectF
+from .minimap import changed_block_range
 
 
 class Minimap2(QGraphicsView):
@@ -51,42 +52,44 @@ class Minimap2(QGraphicsView):
         self._text_edit = None
         self._minimap_doc = None
         self._doc = None
+        self._is_activated = False
 
         self._graphics_proxy_text_browser = self._scene.addWidget(
             self._text_browser)
         self._scale = 0.2
         self._graphics_proxy_text_browser.setScale(self._scale)
 
+    @pyqtSlot(int, int, int)
     def update_minimap_doc(self, position, charsRemoved, charsAdded):
+        '''
+        function:: update_minimap_doc(position, charsRemoved, charsAdded)
 
-        def select_blocks(first_block,  last_block):
-            first_block_pos = first_block.position()
-            doc_cursor.setPosition(first_block_pos)
-            last_block_pos = last_block.position()
-            doc_cursor.setPosition(last_block_pos,  QTextCursor.KeepAnchor)
-            doc_cursor.movePosition(
-                QTextCursor.EndOfBlock,  QTextCursor.KeepAnchor)
-            print("selected text :",  doc_cursor.selectedText())
-            return doc_cursor.selectedText()
-
-        doc_cursor = QTextCursor(self._doc)
-        minimap_cursor = QTextCursor(self._minimap_doc)
-
-        # IF one same block is modified
-        if self._minimap_doc.blockCount() == self._doc.blockCount():
-            doc_cursor.setPosition(position)
-            doc_cursor.select(QTextCursor.BlockUnderCursor)
-            minimap_cursor.setPosition(position)
-            minimap_cursor.select(QTextCursor.BlockUnderCursor)
-            minimap_cursor.insertFragment(doc_cursor.selection())
-        # TODO: if the doc is modified on more than one block but resulting in
-        # the same count of blocks (right now only the first block would be
-        # updated)
-        else:
-            # ELSE
-            doc_cursor.select(QTextCursor.Document)
-            minimap_cursor.select(QTextCursor.Document)
+        Copy the changed blocks only, the other blocks of the minimap
+        document are kept
+        '''
+        head, tail = changed_block_range(self._doc, position, charsAdded)
+        doc_last = self._doc.blockCount() - 1 - tail
+        minimap_last = self._minimap_doc.blockCount() - 1 - tail
+        if minimap_last < head:
+            # out of step, copy the whole document :
+            head = 0
+            doc_last = self._doc.blockCount() - 1
+            minimap_last = self._minimap_doc.blockCount() - 1
+
+        doc_cursor = select_blocks(self._doc, head, doc_last)
+        minimap_cursor = select_blocks(self._minimap_doc, head, minimap_last)
+        minimap_cursor.beginEditBlock()
+        # insertFragment() doesn't replace the selection with an empty
+        # fragment, ex: when the text of a block is deleted :
+        minimap_cursor.removeSelectedText()
+        if doc_cursor.hasSelection():
             minimap_cursor.insertFragment(doc_cursor.selection())
+        # the first block keeps its own format with insertFragment() :
+        first_block = self._doc.findBlockByNumber(head)
+        minimap_cursor.setPosition(self._minimap_doc.findBlockByNumber(head).position())
+        minimap_cursor.setBlockFormat(first_block.blockFormat())
+        minimap_cursor.setBlockCharFormat(first_block.charFormat())
+        minimap_cursor.endEditBlock()
 
     @property
     def text_edit(self):
@@ -100,9 +103,7 @@ class Minimap2(QGraphicsView):
         # self._text_edit.textChanged.connect(self.update)
         # self._scrollbar.valueChanged.connect(self._change_cursor_pos)
 
-        self.setFixedWidth(self._text_edit.width() * self._scale)
-
-        self._doc = self._text_edit.document()
+        self.setFixedWidth(int(self._text_edit.width() * self._scale))
 
         # connect scrollbar
         baseScrollBar = self._text_edit.verticalScrollBar()
@@ -121,15 +122,40 @@ class Minimap2(QGraphicsView):
     def set_activated(self,  value):
         if value is True:
             self.blockSignals(False)
-            self._minimap_doc = self._doc.clone(self)
-            self._text_browser.setDocument(self._minimap_doc)
-            self._doc.contentsChange.connect(self.update_minimap_doc)
+            self._follow_document(self._text_edit.document())
         else:
             self.blockSignals(True)
+            self._follow_document(None)
+        self._is_activated = value
+
+    def set_document(self, document):
+        '''
+        function:: set_document(document)
+        :param document: QTextDocument of the text edit, to follow after
+        QTextEdit.setDocument()
+        '''
+        if self._is_activated:
+            self._follow_document(document)
+        else:
+            self._doc = document
+
+    def _follow_document(self, document):
+        if self._doc is not None:
             try:
                 self._doc.contentsChange.disconnect(self.update_minimap_doc)
-            except TypeError:
+            except (TypeError, RuntimeError):  # disconnected, or deleted by the text edit
                 pass
+        if document is None:
+            return
+        self._doc = document
+        old_minimap_doc = self._minimap_doc
+        self._minimap_doc = document.clone(self)
+        # the edits are copied from the text edit document, not undone :
+        self._minimap_doc.setUndoRedoEnabled(False)
+        self._text_browser.setDocument(self._minimap_doc)
+        if old_minimap_doc is not None:
+            old_minimap_doc.deleteLater()
+        self._doc.contentsChange.connect(self.update_minimap_doc)
 
     @pyqtSlot()
     def update(self):
@@ -154,7 +180,7 @@ class Minimap2(QGraphicsView):
 
     @pyqtSlot('QSize')
     def update_size(self, size):
-        self.setFixedWidth(self._text_edit.width() * self._scale)
+        self.setFixedWidth(int(self._text_edit.width() * self._scale))
 
     def resizeEvent(self, event):
         cursor = QTextCursor(self._text_edit.cursorForPosition(QPoint(0, 0)))
@@ -182,6 +208,22 @@ class Minimap2(QGraphicsView):
             self._text_browser.verticalScrollBar().show()
 
 
+def select_blocks(document, first, last):
+    '''
+    function:: select_blocks(document, first, last)
+    :param document: QTextDocument
+    :param first: number of the first block
+    :param last: number of the last block
+    :rtype: QTextCursor selecting the text of these blocks
+    '''
+    cursor = QTextCursor(document)
+    cursor.setPosition(document.findBlockByNumber(first).position())
+    last_block = document.findBlockByNumber(last)
+    cursor.setPosition(last_block.position() + last_block.length() - 1,
+                       QTextCursor.KeepAnchor)
+    return cursor
+
+
 from PyQt5.QtWidgets import QTextBrowser
 
 
@@ -0,0 +1,54 @@
+import unittest
+
+from gui.writingzone import minimap
+
+
+def make_item(text, line_starts=(0,)):
+    item = minimap.DocItem()
+    item.block_text = text
+    item.line_starts = list(line_starts)
+    return item
+
+
+@unittest.skipIf(minimap.numpy is None, "generate_block_arrays() needs numpy")
+class Test_GenerateBlockArrays(unittest.TestCase):
+
+    def assertBlank(self, array, line_count):
+        self.assertEqual(array.shape, (4 * line_count, 2))
+        self.assertTrue((array == minimap.WHITE).all())
+
+    def test_empty_block(self):
+        arrays = minimap.generate_block_arrays([make_item("")])
+        self.assertEqual(len(arrays), 1)
+        self.assertBlank(arrays[0], 1)
+
+    def test_empty_blocks(self):
+        arrays = minimap.generate_block_arrays([make_item(""), make_item("")])
+        self.assertEqual(len(arrays), 2)
+        for array in arrays:
+            self.assertBlank(array, 1)
+
+    def test_empty_then_text(self):
+        empty, text = minimap.generate_block_arrays([make_item(""), make_item("ab c")])
+        self.assertBlank(empty, 1)
+        # "ab c" : 4 columns of 2 px, the space is left white
+        self.assertEqual(text.shape, (4, 8))
+        self.assertEqual(text[1, :4].tolist(), [minimap.BLACK] * 4)
+        self.assertEqual(text[1, 4:6].tolist(), [minimap.WHITE] * 2)
+        self.assertEqual(text[0].tolist(), [minimap.WHITE] * 8)
+
+    def test_text_then_empty(self):
+        text, empty = minimap.generate_block_arrays([make_item("ab", (0, 1)), make_item("")])
+        # one line per line start :
+        self.assertEqual(text.shape, (8, 2))
+        self.assertBlank(empty, 1)
+
+    def test_heights(self):
+        item_list = [make_item(""), make_item("abc def", (0, 4)), make_item("\tx")]
+        arrays = minimap.generate_block_arrays(item_list)
+        self.assertEqual([array.shape[0] for array in arrays],
+                         [item.height for item in item_list])
+
+
+if __name__ == '__main__':
+    unittest.main()
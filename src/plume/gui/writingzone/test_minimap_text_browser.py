@@ -0,0 +1,75 @@
+import os
+import random
+import sys
+import unittest
+
+# the tests don't need a display :
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5.QtWidgets import QApplication, QTextEdit
+from PyQt5.QtGui import QTextCursor
+
+from gui.writingzone.minimap_text_browser import Minimap2
+
+
+class Test_Minimap2(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication(sys.argv)
+
+    def setUp(self):
+        self.text_edit = QTextEdit()
+        self.text_edit.setPlainText("\n".join("paragraph %d with some words" % number
+                                              for number in range(40)))
+        self.minimap = Minimap2(None)
+        self.minimap.text_edit = self.text_edit
+
+    def assertInStep(self):
+        self.assertEqual(self.minimap._minimap_doc.toPlainText(),
+                         self.text_edit.document().toPlainText())
+
+    def test_empty_a_block(self):
+        document = self.text_edit.document()
+        block = document.findBlockByNumber(3)
+        cursor = QTextCursor(document)
+        cursor.setPosition(block.position())
+        cursor.setPosition(block.position() + block.length() - 1, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        self.assertEqual(document.findBlockByNumber(3).text(), "")
+        self.assertInStep()
+
+    def test_empty_the_document(self):
+        cursor = QTextCursor(self.text_edit.document())
+        cursor.select(QTextCursor.Document)
+        cursor.removeSelectedText()
+        self.assertInStep()
+
+    def test_random_edits(self):
+        rnd = random.Random(4)
+        document = self.text_edit.document()
+        for _ in range(400):
+            cursor = QTextCursor(document)
+            end = document.characterCount() - 1
+            position = rnd.randrange(end + 1)
+            cursor.setPosition(position)
+            choice = rnd.random()
+            if choice < 0.3:
+                cursor.insertText(rnd.choice(["a", "word ", "\n", "x\ny\n", "\t"]))
+            elif choice < 0.5:
+                cursor.setPosition(min(end, position + rnd.randrange(1, 80)), QTextCursor.KeepAnchor)
+                cursor.removeSelectedText()
+            elif choice < 0.7:
+                # the text of a whole block :
+                cursor.movePosition(QTextCursor.StartOfBlock)
+                cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+                cursor.removeSelectedText()
+            elif choice < 0.9:
+                cursor.setPosition(min(end, position + rnd.randrange(1, 300)), QTextCursor.KeepAnchor)
+                cursor.insertText(rnd.choice(["", "repl", "repl\nrepl2"]))
+            else:
+                document.undo()
+            self.assertInStep()
+
+
+if __name__ == '__main__':
+    unittest.main()
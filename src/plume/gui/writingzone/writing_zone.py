@@ -77,6 +77,15 @@ class WritingZone(QWidget):
     def set_rich_text(self, text):
         self.ui.richTextEdit.setText(text)
 
+    def set_document(self, document):
+        '''
+        function:: set_document(document)
+        :param document: QTextDocument, like a shared one from
+        core.document_registry. Not owned by the writing zone
+        '''
+        self.ui.richTextEdit.setDocument(document)
+        self.ui.minimap.set_document(document)
+
     @property
     def text_edit(self):
         return self.ui.richTextEdit
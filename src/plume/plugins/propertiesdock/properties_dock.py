@@ -45,6 +45,9 @@ class CorePropertyDock():
 
         super(CorePropertyDock, self).__init__()
         self._property_table_model = None
+        self._multi_sheet_property_table_model = None
+        # True to edit the sheets selected in the write tree, not only this one
+        self.is_multi_sheet = False
         self._sheet_id = None
         self.tree_sheet = None
 
@@ -65,7 +68,8 @@ class CorePropertyDock():
     @property
     def property_table_model(self):
         if self._property_table_model is None:
-            self._property_table_model = PropertyTableModel(self)
+            # deleted with the sheet :
+            self._property_table_model = PropertyTableModel(self.tree_sheet)
             if self._sheet_id is not None:
                 self._property_table_model.set_sheet_id(self._sheet_id)
                 self._property_table_model.tree_sheet \
@@ -73,16 +77,33 @@ class CorePropertyDock():
 
         return self._property_table_model
 
+    @property
+    def multi_sheet_property_table_model(self):
+        if self._multi_sheet_property_table_model is None:
+            self._multi_sheet_property_table_model = MultiSheetPropertyTableModel(self.tree_sheet)
+            self._multi_sheet_property_table_model.follow_selection()
+
+        return self._multi_sheet_property_table_model
+
+    @property
+    def active_property_table_model(self):
+        if self.is_multi_sheet:
+            return self.multi_sheet_property_table_model
+        return self.property_table_model
+
     @pyqtSlot()
     def add_property_row(self, index):
-        self._property_table_model.insertRow(1, index)
+        model = self.active_property_table_model
+        model.insertRow(len(model.root_node), model.root_model_index())
 
     @pyqtSlot()
     def remove_property_row(self, index):
-        self._property_table_model.removeRow(
-            index.row(), self._property_table_model.root_model_index())
+        if not index.isValid():
+            return
+        model = self.active_property_table_model
+        model.removeRow(index.row(), model.root_model_index())
 
-from PyQt5.QtWidgets import QWidget
+from PyQt5.QtWidgets import QWidget, QToolButton
 from PyQt5.QtCore import QSortFilterProxyModel
 from gui import cfg as gui_cfg
 from plugins.propertiesdock import properties_dock_ui
@@ -148,9 +169,23 @@ class GuiPropertyDock():
                     self.filter.setFilterFixedString)
                 self.ui.tableView.clicked.connect(self.set_current_row)
 
+                # edit the sheets selected in the write tree :
+                self.selectionButton = QToolButton(self.ui.topWidget)
+                self.selectionButton.setText(_("Selection"))
+                self.selectionButton.setToolTip(
+                    _("Edit the properties of the sheets selected in the project tree"))
+                self.selectionButton.setCheckable(True)
+                self.ui.horizontalLayout.insertWidget(1, self.selectionButton)
+                self.selectionButton.toggled.connect(self.set_multi_sheet)
+
             self.widget.gui_part = self
         return self.widget
 
+    @pyqtSlot(bool)
+    def set_multi_sheet(self, is_multi_sheet):
+        self.core_part.is_multi_sheet = is_multi_sheet
+        self.filter.setSourceModel(self.core_part.active_property_table_model)
+
     @pyqtSlot()
     def add_property_row(self):
         index = self.filter.mapToSource(self.ui.tableView.currentIndex())
@@ -165,7 +200,9 @@ class GuiPropertyDock():
     def set_current_row(self, model_index):
         self.ui.tableView.setCurrentIndex(model_index)
 
-from PyQt5.QtCore import QAbstractTableModel, QVariant, QModelIndex, Qt
+from PyQt5.QtCore import QAbstractTableModel, QVariant, QModelIndex, Qt, QTimer
+from collections import OrderedDict
+from functools import partial
 
 
 class PropertyTableModel(QAbstractTableModel):
@@ -179,21 +216,49 @@ class PropertyTableModel(QAbstractTableModel):
         Constructor
         '''
 
-        super(PropertyTableModel, self).__init__(parent=None)
+        super(PropertyTableModel, self).__init__(parent)
 
         self.tree_sheet = None
+        self._sheet_id = None
         self.root_node = TableNode()
+        # key -> TableNode, for the saved properties. The rows added by
+        # insertRows() aren't there until they get a key
+        self._node_dict = {}
+        # True while this model writes an edit, the announced change is
+        # already applied :
+        self._is_editing = False
         self.headers = ["property", "value"]
 
+        # the subscriptions would keep the model alive, they go with it :
+        self.destroyed.connect(partial(core_cfg.data.subscriber.unsubscribe_update_funcs,
+                                       self._subscribed_funcs()))
+
+    def _subscribed_funcs(self):
+        return [self.refresh_model, self.apply_property_value, self.apply_property_key,
+                self.apply_property_removal, self.apply_property_batch]
+
     def set_sheet_id(self, sheet_id):
         # unsubscribe:
-        core_cfg.data.subscriber.unsubscribe_update_func(self.reset_model)
+        core_cfg.data.subscriber.unsubscribe_update_func(self.refresh_model)
+        core_cfg.data.subscriber.unsubscribe_update_func(self.apply_property_value)
+        core_cfg.data.subscriber.unsubscribe_update_func(self.apply_property_key)
+        core_cfg.data.subscriber.unsubscribe_update_func(self.apply_property_removal)
+        core_cfg.data.subscriber.unsubscribe_update_func(self.apply_property_batch)
         self._sheet_id = sheet_id
         self.tree_sheet = core_cfg.core.tree_sheet_manager.get_tree_sheet_from_sheet_id(
             sheet_id)
         # subscribe:
         core_cfg.data.subscriber.subscribe_update_func_to_domain(
-            self.reset_model,  "data.tree.properties",  self._sheet_id)
+            self.refresh_model,  "data.tree.properties",  self._sheet_id)
+        # key-level changes are applied to their row only :
+        core_cfg.data.subscriber.subscribe_update_func_to_domain(
+            self.apply_property_value,  "data.tree.property.value",  self._sheet_id, pass_detail=True)
+        core_cfg.data.subscriber.subscribe_update_func_to_domain(
+            self.apply_property_key,  "data.tree.property.key",  self._sheet_id, pass_detail=True)
+        core_cfg.data.subscriber.subscribe_update_func_to_domain(
+            self.apply_property_removal,  "data.tree.property.removed",  self._sheet_id, pass_detail=True)
+        core_cfg.data.subscriber.subscribe_update_func_to_domain(
+            self.apply_property_batch,  "data.tree.property.batch", pass_detail=True)
         self.reset_model()
 
     def columnCount(self, parent):
@@ -311,29 +376,42 @@ class PropertyTableModel(QAbstractTableModel):
         :param value:
         :param role:
         '''
-        limit = [role]
-        if not index.isValid():
+        if not index.isValid() or role != Qt.EditRole:
             return False
-        # title :
-        if role == Qt.EditRole and index.column() == 0:
-
-            node = self.nodeFromIndex(index)
-            self.tree_sheet.change_property_key(node.key, value)
-            node.key = value
+        node = self.nodeFromIndex(index)
 
-            self.dataChanged.emit(index, index, limit)
+        # key :
+        if index.column() == 0:
+            if value == node.key:
+                return False
+            if node.key in self._node_dict:
+                self._write(self.tree_sheet.change_property_key, node.key, value)
+                self._rename_row(node.key, value)
+                return True
+            # a row added by insertRows(), saved only now :
+            self._write(self.tree_sheet.set_property, value, node.value)
+            self._remove_row(node.row)
+            self._set_row(value, node.value)
             return True
 
-        if role == Qt.EditRole and index.column() == 1:
-
-            node = self.nodeFromIndex(index)
-            self.tree_sheet.set_property(node.key, value)
+        # value :
+        if index.column() == 1:
+            if value == node.value:
+                return False
+            if node.key in self._node_dict:
+                self._write(self.tree_sheet.set_property, node.key, value)
             node.value = value
-
-            self.dataChanged.emit(index, index, limit)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
             return True
         return False
 
+    def _write(self, tree_sheet_func, *args):
+        self._is_editing = True
+        try:
+            tree_sheet_func(*args)
+        finally:
+            self._is_editing = False
+
     def supportedDropActions(self):
         '''
         function:: supportedDropActions()
@@ -372,8 +450,11 @@ class PropertyTableModel(QAbstractTableModel):
         :param count:
         :param parent:
         '''
-        self.beginInsertRows(parent, row, (row + (count - 1)))
-        self.create_child_nodes(self.root_node, {"": ""})
+        # appended, not saved until a key is given :
+        row = len(self.root_node)
+        self.beginInsertRows(QModelIndex(), row, (row + (count - 1)))
+        for _ in range(0, count):
+            self._create_node("", "")
         self.endInsertRows()
         return True
 
@@ -392,61 +473,328 @@ class PropertyTableModel(QAbstractTableModel):
         :param count:
         :param parentIndex:
         '''
-        self.beginRemoveRows(parentIndex, row, row)
-        node = self.nodeFromIndex(parentIndex)
-        node.removeChild(row)
-        self.endRemoveRows()
+        for node in list(self.root_node.children[row:row + count]):
+            if node.key in self._node_dict and self._node_dict[node.key] is node:
+                self._write(self.tree_sheet.remove_property, node.key)
+            self._remove_row(node.row)
 
         return True
 
-        pass
-
     def reset_model(self):
         '''
         function:: reset_model()
-        :param :
+        only when the sheet changes, see refresh_model()
         '''
         self.beginResetModel()
 
-        del self.root_node
         self.root_node = TableNode()
-
-        # create a nice dict
-        self.prop_dict = self.tree_sheet.get_properties()
-
         self.root_node.sheet_id = self._sheet_id
-        self.create_child_nodes(self.root_node, self.prop_dict)
+        self._node_dict = {}
+        for key, value in self.tree_sheet.get_properties().items():
+            self._create_node(key, value)
 
         self.endResetModel()
 
-    def apply_node_variables_from_dict(self, node, sheet_id):
+    def refresh_model(self):
         '''
-        function:: apply_node_variables_from_dict(node, sheet_id, dict_)
-        :param node:
+        function:: refresh_model()
+        apply a change of the whole properties dict, row by row
+        '''
+        if self._is_editing:
+            return
+        # from the tree, the cache of the tree sheet may not be dropped yet :
+        prop_dict = core_cfg.data.main_tree.get_properties(self._sheet_id)
+        for key in [key for key in self._node_dict if key not in prop_dict]:
+            self._remove_row(self._node_dict[key].row)
+        for key, value in prop_dict.items():
+            self._set_row(key, value)
+
+    def apply_property_value(self, sheet_id, key_value):
+        '''
+        function:: apply_property_value(sheet_id, key_value)
         :param sheet_id:
-        :param dict_:
+        :param key_value: (key, value) of the changed or added property
         '''
-        pass
+        if self._is_editing:
+            return
+        key, value = key_value
+        self._set_row(key, value)
 
-    def create_child_nodes(self, parent_node, key_value_dict):
+    def apply_property_key(self, sheet_id, keys):
         '''
-        function:: create_child_nodes(parent_node)
-        :param parent_node:
-        :rtype:
+        function:: apply_property_key(sheet_id, keys)
+        :param sheet_id:
+        :param keys: (key, new_key) of the renamed property
+        '''
+        if self._is_editing:
+            return
+        key, new_key = keys
+        self._rename_row(key, new_key)
+
+    def apply_property_removal(self, sheet_id, key):
+        '''
+        function:: apply_property_removal(sheet_id, key)
+        :param sheet_id:
+        :param key: of the removed property
+        '''
+        if self._is_editing:
+            return
+        node = self._node_dict.get(key)
+        if node is not None:
+            self._remove_row(node.row)
+
+    def apply_property_batch(self, _, sheet_ids_change):
+        '''
+        function:: apply_property_batch(_, sheet_ids_change)
+        :param sheet_ids_change: (sheet_ids, change), see Tree.apply_property_change()
+        '''
+        sheet_ids, change = sheet_ids_change
+        if self._is_editing or self._sheet_id not in sheet_ids:
+            return
+        if change[0] == "value":
+            self._set_row(change[1], change[2])
+        elif change[0] == "key":
+            if change[1] in self._node_dict:
+                self._rename_row(change[1], change[2])
+            else:
+                self._set_row(change[2], "")
+        elif change[0] == "removed":
+            self.apply_property_removal(self._sheet_id, change[1])
+
+    def _set_row(self, key, value):
+        node = self._node_dict.get(key)
+        if node is None:
+            row = len(self.root_node)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._create_node(key, value)
+            self.endInsertRows()
+            return
+        if node.value == value:
+            return
+        node.value = value
+        index = self.index(node.row, 1, QModelIndex())
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+
+    def _rename_row(self, key, new_key):
+        node = self._node_dict.pop(key, None)
+        replaced_node = self._node_dict.get(new_key)
+        if replaced_node is not None and replaced_node is not node:
+            self._remove_row(replaced_node.row)
+        if node is None:
+            return
+        node.key = new_key
+        self._node_dict[new_key] = node
+        index = self.index(node.row, 0, QModelIndex())
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+
+    def _remove_row(self, row):
+        node = self.root_node.childAtRow(row)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.root_node.removeChild(row)
+        if self._node_dict.get(node.key) is node:
+            del self._node_dict[node.key]
+        self.endRemoveRows()
+
+    def _create_node(self, key, value):
+        node = TableNode(self.root_node)
+        node.key = key
+        node.value = value
+        node.sheet_id = self._sheet_id
+        node.children_id = None
+        if key != "" or value != "":
+            self._node_dict[key] = node
+        return node
+
+
+class MultiSheetPropertyTableModel(PropertyTableModel):
+
+    '''
+    MultiSheetPropertyTableModel
+    The merged properties of several sheets. A key missing from some sheets,
+    or with different values, is shown as mixed. Each edit is applied to all
+    the sheets with one batched transaction.
+    '''
+    def __init__(self, parent=None):
+        '''
+        Constructor
+        '''
+
+        super(MultiSheetPropertyTableModel, self).__init__(parent)
+
+        self.mixed_text = _("(mixed)")
+        self._sheet_ids = ()
+        # keys whose value differs between the sheets :
+        self._mixed_key_set = set()
+
+        # the changes of the sheets are gathered, then applied at once :
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.timeout.connect(self.refresh_model)
 
+        core_cfg.core.subscriber.subscribe_update_func_to_domain(
+            self.follow_selection,  "core.write_panel.selection")
+        core_cfg.data.subscriber.subscribe_update_func_to_domain(
+            self._schedule_sheet_refresh,  "data.tree.properties",  pass_sheet_id=True)
+        for domain in ("data.tree.property.value", "data.tree.property.key",
+                       "data.tree.property.removed", "data.tree.property.batch"):
+            core_cfg.data.subscriber.subscribe_update_func_to_domain(
+                self._schedule_refresh,  domain,  pass_detail=True)
+
+    def _subscribed_funcs(self):
+        return super(MultiSheetPropertyTableModel, self)._subscribed_funcs() \
+            + [self.follow_selection, self._schedule_sheet_refresh, self._schedule_refresh]
+
+    @property
+    def sheet_ids(self):
+        return self._sheet_ids
+
+    def follow_selection(self):
+        '''
+        function:: follow_selection()
+        show the sheets selected in the write tree
+        '''
+        self.set_sheet_ids(core_cfg.core.write_panel_core.selected_sheet_ids)
+
+    def set_sheet_ids(self, sheet_ids):
+        '''
+        function:: set_sheet_ids(sheet_ids)
+        :param sheet_ids:
+        '''
+        self._sheet_ids = tuple(sheet_ids)
+        self.reset_model()
+
+    def data(self, index, role):
         '''
-        # add & scan children :
+        function:: data(index, role)
+        :param index:
+        :param role:
+        '''
+        if index.isValid() and index.column() == 1 and role == Qt.DisplayRole \
+                and self.nodeFromIndex(index).key in self._mixed_key_set:
+            return self.mixed_text
+        return super(MultiSheetPropertyTableModel, self).data(index, role)
 
-        if list(key_value_dict.keys()) != []:
-            for child_key in key_value_dict.keys():
+    def setData(self, index, value, role):
+        '''
+        function:: setData(index, value, role)
+        :param index:
+        :param value:
+        :param role:
+        '''
+        if not index.isValid() or role != Qt.EditRole or self._sheet_ids == ():
+            return False
+        node = self.nodeFromIndex(index)
+        main_tree = core_cfg.data.main_tree
+
+        # key :
+        if index.column() == 0:
+            if value == node.key:
+                return False
+            if node.key in self._node_dict:
+                self._write(main_tree.rename_property_key_many, self._sheet_ids, node.key, value)
+                if node.key in self._mixed_key_set:
+                    self._mixed_key_set.discard(node.key)
+                    self._mixed_key_set.add(value)
+                self._rename_row(node.key, value)
+                return True
+            # a row added by insertRows(), saved only now :
+            self._write(main_tree.set_property_many, self._sheet_ids, value, node.value)
+            self._remove_row(node.row)
+            self._mixed_key_set.discard(value)
+            self._set_row(value, node.value)
+            return True
+
+        # value :
+        if index.column() == 1:
+            if value == node.value and node.key not in self._mixed_key_set:
+                return False
+            if node.key in self._node_dict:
+                self._write(main_tree.set_property_many, self._sheet_ids, node.key, value)
+            self._mixed_key_set.discard(node.key)
+            node.value = value
+            self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+            return True
+        return False
+
+    def removeRows(self, row, count, parentIndex):
+        '''
+        function:: removeRows(row, count, parentIndex)
+        :param row:
+        :param count:
+        :param parentIndex:
+        '''
+        for node in list(self.root_node.children[row:row + count]):
+            if node.key in self._node_dict and self._node_dict[node.key] is node:
+                self._write(core_cfg.data.main_tree.remove_property_many, self._sheet_ids, node.key)
+                self._mixed_key_set.discard(node.key)
+            self._remove_row(node.row)
+
+        return True
+
+    def reset_model(self):
+        '''
+        function:: reset_model()
+        only when the selection changes, see refresh_model()
+        '''
+        self._refresh_timer.stop()
+        self.beginResetModel()
+
+        self.root_node = TableNode()
+        self._node_dict = {}
+        merged_dict, self._mixed_key_set = self._merge_properties()
+        for key, value in merged_dict.items():
+            self._create_node(key, value)
+
+        self.endResetModel()
 
-                child_node = TableNode(parent_node)
-                child_node.key = child_key
-                child_node.value = key_value_dict[child_key]
-                child_node.sheet_id = self._sheet_id
-                child_node.children_id = None
-                parent_node.appendChild(child_node)
-                # self.create_child_nodes(child_node)
+    def refresh_model(self):
+        '''
+        function:: refresh_model()
+        apply the changes of the sheets, row by row
+        '''
+        self._refresh_timer.stop()
+        merged_dict, mixed_key_set = self._merge_properties()
+        changed_mixed_key_set = mixed_key_set ^ self._mixed_key_set
+        self._mixed_key_set = mixed_key_set
+        for key in [key for key in self._node_dict if key not in merged_dict]:
+            self._remove_row(self._node_dict[key].row)
+        for key, value in merged_dict.items():
+            self._set_row(key, value)
+            if key in changed_mixed_key_set:
+                index = self.index(self._node_dict[key].row, 1, QModelIndex())
+                self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def _merge_properties(self):
+        # key -> common value, or "" if mixed
+        merged_dict = OrderedDict()
+        mixed_key_set = set()
+        key_count_dict = {}
+        sheet_count = 0
+        for _, fields in core_cfg.data.main_tree.get_many_fields(self._sheet_ids, ["properties"]):
+            sheet_count += 1
+            for key, value in fields["properties"].items():
+                key_count_dict[key] = key_count_dict.get(key, 0) + 1
+                if key not in merged_dict:
+                    merged_dict[key] = value
+                elif merged_dict[key] != value:
+                    mixed_key_set.add(key)
+        for key, count in key_count_dict.items():
+            if count != sheet_count:
+                mixed_key_set.add(key)
+        for key in mixed_key_set:
+            merged_dict[key] = ""
+        return merged_dict, mixed_key_set
+
+    def _schedule_sheet_refresh(self, sheet_id):
+        if not self._is_editing and sheet_id in self._sheet_ids:
+            self._refresh_timer.start(0)
+
+    def _schedule_refresh(self, sheet_id, detail):
+        if self._is_editing:
+            return
+        if sheet_id in self._sheet_ids \
+                or (sheet_id == -1 and not set(detail[0]).isdisjoint(self._sheet_ids)):
+            self._refresh_timer.start(0)
 
 
 class TableNode():
@@ -467,6 +815,9 @@ class TableNode():
         self.value = ""
         self.parent = parent
         self.children = []
+        # row of this node in parent.children, kept up to date by the parent
+        self.row = -1
+        self.setParent(parent)
 
     def setParent(self, parent):
         '''
@@ -488,8 +839,12 @@ class TableNode():
         :rtype:         return
 
         '''
-        if not child in self.children:
-            self.children.append(child)
+        if child.parent is self and 0 <= child.row < len(self.children) \
+                and self.children[child.row] is child:
+            return
+        child.parent = self
+        child.row = len(self.children)
+        self.children.append(child)
 
     def childAtRow(self, row):
         '''
@@ -507,9 +862,8 @@ class TableNode():
         :rtype:         return
 
         '''
-        for i, item in enumerate(self.children):
-            if item == child:
-                return i
+        if child.parent is self:
+            return child.row
         return -1
 
     def removeChild(self, row):
@@ -520,8 +874,10 @@ class TableNode():
         :rtype:         return
 
         '''
-        value = self.children[row]
-        self.children.remove(value)
+        value = self.children.pop(row)
+        value.row = -1
+        for i in range(row, len(self.children)):
+            self.children[i].row = i
 
         return True
 
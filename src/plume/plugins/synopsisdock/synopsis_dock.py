@@ -44,7 +44,6 @@ class CoreSynopsisDock():
         '''
 
         super(CoreSynopsisDock, self).__init__()
-        self._synopsis_rich_text = None
         self._sheet_id = None
         self.tree_sheet = None        
 
@@ -59,33 +58,37 @@ class CoreSynopsisDock():
         self._sheet_id = sheet_id
         if self.sheet_id is not None:
             self.tree_sheet = core_cfg.core.tree_sheet_manager.get_tree_sheet_from_sheet_id(self.sheet_id)
-            _ = self.synopsis_rich_text
             
             
         
     @property   
     def synopsis_rich_text(self):
-        if self._synopsis_rich_text is None:
-            self._synopsis_rich_text = ""
-            if self._sheet_id is not None:
-                other_contents_dict = self.tree_sheet.get_other_contents()
-                try :
-                    self._synopsis_rich_text = other_contents_dict[self.note_type_name]
-                except KeyError:
-                    self._synopsis_rich_text = ""
-            
-        return self._synopsis_rich_text
+        if self._sheet_id is None:
+            return ""
+        # cached by the tree sheet :
+        text = self.tree_sheet.get_other_contents().get(self.note_type_name)
+        if text is None:
+            return ""
+        return text
         
     @synopsis_rich_text.setter
     def synopsis_rich_text(self,  text):
         if self.sheet_id is not None:
             self.tree_sheet = core_cfg.core.tree_sheet_manager.get_tree_sheet_from_sheet_id(self.sheet_id)
             self.tree_sheet.set_other_content(self.note_type_name,  text) 
-            self._synopsis_rich_text = text
+
+    def flush(self):
+        '''
+        function:: flush()
+        save now the buffered rich text, if any
+        '''
+        if self.sheet_id is not None:
+            core_cfg.core.document_registry.flush_document(self.sheet_id, self.note_type_name)
     
 
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtCore import QObject
+from PyQt5.QtCore import QObject, QEvent
+from functools import partial
 from gui import cfg as gui_cfg
 from plugins.synopsisdock import synopsis_dock_ui
 
@@ -104,6 +107,8 @@ class GuiSynopsisDock(QObject):
         self.core_part = None     #      CoreSynopsisDock
         self._sheet_id = None
         self.tree_sheet = None        
+        # (sheet_id, field) of the shared document shown
+        self._document_key = None
 
     @property
     def sheet_id(self):
@@ -113,13 +118,15 @@ class GuiSynopsisDock(QObject):
     def sheet_id(self, sheet_id):
         if self._sheet_id == sheet_id:
             pass
+        # the buffered text belongs to the previous sheet :
+        self.flush()
         self._sheet_id = sheet_id
         if self.sheet_id is not None:
             self.tree_sheet = gui_cfg.core.tree_sheet_manager.get_tree_sheet_from_sheet_id(self.sheet_id)
             self.core_part = self.tree_sheet.get_instance_of(self.dock_name)
             self.core_part.sheet_id = sheet_id
-            core_cfg.data.subscriber.unsubscribe_update_func(self.get_update)
-            core_cfg.data.subscriber.subscribe_update_func_to_domain(self.get_update,"data.tree.other_contents", self._sheet_id)
+            if self.widget is not None:
+                self._acquire_document()
 
     def get_widget(self):
         
@@ -134,25 +141,40 @@ class GuiSynopsisDock(QObject):
             self.ui.has_side_tool_bar = False        
 
             if self.tree_sheet is not None and self.core_part is not None:
-                self.get_update()
-
-                
-                #connect :
-                self.ui.writingZone.text_edit.textChanged.connect(self.apply_text_change, type=Qt.UniqueConnection )
+                self._acquire_document()
                 
+            # save before the dock is closed :
+            self.widget.installEventFilter(self)
+            self.widget.destroyed.connect(partial(self._release_document))
             self.widget.gui_part = self
         return self.widget
- 
-    def get_update(self):
-        self.ui.writingZone.text_edit.blockSignals(True)
-        if self.tree_sheet is not None and self.core_part is not None:
-            text = self.core_part.synopsis_rich_text
-            self.ui.writingZone.set_rich_text(text)
-        self.ui.writingZone.text_edit.blockSignals(False) 
-        
-    @pyqtSlot()
-    def apply_text_change(self):
-        core_cfg.data.subscriber.disable_func(self.get_update)
-        self.core_part.synopsis_rich_text = self.ui.writingZone.text_edit.toHtml()
-        core_cfg.data.subscriber.enable_func(self.get_update)
+
+    def _acquire_document(self):
+        # shared with the other views of this text, the registry saves it :
+        previous_key = self._document_key
+        self._document_key = (self.sheet_id, self.core_part.note_type_name)
+        if self._document_key == previous_key:
+            return
+        self.ui.writingZone.set_document(
+            gui_cfg.core.document_registry.acquire(*self._document_key))
+        if previous_key is not None:
+            gui_cfg.core.document_registry.release(*previous_key)
+
+    def _release_document(self):
+        if self._document_key is not None:
+            gui_cfg.core.document_registry.release(*self._document_key)
+            self._document_key = None
+
+    def flush(self):
+        '''
+        function:: flush()
+        save now the text being edited
+        '''
+        if self.core_part is not None:
+            self.core_part.flush()
+
+    def eventFilter(self, watched, event):
+        if watched is self.widget and event.type() == QEvent.Hide:
+            self.flush()
+        return False
 
@@ -0,0 +1,37 @@
+import unittest
+
+from plugins.writetreedock.write_tree_proxy_model import TitleIndex
+
+
+class Test_TitleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TitleIndex()
+        # 0 -> 1 "Book" -> (2 "Chapter one" -> 4 "Scene one", 3 "Chapter two")
+        self.index.build([(1, "Book", 0), (2, "Chapter one", 1), (3, "Chapter two", 1),
+                          (4, "Scene one", 2)])
+
+    def test_search(self):
+        self.assertEqual(self.index.search("one"), {2, 4})
+        self.assertEqual(self.index.search("ch"), {2, 3})
+        self.assertEqual(self.index.with_ancestors({4}), {0, 1, 2, 4})
+
+    def test_remove_sheet_with_descendants(self):
+        self.index.remove_sheet(2)
+
+        self.assertEqual(self.index.search("one"), set())
+        self.assertEqual(self.index.search("chapter"), {3})
+        self.assertEqual(self.index.with_ancestors({4}), {4})
+        self.assertEqual(self.index.ancestors({3}), [0, 1])
+
+    def test_moved_sheet_removed_from_new_parent(self):
+        self.index.set_sheet(4, "Scene one", 3)
+        self.index.remove_sheet(2)
+        self.assertEqual(self.index.search("scene"), {4})
+
+        self.index.remove_sheet(3)
+        self.assertEqual(self.index.search("scene"), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -61,9 +61,8 @@ class CoreWriteTreeDock():
 #        self._property_table_model.removeRow(index.row(), self._property_table_model.root_model_index())
 
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtCore import QSortFilterProxyModel
 from gui import cfg as gui_cfg
-from plugins.writetreedock import write_tree_dock_ui,  write_tree_view
+from plugins.writetreedock import write_tree_dock_ui,  write_tree_view, write_tree_proxy_model
 
 class GuiWriteTreeDock():
     '''
@@ -95,18 +94,17 @@ class GuiWriteTreeDock():
                 tree_model = self.core_part.write_tree_model
                 
                 #filter :
-                self.filter = QSortFilterProxyModel(self.widget)
-                self.filter.setFilterKeyColumn(-1)
-                self.filter.setFilterCaseSensitivity(False)
+                self.filter = write_tree_proxy_model.WriteTreeProxyModel(self.widget)
                 self.filter.setSourceModel(tree_model)
                 
                 #model :
                 tree_view.setModel(self.filter)
+                tree_view.set_undo_stack(tree_model.undo_stack)
                 
                 #connect :
                 #self.ui.addPropButton.clicked.connect(self.add_property_row)
                 #self.ui.removePropButton.clicked.connect(self.remove_property_row)
-                self.ui.filterLineEdit.textChanged.connect(self.filter.setFilterFixedString)
+                self.ui.filterLineEdit.textChanged.connect(self.filter.set_filter_text)
                 #TODO: #self.ui.treeView.clicked.connect(self.set_current_row)
                 
             self.widget.gui_part = self
@@ -4,16 +4,24 @@ Created on 26 avr. 2015
 @author:  Cyril Jacquet
 '''
 from PyQt5.Qt import QAbstractItemModel, QVariant, QModelIndex 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QCoreApplication, QThread, pyqtSignal, QMimeData, QByteArray
+from PyQt5.QtWidgets import QUndoStack, QUndoCommand
 from core import subscriber, cfg
 
 
+SHEET_IDS_MIME_TYPE = "application/x-plume-sheet-ids"
+
+
 class WriteTreeModel(QAbstractItemModel):
     '''
     classdocs
     '''
 
 
+    # levels built at reset, under the root. The deeper ones are fetched
+    # when the view expands their parent :
+    initial_depth = 1
+
     def __init__(self, parent=None):
         super(WriteTreeModel, self).__init__(parent)
         '''
@@ -24,10 +32,39 @@ class WriteTreeModel(QAbstractItemModel):
         
         self.headers = ["name"]
         self._id_of_last_created_sheet = None     
-        cfg.data.subscriber.subscribe_update_func_to_domain(self.reset_model, "data.project.close")
-        cfg.data.subscriber.subscribe_update_func_to_domain(self.reset_model, "data.tree")
-        cfg.data.subscriber.subscribe_update_func_to_domain(self.reset_model, "data.tree.title")
-        cfg.data.subscriber.subscribe_update_func_to_domain(self.reset_model, "data.tree.properties")
+        # sheet_id -> TreeNode
+        self._node_dict = {}
+        self._build_generation = 0
+        self._build_is_stale = False
+        self._build_is_pending = False
+        self._builder_list = []
+        # drag and drop moves :
+        self.undo_stack = QUndoStack(self)
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.wait_for_tree)
+        # the whole tree is only rebuilt when a project is loaded, else each
+        # change is applied to its own node :
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.clear_model, "data.project.close")
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.reset_model, "data.project.load")
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.update_title, "data.tree.title",
+                                                            pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.update_properties, "data.tree.properties",
+                                                            pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.update_property_value, "data.tree.property.value",
+                                                            pass_detail=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.update_property_key, "data.tree.property.key",
+                                                            pass_detail=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.remove_property, "data.tree.property.removed",
+                                                            pass_detail=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.update_properties_many, "data.tree.property.batch",
+                                                            pass_detail=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.add_node, "data.tree.sheet_added",
+                                                            pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.remove_node, "data.tree.sheet_removed",
+                                                            pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self.move_node, "data.tree.sheet_moved",
+                                                            pass_sheet_id=True)
 
     def columnCount(self, parent):
         return 1
@@ -47,6 +84,66 @@ class WriteTreeModel(QAbstractItemModel):
             return len(parent_node)
         
         
+#------------------------------------------
+#--------------Lazy population-------------
+#------------------------------------------
+
+    def hasChildren(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return False
+        node = self.nodeFromIndex(parent)
+        if node.fetched:
+            return len(node) > 0
+        # not fetched yet, the children ids of the row tell the count :
+        return bool(node.children_id)
+
+    def canFetchMore(self, parent):
+        node = self.nodeFromIndex(parent)
+        return not node.fetched and bool(node.children_id)
+
+    def fetchMore(self, parent):
+        node = self.nodeFromIndex(parent)
+        if node.fetched:
+            return
+        # the children ids may be older than the node :
+        tuple_ = cfg.data.main_tree.get_tree_model_row(node.sheet_id)
+        if tuple_ is not None:
+            node.children_id = tuple_[3]
+        row_list = []
+        if node.children_id:
+            row_list = [row for row in cfg.data.main_tree.get_tree_model_rows(node.children_id)
+                        if row[0] not in self._node_dict]
+        if row_list == []:
+            node.fetched = True
+            return
+
+        self.beginInsertRows(parent, 0, len(row_list) - 1)
+        for tuple_ in row_list:
+            child_node = TreeNode(node)
+            child_node.sheet_id, child_node.title, child_node.parent_id, \
+                child_node.children_id, child_node.properties = tuple_
+            self._node_dict[child_node.sheet_id] = child_node
+        node.fetched = True
+        self.endInsertRows()
+
+    def _fetch_path_to(self, sheet_id):
+        # fetch the ancestors of a sheet the view hasn't expanded yet
+        ancestor_list = []
+        ancestor_id = sheet_id
+        while ancestor_id not in self._node_dict:
+            tuple_ = cfg.data.main_tree.get_tree_model_row(ancestor_id)
+            if tuple_ is None or tuple_[2] is None or ancestor_id in ancestor_list:
+                return None
+            ancestor_list.append(ancestor_id)
+            ancestor_id = tuple_[2]
+
+        for ancestor_id in [ancestor_id] + list(reversed(ancestor_list[1:])):
+            node = self._node_dict.get(ancestor_id)
+            if node is None:  # not a child of its parent
+                return None
+            self.fetchMore(self.index_from_node(node))
+        return self._node_dict.get(sheet_id)
+
 
 
     def headerData(self, section, orientation, role):
@@ -130,17 +227,14 @@ class WriteTreeModel(QAbstractItemModel):
             
             node = self.nodeFromIndex(index) 
             
+            # dataChanged is emitted by update_title() :
             cfg.data.main_tree.set_title(node.sheet_id, value)
-            node.title = value
-            
-            
-            self.dataChanged.emit(index, index, limit)
             return True
         
         return False
  
     def supportedDropActions(self):
-        return Qt.CopyAction | Qt.MoveAction
+        return Qt.MoveAction
 
 
     def flags(self, index):
@@ -152,43 +246,78 @@ class WriteTreeModel(QAbstractItemModel):
            
         else:
             return Qt.ItemIsDropEnabled | defaultFlags
-    '''
-    def mimeTypes(self):
-        types = QStringList()
-        types.append('application/x-ets-qt4-instance')
-        return types
-
-    def mimeData(self, index):
-        node = self.nodeFromIndex(index[0])       
-        mimeData = PyMimeData(node)
-        return mimeData
 
-
-    def dropMimeData(self, mimedata, action, row, column, parentIndex):
+    def mimeTypes(self):
+        return [SHEET_IDS_MIME_TYPE]
+
+    def mimeData(self, indexes):
+        node_list = []
+        for index in indexes:
+            node = self.nodeFromIndex(index)
+            if index.isValid() and node not in node_list:
+                node_list.append(node)
+        # a sheet moves with its children :
+        node_list = [node for node in node_list
+                     if not any(ancestor in node_list for ancestor in self._iter_ancestors(node))]
+        node_list.sort(key=self._document_position)
+
+        mime_data = QMimeData()
+        mime_data.setData(SHEET_IDS_MIME_TYPE, 
+                          QByteArray(",".join(str(node.sheet_id) for node in node_list).encode()))
+        return mime_data
+
+    def canDropMimeData(self, mime_data, action, row, column, parent):
+        if action != Qt.MoveAction or not mime_data.hasFormat(SHEET_IDS_MIME_TYPE):
+            return False
+        return self._drop_is_valid(self._sheet_ids_from_mime_data(mime_data), parent)
+
+    def dropMimeData(self, mime_data, action, row, column, parent):
         if action == Qt.IgnoreAction:
             return True
+        if not self.canDropMimeData(mime_data, action, row, column, parent):
+            return False
 
-        dragNode = mimedata.instance()
-        parentNode = self.nodeFromIndex(parentIndex)
+        sheet_id_list = self._sheet_ids_from_mime_data(mime_data)
+        parent_node = self.nodeFromIndex(parent)
+        self.undo_stack.push(MoveSheetsCommand(sheet_id_list, parent_node.sheet_id, row))
+        return True
 
-        # make an copy of the node being moved
-        newNode = deepcopy(dragNode)
-        newNode.setParent(parentNode)
-        self.insertRow(len(parentNode)-1, parentIndex)
-        self.emit(SIGNAL("dataChanged(QModelIndex,QModelIndex)"), 
-parentIndex, parentIndex)
+    def _sheet_ids_from_mime_data(self, mime_data):
+        text = bytes(mime_data.data(SHEET_IDS_MIME_TYPE)).decode()
+        return [int(sheet_id) for sheet_id in text.split(",") if sheet_id != ""]
+
+    def _drop_is_valid(self, sheet_id_list, parent):
+        if sheet_id_list == [] or self.root_node.sheet_id is None:
+            return False
+        parent_node = self.nodeFromIndex(parent)
+        # not into itself nor into one of its children :
+        for node in [parent_node] + list(self._iter_ancestors(parent_node)):
+            if node.sheet_id in sheet_id_list:
+                return False
         return True
 
-    '''
+    def _iter_ancestors(self, node):
+        node = node.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def _document_position(self, node):
+        rows = []
+        while node.parent is not None:
+            rows.append(node.row)
+            node = node.parent
+        return rows[::-1]
+
     def insertRow(self, row, parent):
         return self.insertRows(row, 1, parent)
 
 
     def insertRows(self, row, count, parent):
-        self.beginInsertRows(parent, row, (row + (count - 1)))
+        # sheets are appended to the parent. The rows are inserted by
+        # add_node(), when the tree announces each new sheet
         for _ in range(0, count):
             self._id_of_last_created_sheet = cfg.data.main_tree.create_new_sheet(self.nodeFromIndex(parent).sheet_id, "write")
-        self.endInsertRows()
         return True
 
 
@@ -197,12 +326,30 @@ parentIndex, parentIndex)
 
 
     def removeRows(self, row, count, parentIndex):
-        self.beginRemoveRows(parentIndex, row, row)
-        node = self.nodeFromIndex(parentIndex)
-        node.removeChild(row)
-        self.endRemoveRows()
-       
-        return True
+        # never removes the sheets : remove_sheets() does it, undoably, and
+        # the rows are removed by remove_node() when the tree announces it
+        return False
+
+    def remove_sheets(self, sheet_id_list):
+        '''
+        function:: remove_sheets(sheet_id_list)
+        :param sheet_id_list: sheets removed with their descendants, can be undone
+        '''
+        # descendants go with their ancestor :
+        sheet_id_list = [sheet_id for sheet_id in sheet_id_list
+                         if not self._has_ancestor_in(sheet_id, sheet_id_list)]
+        if sheet_id_list == []:
+            return
+        self.undo_stack.push(RemoveSheetsCommand(sheet_id_list))
+
+    def _has_ancestor_in(self, sheet_id, sheet_id_list):
+        node = self._node_dict.get(sheet_id)
+        if node is None:
+            return False
+        for ancestor in self._iter_ancestors(node):
+            if ancestor.sheet_id in sheet_id_list:
+                return True
+        return False
 
 
 
@@ -211,68 +358,248 @@ parentIndex, parentIndex)
         return self._id_of_last_created_sheet
 
     def find_index_from_id(self, id):
-        start_index = self.index(0,0, QModelIndex())
-        index_list = self.match(start_index, 37, id, 1, Qt.MatchExactly | Qt.MatchRecursive)
-        if len(index_list) == 0:
+        node = self._node_dict.get(id)
+        if node is None and self._node_dict != {}:
+            node = self._fetch_path_to(id)
+        if node is None or node is self.root_node:
             return None
-        else:
-            return index_list[0]
+        return self.index_from_node(node)
+
+    def node_from_id(self, sheet_id):
+        '''
+        function:: node_from_id(sheet_id)
+        :param sheet_id:
+        :rtype: the loaded TreeNode of the sheet, None if not loaded. Nothing
+        is fetched, unlike find_index_from_id()
+        '''
+        return self._node_dict.get(sheet_id)
+
+    def loaded_nodes(self):
+        '''
+        function:: loaded_nodes()
+        :rtype: list of the loaded TreeNodes, the root node included
+        '''
+        return list(self._node_dict.values())
     
-    def reset_model(self):
+    def clear_model(self):
+        # drop the result of a running build :
+        self._build_generation += 1
+        self._build_is_pending = False
+        self._build_is_stale = False
+        self.undo_stack.clear()
         self.beginResetModel()
-        
-
-        del self.root_node
         self.root_node = TreeNode()
-          
-        
-        list_ = cfg.data.main_tree.get_tree_model_necessities("write")
-        if list_ == []: #empty /close
-            self.root_node = TreeNode()
-            self.endResetModel()
-            return           
-        
-        # create a nice dict
-        self._dict = {}
-        for tuple_ in list_:
-            self._dict[tuple_[0]] = tuple_
-
-        self.root_node.sheet_id = cfg.data.main_tree.get_root_id("write")
-        self.create_child_nodes(self.root_node)
-
+        self._node_dict = {}
+        self.endResetModel()
 
+    def reset_model(self):
+        # the nodes are built by a WriteTreeBuilder thread, then swapped in by
+        # _apply_built_tree(). Meanwhile, the model stays empty :
+        self.clear_model()
+        self._build_is_pending = True
+
+        builder = WriteTreeBuilder("write", self._build_generation, self,
+                                   depth=self.initial_depth)
+        builder.built.connect(self._apply_built_tree, Qt.QueuedConnection)
+        builder.finished.connect(self._forget_builder)
+        builder.finished.connect(builder.deleteLater)
+        self._builder_list.append(builder)
+        builder.start()
+
+    def wait_for_tree(self):
+        '''
+        function:: wait_for_tree()
+        block until the running tree builders are finished, then apply their
+        result
+        '''
+        for builder in list(self._builder_list):
+            builder.wait()
+        QCoreApplication.sendPostedEvents()
+
+    def _apply_built_tree(self, generation, root_node, node_dict):
+        if generation != self._build_generation:  # superseded
+            return
+        if self._build_is_stale:  # the tree changed during the build
+            self.reset_model()
+            return
+        self._build_is_pending = False
+        self.beginResetModel()
+        self.root_node = root_node
+        self._node_dict = node_dict
         self.endResetModel()
 
-    def apply_node_variables_from_dict(self, node, sheet_id, dict_):
-        """
-        
-        """
-        tuple_ = self._dict[sheet_id]
-        node.sheet_id, node.title, node.parent_id, node.children_id, node.properties = tuple_
-        
+    def _forget_builder(self):
+        self._builder_list = [builder for builder in self._builder_list
+                              if not builder.isFinished()]
 
+    def _is_building(self):
+        return self._build_is_pending
 
-    def create_child_nodes(self, parent_node):
-        
-        
-        
-        #add & scan children :
-        
-        self.apply_node_variables_from_dict(parent_node, parent_node.sheet_id, self._dict)
+#------------------------------------------
+#-----------Incremental updates------------
+#------------------------------------------
 
+    def index_from_node(self, node):
+        if node is None or node is self.root_node:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
 
-        if parent_node.children_id != None:
-            for child_id in parent_node.children_id:
-            
+    def update_title(self, sheet_id):
+        if self._is_building():
+            self._build_is_stale = True
+            return
+        node = self._node_dict.get(sheet_id)
+        if node is None:
+            return
+        node.title = cfg.data.main_tree.get_title(sheet_id)
+        index = self.index_from_node(node)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+
+    def update_properties(self, sheet_id):
+        if self._is_building():
+            self._build_is_stale = True
+            return
+        node = self._node_dict.get(sheet_id)
+        if node is None:
+            return
+        node.properties = cfg.data.main_tree.get_properties(sheet_id)
+        index = self.index_from_node(node)
+        self.dataChanged.emit(index, index, [Qt.UserRole])
+
+    def update_property_value(self, sheet_id, key_value):
+        key, value = key_value
+        self._change_properties(sheet_id, lambda properties: properties.__setitem__(key, value))
+
+    def update_property_key(self, sheet_id, keys):
+        key, new_key = keys
+        self._change_properties(sheet_id, lambda properties: properties.__setitem__(
+            new_key, properties.pop(key, "")))
+
+    def remove_property(self, sheet_id, key):
+        self._change_properties(sheet_id, lambda properties: properties.pop(key, None))
+
+    def update_properties_many(self, _, sheet_ids_change):
+        sheet_ids, change = sheet_ids_change
+        apply_property_change = cfg.data.main_tree.apply_property_change
+        for sheet_id in sheet_ids:
+            self._change_properties(sheet_id, lambda properties: apply_property_change(properties, change))
+
+    def _change_properties(self, sheet_id, change_func):
+        # apply a key-level change without reading the sheet
+        if self._is_building():
+            self._build_is_stale = True
+            return
+        node = self._node_dict.get(sheet_id)
+        if node is None:
+            return
+        # a new dict, the old one may be cached by the proxies :
+        properties = dict(node.properties or {})
+        change_func(properties)
+        node.properties = properties
+        index = self.index_from_node(node)
+        self.dataChanged.emit(index, index, [Qt.UserRole])
+
+    def add_node(self, sheet_id):
+        if self._is_building():
+            self._build_is_stale = True
+            return
+        if sheet_id in self._node_dict:
+            return
+        tuple_ = cfg.data.main_tree.get_tree_model_row(sheet_id)
+        if tuple_ is None:
+            return
+        parent_node = self._node_dict.get(tuple_[2])
+        if parent_node is None: # not in this tree, or not fetched yet
+            return
+        had_children = bool(parent_node.children_id)
+        parent_node.children_id = cfg.data.main_tree.get_tree_model_row(parent_node.sheet_id)[3]
+        if not parent_node.fetched:
+            parent_index = self.index_from_node(parent_node)
+            if had_children:
+                # the view already shows the parent as expandable
+                self.dataChanged.emit(parent_index, parent_index, [])
+            else:
+                # the view caches hasChildren(), so insert the only child
+                # to give the parent its expand arrow :
+                self.fetchMore(parent_index)
+            return
+        row = min(parent_node.children_id.index(sheet_id), len(parent_node))
+
+        self.beginInsertRows(self.index_from_node(parent_node), row, row)
+        node = TreeNode()
+        node.sheet_id, node.title, node.parent_id, node.children_id, node.properties = tuple_
+        parent_node.insertChild(row, node)
+        self._node_dict[sheet_id] = node
+        self.endInsertRows()
 
-                child_node = TreeNode(parent_node) 
-                child_node.sheet_id = child_id  
-                parent_node.appendChild(child_node)
-                self.create_child_nodes(child_node)
+    def remove_node(self, sheet_id):
+        if self._is_building():
+            self._build_is_stale = True
+            return
+        node = self._node_dict.get(sheet_id)
+        if node is None:
+            return
+        parent_node = node.parent
+        row = parent_node.rowOfChild(node)
+
+        self.beginRemoveRows(self.index_from_node(parent_node), row, row)
+        parent_node.removeChild(row)
+        # forget the node and its descendants :
+        removed_nodes = [node]
+        for removed_node in removed_nodes:
+            self._node_dict.pop(removed_node.sheet_id, None)
+            removed_nodes.extend(removed_node.children)
+        self.endRemoveRows()
 
+    def move_node(self, sheet_id):
+        if self._is_building():
+            self._build_is_stale = True
+            return
+        node = self._node_dict.get(sheet_id)
+        if node is None: # moved from a part of the tree not fetched yet
+            self.add_node(sheet_id)
+            return
+        tuple_ = cfg.data.main_tree.get_tree_model_row(sheet_id)
+        new_parent_node = self._node_dict.get(tuple_[2])
+        if new_parent_node is None: # moved out of this tree
+            self.remove_node(sheet_id)
+            return
+        new_parent_node.children_id = cfg.data.main_tree.get_tree_model_row(new_parent_node.sheet_id)[3]
+        if not new_parent_node.fetched:
+            self.remove_node(sheet_id)
+            self.add_node(sheet_id)
+            return
+        old_parent_node = node.parent
+        old_row = node.row
+
+        # the node goes after its new previous sibling. When several sheets are
+        # moved, the tree announces them in their new order, so this sibling
+        # is always in place already :
+        new_row = new_parent_node.children_id.index(sheet_id)
+        previous_node = None
+        if new_row > 0:
+            previous_node = self._node_dict.get(new_parent_node.children_id[new_row - 1])
+        if new_row == 0:
+            destination_row = 0
+        elif previous_node is not None and previous_node.parent is new_parent_node:
+            destination_row = previous_node.row + 1
+        else:
+            destination_row = min(new_row, len(new_parent_node))
+
+        # Qt wants the destination row as counted before the move :
+        if old_parent_node is new_parent_node and destination_row in (old_row, old_row + 1):
+            return
+        if not self.beginMoveRows(self.index_from_node(old_parent_node), old_row, old_row,
+                                  self.index_from_node(new_parent_node), destination_row):
+            self.reset_model()
+            return
+        old_parent_node.removeChild(old_row)
+        if old_parent_node is new_parent_node and destination_row > old_row:
+            destination_row -= 1
+        new_parent_node.insertChild(destination_row, node)
+        node.parent_id = new_parent_node.sheet_id
+        self.endMoveRows()
 
-        
-        
     def get_synopsys(self,sheet_id):
         pass
     
@@ -295,7 +622,132 @@ parentIndex, parentIndex)
 
 
 
+class MoveSheetsCommand(QUndoCommand):
+    '''
+    MoveSheetsCommand
+    '''
+
+    def __init__(self, sheet_ids, new_parent_id, new_position, parent=None):
+        super(MoveSheetsCommand, self).__init__(parent)
+        self.setText(_("Move sheets"))
+        self.sheet_ids = sheet_ids
+        self.new_parent_id = new_parent_id
+        self.new_position = new_position
+        self._old_positions = None
+
+    def redo(self):
+        self._old_positions = cfg.data.main_tree.move_many(self.sheet_ids, self.new_parent_id, 
+                                                          self.new_position)
+
+    def undo(self):
+        cfg.data.main_tree.restore_positions(self._old_positions)
+
+
+class RemoveSheetsCommand(QUndoCommand):
+    '''
+    RemoveSheetsCommand
+    '''
+
+    def __init__(self, sheet_ids, parent=None):
+        super(RemoveSheetsCommand, self).__init__(parent)
+        self.setText(_("Remove sheets"))
+        self.sheet_ids = sheet_ids
+        self._removals = []
+
+    def redo(self):
+        self._removals = [cfg.data.main_tree.remove_sheet(sheet_id) for sheet_id in self.sheet_ids]
+
+    def undo(self):
+        # in reverse order, so that each sheet finds back its position :
+        for removal in reversed(self._removals):
+            if removal is not None:
+                cfg.data.main_tree.restore_sheet(removal)
+        self._removals = []
+
+
+class WriteTreeBuilder(QThread):
+    '''
+    WriteTreeBuilder
+    '''
+    built = pyqtSignal(int, object, object)
+
+    def __init__(self, tree_type, generation, parent=None, depth=None):
+        super(WriteTreeBuilder, self).__init__(parent)
+        self.tree_type = tree_type
+        self.generation = generation
+        self.depth = depth
+
+    def run(self):
+        root_node, node_dict = build_tree_nodes(cfg.data.main_tree, self.tree_type, self.depth)
+        self.built.emit(self.generation, root_node, node_dict)
+
+
+def build_tree_nodes(tree, tree_type, depth=None):
+    '''
+    function:: build_tree_nodes(tree, tree_type, depth=None)
+    :param tree: data.tree.Tree
+    :param tree_type: ex: "write"
+    :param depth: optional. number of levels under the root to build, the
+    deeper nodes being left to WriteTreeModel.fetchMore(). All if None
+    Build the TreeNode graph level by level, without recursion, so deep
+    outlines don't hit the recursion limit. One query by level, only the
+    rows of the built levels are read
+
+    return (root_node, {sheet_id: node})
+    '''
+    # called from a WriteTreeBuilder thread. The levels are read holding the
+    # connection lock, so they are consistent
+    with tree.db_lock:
+        return _read_tree_levels(tree, tree_type, depth)
+
+
+def _read_tree_levels(tree, tree_type, depth):
+    root_node = TreeNode()
+    node_dict = {}
+
+    row_list = []
+    if tree.db is not None:  # not closed
+        row_list = tree.get_tree_model_rows([tree.get_root_id(tree_type)])
+    if row_list == []:
+        return root_node, node_dict
+
+    level = [(root_node, row_list[0])]
+    level_depth = 0
+    while level:
+        for node, tuple_ in level:
+            node.sheet_id, node.title, node.parent_id, node.children_id, node.properties = tuple_
+            node_dict[node.sheet_id] = node
+        if level_depth == depth:
+            break
+
+        child_id_list = []
+        for node, _ in level:
+            node.fetched = True
+            child_id_list.extend(node.children_id or ())
+        row_dict = {}
+        for tuple_ in tree.get_tree_model_rows(child_id_list):
+            row_dict[tuple_[0]] = tuple_
+
+        next_level = []
+        for node, _ in level:
+            for child_id in node.children_id or ():
+                if child_id not in row_dict or child_id in node_dict:  # broken link
+                    continue
+                next_level.append((TreeNode(node), row_dict.pop(child_id)))
+        level = next_level
+        level_depth += 1
+
+    return root_node, node_dict
+
+
 class TreeNode(object):
+    '''
+    TreeNode
+    '''
+    # a write tree can hold tens of thousands of nodes :
+    __slots__ = ("title", "sheet_id", "parent_id", "children_id", "properties",
+                 "parent", "children", "row", "fetched")
+
     def __init__(self, parent=None):
         super(TreeNode, self).__init__()
   
@@ -307,6 +759,10 @@ class TreeNode(object):
        
         self.parent = parent
         self.children = []
+        # row of this node in parent.children, kept up to date by the parent
+        self.row = -1
+        # True once the children nodes are created, see WriteTreeModel.fetchMore()
+        self.fetched = False
        
         self.setParent(parent)
        
@@ -318,29 +774,37 @@ class TreeNode(object):
             self.parent = None
            
     def appendChild(self, child):
-        if not child in self.children:
-            self.children.append(child)
+        if child.parent is self and 0 <= child.row < len(self.children) \
+                and self.children[child.row] is child:
+            return
+        child.parent = self
+        child.row = len(self.children)
+        self.children.append(child)
+
+    def insertChild(self, row, child):
+        child.parent = self
+        self.children.insert(row, child)
+        self._renumber_from(row)
        
     def childAtRow(self, row):
         return self.children[row]
    
     def rowOfChild(self, child):       
-        for i, item in enumerate(self.children):
-            if item == child:
-                return i
+        if child.parent is self:
+            return child.row
         return -1
    
     def removeChild(self, row):
-        value = self.children[row]
-        self.children.remove(value)
+        value = self.children.pop(row)
+        value.row = -1
+        self._renumber_from(row)
 
         return True
+
+    def _renumber_from(self, row):
+        children = self.children
+        for i in range(row, len(children)):
+            children[i].row = i
        
     def __len__(self):
         return len(self.children)
-
-
-
-
-
-  
@@ -4,7 +4,11 @@ Created on 26 may 2015
 @author:  Cyril Jacquet
 '''
 
-from PyQt5.QtCore import QSortFilterProxyModel, QVariant, QModelIndex, Qt
+from PyQt5.QtCore import QSortFilterProxyModel, QTimer, Qt
+from core import cfg
+from collections import deque
+from datetime import datetime
+from functools import partial
 
 
 class WriteTreeProxyModel(QSortFilterProxyModel):
@@ -12,10 +16,363 @@ class WriteTreeProxyModel(QSortFilterProxyModel):
     '''
     WriteTreeProxyModel
     '''
+    # ms of typing pause before filtering :
+    filter_delay = 150
+    # folders fetched into the source model per event loop turn, while
+    # filtering :
+    fetch_batch_size = 20
 
     def __init__(self, parent=None):
         '''
         Constructor
         '''
 
-        super(WriteTreeProxyModel, self).__init__(parent=None)
+        super(WriteTreeProxyModel, self).__init__(parent)
+
+        self._filter_text = ""
+        # sheet_ids shown while filtering, None when not filtering :
+        self._visible_set = None
+        self._title_index = TitleIndex()
+
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.timeout.connect(self.apply_filter)
+        # ancestors of the matches, each one after its parent, to fetch :
+        self._fetch_list = deque()
+        self._fetch_timer = QTimer(self)
+        self._fetch_timer.setSingleShot(True)
+        self._fetch_timer.timeout.connect(self._fetch_next_folders)
+
+        # siblings sorted by this property, stored order if None :
+        self._sort_property_key = None
+        # sheet_id -> (properties dict of the node, typed sort key)
+        self._sort_key_dict = {}
+        # the source model emits dataChanged with this role when the
+        # properties of a sheet change, then the row is sorted again :
+        self.setSortRole(Qt.UserRole)
+
+        cfg.data.subscriber.subscribe_update_func_to_domain(self._clear_title_index, "data.project.close")
+        cfg.data.subscriber.subscribe_update_func_to_domain(self._clear_title_index, "data.project.load")
+        cfg.data.subscriber.subscribe_update_func_to_domain(self._update_sheet, "data.tree.title",
+                                                            pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self._update_sheet, "data.tree.sheet_added",
+                                                            pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self._update_sheet, "data.tree.sheet_moved",
+                                                            pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self._remove_sheet, "data.tree.sheet_removed",
+                                                            pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self._clear_sort_keys, "data.project.close")
+        for domain in ("data.tree.properties", "data.tree.property.value", "data.tree.property.key",
+                       "data.tree.property.removed"):
+            cfg.data.subscriber.subscribe_update_func_to_domain(self._forget_sort_key, domain,
+                                                                pass_sheet_id=True)
+        cfg.data.subscriber.subscribe_update_func_to_domain(self._forget_sort_keys, "data.tree.property.batch",
+                                                            pass_detail=True)
+        # the subscriptions would keep the model alive, they go with it :
+        self.destroyed.connect(partial(cfg.data.subscriber.unsubscribe_update_funcs,
+                                       [self._clear_title_index, self._update_sheet, self._remove_sheet,
+                                        self._clear_sort_keys,
+                                        self._forget_sort_key, self._forget_sort_keys]))
+
+    def set_filter_text(self, text):
+        '''
+        function:: set_filter_text(text)
+        :param text: the titles containing it are shown, with their parents.
+        Applied after filter_delay
+        '''
+        self._filter_text = text
+        self._filter_timer.start(self.filter_delay)
+
+    def apply_filter(self):
+        '''
+        function:: apply_filter()
+        apply now the last text given to set_filter_text()
+        '''
+        self._filter_timer.stop()
+        text = self._filter_text.casefold()
+        if text == "":
+            self._visible_set = None
+            self._fetch_list.clear()
+            self._fetch_timer.stop()
+            self.invalidateFilter()
+            return
+
+        if not self._title_index.is_built:
+            self._title_index.build(cfg.data.main_tree.iter_tree_model_necessities("write"))
+        match_set = self._title_index.search(text)
+        self._visible_set = self._title_index.with_ancestors(match_set)
+        self._fetch_matches(match_set)
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self._visible_set is None:
+            return True
+        source_model = self.sourceModel()
+        node = source_model.nodeFromIndex(source_parent).childAtRow(source_row)
+        return node.sheet_id in self._visible_set
+
+    def sort_by_property(self, key, order=Qt.AscendingOrder):
+        '''
+        function:: sort_by_property(key, order=Qt.AscendingOrder)
+        :param key: property key, ex: "status". None for the stored order
+        :param order:
+        Sort the siblings by the value of a property, so the sheets sharing a
+        value are grouped, in their stored order
+        '''
+        if key != self._sort_property_key:
+            self._sort_key_dict = {}
+        self._sort_property_key = key
+        if key is None:
+            self.sort(-1)
+        else:
+            self.sort(0, order)
+
+    @property
+    def sort_property_key(self):
+        return self._sort_property_key
+
+    def property_keys(self):
+        '''
+        function:: property_keys()
+        :rtype: set of the property keys of the loaded sheets
+        '''
+        key_set = set()
+        for node in self.sourceModel().loaded_nodes():
+            if node.properties:
+                key_set.update(node.properties.keys())
+        return key_set
+
+    def lessThan(self, left, right):
+        if self._sort_property_key is None:
+            return left.row() < right.row()
+        return (self._sort_key(left.internalPointer()), left.row()) \
+            < (self._sort_key(right.internalPointer()), right.row())
+
+    def _sort_key(self, node):
+        properties = node.properties
+        cached = self._sort_key_dict.get(node.sheet_id)
+        if cached is not None and cached[0] is properties:
+            return cached[1]
+        value = None
+        if properties:
+            value = properties.get(self._sort_property_key)
+        sort_key = typed_sort_key(value)
+        self._sort_key_dict[node.sheet_id] = (properties, sort_key)
+        return sort_key
+
+    def _forget_sort_key(self, sheet_id):
+        self._sort_key_dict.pop(sheet_id, None)
+
+    def _forget_sort_keys(self, _, sheet_ids_change):
+        for sheet_id in sheet_ids_change[0]:
+            self._sort_key_dict.pop(sheet_id, None)
+
+    def _clear_sort_keys(self):
+        self._sort_key_dict = {}
+
+    def _fetch_matches(self, match_set):
+        # the matches under a folder the view didn't expand yet aren't in the
+        # source model. The title index knows their ancestors, which are
+        # fetched a batch at a time, so the GUI stays responsive :
+        self._fetch_list = deque(self._title_index.ancestors(match_set))
+        self._fetch_next_folders()
+
+    def _fetch_next_folders(self):
+        source_model = self.sourceModel()
+        if source_model is None:
+            self._fetch_list.clear()
+            return
+        fetch_count = 0
+        while self._fetch_list and fetch_count < self.fetch_batch_size:
+            node = source_model.node_from_id(self._fetch_list.popleft())
+            if node is not None and not node.fetched:
+                source_model.fetchMore(source_model.index_from_node(node))
+                fetch_count += 1
+        if self._fetch_list:
+            self._fetch_timer.start(0)
+
+    def _clear_title_index(self):
+        self._title_index.clear()
+        if self._visible_set is not None:
+            self._filter_timer.start(self.filter_delay)
+
+    def _update_sheet(self, sheet_id):
+        if not self._title_index.is_built:
+            return
+        tuple_ = cfg.data.main_tree.get_tree_model_row(sheet_id)
+        if tuple_ is None:
+            return
+        self._title_index.set_sheet(sheet_id, tuple_[1], tuple_[2])
+        if self._visible_set is not None:
+            self._filter_timer.start(self.filter_delay)
+
+    def _remove_sheet(self, sheet_id):
+        if not self._title_index.is_built:
+            return
+        self._title_index.remove_sheet(sheet_id)
+        if self._visible_set is not None:
+            self._filter_timer.start(self.filter_delay)
+
+
+def typed_sort_key(value):
+    '''
+    function:: typed_sort_key(value)
+    :param value: a property value, a string
+    :rtype: tuple comparable with any other typed_sort_key(). Numbers come
+    first, in numeric order, then the dates, then the texts, then the sheets
+    without the property
+    '''
+    if value is None or value == "":
+        return (3, 0, "")
+    try:
+        return (0, float(value), "")
+    except ValueError:
+        pass
+    try:
+        # ISO dates sort as texts :
+        datetime.strptime(value[:10], "%Y-%m-%d")
+        return (1, 0, value)
+    except ValueError:
+        pass
+    return (2, 0, value.casefold())
+
+
+class TitleIndex(object):
+
+    '''
+    TitleIndex
+    '''
+    # length of the indexed substrings of the titles :
+    gram_size = 3
+
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        super(TitleIndex, self).__init__()
+        self.clear()
+
+    def clear(self):
+        self.is_built = False
+        self._title_dict = {}
+        self._parent_dict = {}
+        # parent_id -> set of the children sheet_ids :
+        self._children_dict = {}
+        self._gram_dict = {}
+
+    def build(self, rows):
+        '''
+        function:: build(rows)
+        :param rows: iterable of (sheet_id, title, parent_id, ...), like
+        Tree.iter_tree_model_necessities()
+        '''
+        self.clear()
+        for row in rows:
+            self.set_sheet(row[0], row[1], row[2])
+        self.is_built = True
+
+    def set_sheet(self, sheet_id, title, parent_id):
+        '''
+        function:: set_sheet(sheet_id, title, parent_id)
+        :param sheet_id:
+        :param title:
+        :param parent_id:
+        '''
+        self._remove_grams(sheet_id)
+        self._unlink_from_parent(sheet_id)
+        title = (title or "").casefold()
+        self._title_dict[sheet_id] = title
+        self._parent_dict[sheet_id] = parent_id
+        self._children_dict.setdefault(parent_id, set()).add(sheet_id)
+        for gram in self._iter_grams(title):
+            self._gram_dict.setdefault(gram, set()).add(sheet_id)
+
+    def remove_sheet(self, sheet_id):
+        '''
+        function:: remove_sheet(sheet_id)
+        :param sheet_id: removed with its descendants
+        '''
+        self._unlink_from_parent(sheet_id)
+        stack = [sheet_id]
+        while stack:
+            sheet_id = stack.pop()
+            stack.extend(self._children_dict.pop(sheet_id, ()))
+            self._remove_grams(sheet_id)
+            self._title_dict.pop(sheet_id, None)
+            self._parent_dict.pop(sheet_id, None)
+
+    def search(self, text):
+        '''
+        function:: search(text)
+        :param text: casefolded
+        :rtype: set of the sheet_ids whose title contains text
+        '''
+        if len(text) < self.gram_size:
+            return {sheet_id for sheet_id, title in self._title_dict.items()
+                    if text in title}
+
+        candidate_set = None
+        # the rarest grams first :
+        for gram in sorted(set(self._iter_grams(text)),
+                           key=lambda gram: len(self._gram_dict.get(gram, ()))):
+            gram_set = self._gram_dict.get(gram)
+            if not gram_set:
+                return set()
+            candidate_set = set(gram_set) if candidate_set is None else candidate_set & gram_set
+            if not candidate_set:
+                return set()
+        return {sheet_id for sheet_id in candidate_set
+                if text in self._title_dict[sheet_id]}
+
+    def with_ancestors(self, sheet_id_set):
+        '''
+        function:: with_ancestors(sheet_id_set)
+        :param sheet_id_set:
+        :rtype: set of these sheet_ids and of all their ancestors
+        '''
+        result_set = set()
+        for sheet_id in sheet_id_set:
+            while sheet_id is not None and sheet_id not in result_set:
+                result_set.add(sheet_id)
+                sheet_id = self._parent_dict.get(sheet_id)
+        return result_set
+
+    def ancestors(self, sheet_id_set):
+        '''
+        function:: ancestors(sheet_id_set)
+        :param sheet_id_set:
+        :rtype: list of the ancestors of these sheet_ids, each one after its
+        parent
+        '''
+        result_list = []
+        seen_set = set()
+        for sheet_id in sheet_id_set:
+            path_list = []
+            parent_id = self._parent_dict.get(sheet_id)
+            while parent_id is not None and parent_id not in seen_set:
+                seen_set.add(parent_id)
+                path_list.append(parent_id)
+                parent_id = self._parent_dict.get(parent_id)
+            result_list.extend(reversed(path_list))
+        return result_list
+
+    def _remove_grams(self, sheet_id):
+        title = self._title_dict.get(sheet_id)
+        if title is None:
+            return
+        for gram in self._iter_grams(title):
+            gram_set = self._gram_dict.get(gram)
+            if gram_set is not None:
+                gram_set.discard(sheet_id)
+
+    def _unlink_from_parent(self, sheet_id):
+        if sheet_id not in self._parent_dict:
+            return
+        sibling_set = self._children_dict.get(self._parent_dict[sheet_id])
+        if sibling_set is not None:
+            sibling_set.discard(sheet_id)
+
+    def _iter_grams(self, text):
+        size = self.gram_size
+        for i in range(0, len(text) - size + 1):
+            yield text[i:i + size]
@@ -3,7 +3,9 @@ Created on 8 mai 2015
 
 @author:  Cyril Jacquet
 '''
-from PyQt5.QtWidgets import QTreeView, QMenu
+from PyQt5.QtWidgets import QTreeView, QMenu, QAbstractItemView
+from PyQt5.QtGui import QKeySequence, QDrag
+from PyQt5.QtCore import Qt
 from gui import cfg
 
 
@@ -24,6 +26,13 @@ class WriteTreeView(QTreeView):
         self.setEditTriggers(QTreeView.NoEditTriggers)
         self.setExpandsOnDoubleClick(False)
 
+        # drag and drop :
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setDragEnabled(True)
+        self.setAcceptDrops(True)
+        self.setDropIndicatorShown(True)
+        self.setDragDropMode(QAbstractItemView.InternalMove)
+
         self.old_index = None
         self.clicked.connect(self.itemClicked)
 
@@ -32,6 +41,43 @@ class WriteTreeView(QTreeView):
     def _init_actions(self):
         pass
 
+    def setModel(self, model):
+        QTreeView.setModel(self, model)
+        self.selectionModel().selectionChanged.connect(self._publish_selection)
+
+    def _publish_selection(self):
+        # for the docks working on several sheets, like the properties dock
+        sheet_ids = [index.data(37) for index in self.selectionModel().selectedRows()]
+        cfg.core.write_panel_core.set_selected_sheet_ids(sheet_ids)
+
+    def set_undo_stack(self, undo_stack):
+        '''
+        function:: set_undo_stack(undo_stack)
+        :param undo_stack: QUndoStack of the model, to undo the moves
+        '''
+        undo_action = undo_stack.createUndoAction(self)
+        undo_action.setShortcut(QKeySequence.Undo)
+        undo_action.setShortcutContext(Qt.WidgetShortcut)
+        self.addAction(undo_action)
+        redo_action = undo_stack.createRedoAction(self)
+        redo_action.setShortcut(QKeySequence.Redo)
+        redo_action.setShortcutContext(Qt.WidgetShortcut)
+        self.addAction(redo_action)
+
+    def startDrag(self, supported_actions):
+        # like QAbstractItemView.startDrag(), without removing the dragged
+        # rows after the drop : the model has already moved the sheets
+        index_list = [index for index in self.selectedIndexes()
+                      if self.model().flags(index) & Qt.ItemIsDragEnabled]
+        if index_list == []:
+            return
+        mime_data = self.model().mimeData(index_list)
+        if mime_data is None:
+            return
+        drag = QDrag(self)
+        drag.setMimeData(mime_data)
+        drag.exec_(supported_actions, Qt.MoveAction)
+
     def itemClicked(self, index):
 
         if index != self._old_index:  # reset if change
@@ -61,6 +107,17 @@ class WriteTreeView(QTreeView):
         menu = QMenu(self)
         attachAction = menu.addAction(_("Add sheet"))
         attachAction.triggered.connect(self.add_sheet)
+        if self.selectionModel().selectedRows() != []:
+            remove_action = menu.addAction(_("Remove sheet"))
+            remove_action.triggered.connect(self.remove_sheets)
+        if hasattr(self.model(), "sort_by_property"):
+            sort_menu = menu.addMenu(_("Sort by"))
+            sort_action = sort_menu.addAction(_("Stored order"))
+            sort_action.triggered.connect(lambda: self.model().sort_by_property(None))
+            for key in sorted(self.model().property_keys()):
+                sort_action = sort_menu.addAction(key)
+                sort_action.triggered.connect(
+                    lambda checked, key=key: self.model().sort_by_property(key))
         menu.exec_(self.mapToGlobal(event.pos()))
 
         return QTreeView.contextMenuEvent(self, event)
@@ -74,3 +131,10 @@ class WriteTreeView(QTreeView):
         # temp :
         self.expandAll()
         self.edit(index)
+
+    def remove_sheets(self):
+        sheet_ids = [index.data(37) for index in self.selectionModel().selectedRows()]
+        model = self.model()
+        if hasattr(model, "sourceModel"):
+            model = model.sourceModel()
+        model.remove_sheets(sheet_ids)